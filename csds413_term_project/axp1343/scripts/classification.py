@@ -6,8 +6,7 @@ Trains classifiers on stylometric features and validates using permutation tests
 """
 
 import pandas as pd
-import numpy as np
-from sklearn.model_selection import train_test_split, cross_val_score
+from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
 from sklearn.svm import SVC
 from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier
@@ -15,16 +14,27 @@ from sklearn.linear_model import LogisticRegression
 from sklearn.neural_network import MLPClassifier
 from sklearn.naive_bayes import GaussianNB
 from sklearn.neighbors import KNeighborsClassifier
-from sklearn.metrics import classification_report, confusion_matrix, accuracy_score
-from sklearn.metrics import precision_recall_fscore_support
+from sklearn.metrics import classification_report, confusion_matrix
 import matplotlib.pyplot as plt
 import seaborn as sns
 import warnings
+from csds413_term_project.permutation import make_progress_printer
+from csds413_term_project.classifier_permutation import classifier_permutation_test, closed_form_scorer
+from csds413_term_project.feature_store import load_features
+from csds413_term_project.evaluation import make_folds, run_evaluation
+from csds413_term_project.model_registry import (
+    ModelBundle, ModelRegistry, content_hash, fit_transformer, params_fingerprint
+)
+from csds413_term_project import instrumentation
+from csds413_term_project.instrumentation import span
 warnings.filterwarnings('ignore')
 
+# Set CSDS413_PROFILE=<trace.json> to print per-step timings and write a Chrome trace
+instrumentation.enable_from_env()
+
 # Load data
 print("Loading data...")
-df = pd.read_csv('data/tweepfake_features.csv', sep=';')
+df = load_features('data/tweepfake_features.csv')
 
 # Prepare features and labels
 features = ['V', 'S', 'W', 'F', 'C']
@@ -40,9 +50,13 @@ X_train, X_test, y_train, y_test = train_test_split(
     X, y, test_size=0.2, random_state=42, stratify=y
 )
 
+# Fitted models are cached by a hash of their data and hyperparameters, so
+# re-running on unchanged data reloads them instead of retraining
+registry = ModelRegistry('models')
+
 # Standardize features
-scaler = StandardScaler()
-X_train_scaled = scaler.fit_transform(X_train)
+scaler = fit_transformer(registry, StandardScaler(), X_train)
+X_train_scaled = scaler.transform(X_train)
 X_test_scaled = scaler.transform(X_test)
 
 print(f"\nTraining set: {len(X_train)} samples")
@@ -66,42 +80,25 @@ print("\n" + "="*80)
 print("CLASSIFICATION RESULTS")
 print("="*80)
 
+# Every classifier is fit on the training set and on each CV fold in one
+# parallel pass; the fitted models are reused below
+folds = make_folds(y_train, n_splits=5)
+evaluations = run_evaluation(classifiers, X_train_scaled, y_train, X_test_scaled, y_test, folds,
+                             registry=registry)
+
 results = []
 
-for name, clf in classifiers.items():
+for name, evaluation in evaluations.items():
     print(f"\n{name}:")
     print("-" * 60)
     
-    # Train
-    clf.fit(X_train_scaled, y_train)
-    
-    # Predict
-    y_pred = clf.predict(X_test_scaled)
+    print(f"  Accuracy:  {evaluation.accuracy:.4f}")
+    print(f"  Precision: {evaluation.precision:.4f}")
+    print(f"  Recall:    {evaluation.recall:.4f}")
+    print(f"  F1-Score:  {evaluation.f1:.4f}")
+    print(f"  CV Accuracy: {evaluation.cv_scores.mean():.4f} (+/- {evaluation.cv_scores.std():.4f})")
     
-    # Metrics
-    accuracy = accuracy_score(y_test, y_pred)
-    precision, recall, f1, _ = precision_recall_fscore_support(
-        y_test, y_pred, average='binary'
-    )
-    
-    print(f"  Accuracy:  {accuracy:.4f}")
-    print(f"  Precision: {precision:.4f}")
-    print(f"  Recall:    {recall:.4f}")
-    print(f"  F1-Score:  {f1:.4f}")
-    
-    # Cross-validation
-    cv_scores = cross_val_score(clf, X_train_scaled, y_train, cv=5)
-    print(f"  CV Accuracy: {cv_scores.mean():.4f} (+/- {cv_scores.std():.4f})")
-    
-    results.append({
-        'Classifier': name,
-        'Accuracy': accuracy,
-        'Precision': precision,
-        'Recall': recall,
-        'F1': f1,
-        'CV_Mean': cv_scores.mean(),
-        'CV_Std': cv_scores.std()
-    })
+    results.append({'Classifier': name, **evaluation.summary()})
 
 # Results table
 results_df = pd.DataFrame(results)
@@ -116,40 +113,40 @@ print("PERMUTATION TEST (Statistical Validation)")
 print("="*80)
 
 best_clf_name = results_df.loc[results_df['Accuracy'].idxmax(), 'Classifier']
-best_clf = classifiers[best_clf_name]
-
-print(f"\nTesting: {best_clf_name}")
-print("Running 1000 permutations...")
-
-# Permutation test
-n_permutations = 1000
-permutation_scores = []
+best_clf = evaluations[best_clf_name].estimator
 
-for i in range(n_permutations):
-    # Shuffle labels
-    y_train_permuted = np.random.permutation(y_train)
-    
-    # Train on permuted data
-    clf_perm = type(best_clf)(**best_clf.get_params())
-    clf_perm.fit(X_train_scaled, y_train_permuted)
-    
-    # Test on real test set
-    score = clf_perm.score(X_test_scaled, y_test)
-    permutation_scores.append(score)
-    
-    if (i + 1) % 100 == 0:
-        print(f"  Completed {i + 1}/{n_permutations} permutations")
+# Store the winner with its scaler so it can score new tweets
+bundle_key = content_hash('bundle', params_fingerprint(best_clf), X_train, y_train)
+registry.save(bundle_key, ModelBundle(best_clf, scaler, feature_names=features))
+registry.tag('classification', bundle_key)
 
-permutation_scores = np.array(permutation_scores)
+print(f"\nTesting: {best_clf_name}")
 
-# Calculate p-value
-real_score = best_clf.score(X_test_scaled, y_test)
-p_value = (permutation_scores >= real_score).sum() / n_permutations
+# Models refit in closed form (Naive Bayes) can afford 10k permutations
+closed_form = closed_form_scorer(best_clf) is not None
+n_permutations = 10000 if closed_form else 1000
+chunk_size = 500 if closed_form else 10
+print(f"Running {n_permutations} permutations...")
+
+# Permutation test (chunks of permutations run across all cores; each chunk has
+# its own seeded generator, so the scores don't depend on the number of workers)
+perm_key = content_hash('permutation', params_fingerprint(best_clf), X_train_scaled, y_train,
+                        X_test_scaled, y_test, n_permutations, chunk_size, 42)
+perm_result = registry.get_or_create(perm_key, lambda: classifier_permutation_test(
+    best_clf, X_train_scaled, y_train, X_test_scaled, y_test,
+    n_permutations=n_permutations, seed=42, n_workers=None, chunk_size=chunk_size,
+    progress=make_progress_printer(every=n_permutations // 10)
+))
+real_score = perm_result.observed
+permutation_scores = perm_result.null_distribution
+p_value = perm_result.p_value
 
 print(f"\nReal model accuracy: {real_score:.4f}")
 print(f"Mean permuted accuracy: {permutation_scores.mean():.4f}")
 print(f"Std permuted accuracy: {permutation_scores.std():.4f}")
 print(f"p-value: {p_value:.4f}")
+print(f"Permutation time: {perm_result.timing['total_seconds']:.1f}s "
+      f"({perm_result.timing['permutations_per_second']:.1f} permutations/s, {perm_result.timing['method']})")
 
 if p_value < 0.05:
     print("✓ Model is significantly better than chance (p < 0.05)")
@@ -170,15 +167,16 @@ axes[0].legend()
 axes[0].grid(True, alpha=0.3)
 
 # Confusion matrix
-cm = confusion_matrix(y_test, best_clf.predict(X_test_scaled))
+cm = confusion_matrix(y_test, evaluations[best_clf_name].y_pred)
 sns.heatmap(cm, annot=True, fmt='d', cmap='Blues', ax=axes[1],
             xticklabels=['Human', 'Bot'], yticklabels=['Human', 'Bot'])
 axes[1].set_xlabel('Predicted')
 axes[1].set_ylabel('Actual')
 axes[1].set_title(f'Confusion Matrix - {best_clf_name}')
 
-plt.tight_layout()
-plt.savefig('visuals/classification_results.png', dpi=300, bbox_inches='tight')
+with span('plot.classification_results'):
+    plt.tight_layout()
+    plt.savefig('visuals/classification_results.png', dpi=300, bbox_inches='tight')
 print("\n✓ Visualization saved as 'classification_results.png'")
 plt.show()
 
@@ -200,8 +198,9 @@ if any(model_type in best_clf_name for model_type in ['Random Forest', 'Gradient
     plt.xlabel('Features')
     plt.ylabel('Importance')
     plt.xticks(rotation=45)
-    plt.tight_layout()
-    plt.savefig('visuals/feature_importance.png', dpi=300, bbox_inches='tight')
+    with span('plot.feature_importance'):
+        plt.tight_layout()
+        plt.savefig('visuals/feature_importance.png', dpi=300, bbox_inches='tight')
     plt.show()
     print("✓ Feature importance plot saved as 'feature_importance.png'")
 
@@ -212,3 +211,5 @@ print("\n✓ Results saved to 'classification_results.csv'")
 print("\n" + "="*80)
 print("CLASSIFICATION COMPLETE")
 print("="*80)
+
+instrumentation.report()
@@ -3,7 +3,6 @@ Author: Aishani Patil
 Clustering Analysis with t-SNE and PCA Visualization
 """
 
-import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 from sklearn.preprocessing import StandardScaler
@@ -12,10 +11,16 @@ from sklearn.manifold import TSNE
 from sklearn.cluster import KMeans
 from mpl_toolkits.mplot3d import Axes3D
 import seaborn as sns
+from csds413_term_project.feature_store import load_features
+from csds413_term_project import instrumentation
+from csds413_term_project.instrumentation import span
+
+# Set CSDS413_PROFILE=<trace.json> to print per-step timings and write a Chrome trace
+instrumentation.enable_from_env()
 
 # Load data
 print("Loading data...")
-df = pd.read_csv('data/tweepfake_features.csv', sep=';')
+df = load_features('data/tweepfake_features.csv')
 
 features = ['V', 'S', 'W', 'F', 'C']
 X = df[features].values
@@ -25,8 +30,9 @@ print(f"Dataset: {len(X)} samples")
 print(f"Features: {features}")
 
 # Standardize features
-scaler = StandardScaler()
-X_scaled = scaler.fit_transform(X)
+with span('scale', rows=len(X)):
+    scaler = StandardScaler()
+    X_scaled = scaler.fit_transform(X)
 
 # ============================================================================
 # K-MEANS CLUSTERING
@@ -36,7 +42,8 @@ print("K-MEANS CLUSTERING")
 print("="*80)
 
 kmeans = KMeans(n_clusters=2, random_state=42, n_init=10)
-cluster_labels = kmeans.fit_predict(X_scaled)
+with span('fit.KMeans', rows=len(X_scaled)):
+    cluster_labels = kmeans.fit_predict(X_scaled)
 
 # Compare clusters to true labels
 from sklearn.metrics import adjusted_rand_score, normalized_mutual_info_score
@@ -57,7 +64,8 @@ print("PCA - 2D PROJECTION")
 print("="*80)
 
 pca_2d = PCA(n_components=2, random_state=42)
-X_pca_2d = pca_2d.fit_transform(X_scaled)
+with span('fit.PCA_2d', rows=len(X_scaled)):
+    X_pca_2d = pca_2d.fit_transform(X_scaled)
 
 print(f"Explained variance: {pca_2d.explained_variance_ratio_}")
 print(f"Total variance explained: {pca_2d.explained_variance_ratio_.sum():.4f}")
@@ -70,7 +78,8 @@ print("PCA - 3D PROJECTION")
 print("="*80)
 
 pca_3d = PCA(n_components=3, random_state=42)
-X_pca_3d = pca_3d.fit_transform(X_scaled)
+with span('fit.PCA_3d', rows=len(X_scaled)):
+    X_pca_3d = pca_3d.fit_transform(X_scaled)
 
 print(f"Explained variance: {pca_3d.explained_variance_ratio_}")
 print(f"Total variance explained: {pca_3d.explained_variance_ratio_.sum():.4f}")
@@ -84,7 +93,8 @@ print("="*80)
 print("Computing t-SNE (this may take a minute)...")
 
 tsne_2d = TSNE(n_components=2, random_state=42, perplexity=30)
-X_tsne_2d = tsne_2d.fit_transform(X_scaled)
+with span('fit.TSNE_2d', rows=len(X_scaled)):
+    X_tsne_2d = tsne_2d.fit_transform(X_scaled)
 
 print("✓ t-SNE 2D complete")
 
@@ -97,7 +107,8 @@ print("="*80)
 print("Computing t-SNE 3D (this may take a minute)...")
 
 tsne_3d = TSNE(n_components=3, random_state=42, perplexity=30)
-X_tsne_3d = tsne_3d.fit_transform(X_scaled)
+with span('fit.TSNE_3d', rows=len(X_scaled)):
+    X_tsne_3d = tsne_3d.fit_transform(X_scaled)
 
 print("✓ t-SNE 3D complete")
 
@@ -171,8 +182,9 @@ axes[1, 1].legend(handles=[
 ])
 axes[1, 1].grid(True, alpha=0.3)
 
-plt.tight_layout()
-plt.savefig('visuals/clustering_2d.png', dpi=300, bbox_inches='tight')
+with span('plot.clustering_2d'):
+    plt.tight_layout()
+    plt.savefig('visuals/clustering_2d.png', dpi=300, bbox_inches='tight')
 print("✓ 2D visualizations saved as 'clustering_2d.png'")
 plt.show()
 
@@ -215,8 +227,9 @@ ax2.legend(handles=[
                markersize=10, label='Human')
 ])
 
-plt.tight_layout()
-plt.savefig('visuals/clustering_3d.png', dpi=300, bbox_inches='tight')
+with span('plot.clustering_3d'):
+    plt.tight_layout()
+    plt.savefig('visuals/clustering_3d.png', dpi=300, bbox_inches='tight')
 print("✓ 3D visualizations saved as 'clustering_3d.png'")
 plt.show()
 
@@ -234,4 +247,6 @@ print(f"  2D variance explained: {pca_2d.explained_variance_ratio_.sum():.4f}")
 print(f"  3D variance explained: {pca_3d.explained_variance_ratio_.sum():.4f}")
 print(f"\nFiles saved:")
 print(f"  - clustering_2d.png (4 subplots)")
-print(f"  - clustering_3d.png (2 3D plots)")
\ No newline at end of file
+print(f"  - clustering_3d.png (2 3D plots)")
+
+instrumentation.report()
@@ -6,8 +6,7 @@ Uses the best quadratic and interaction features identified through feature sele
 """
 
 import pandas as pd
-import numpy as np
-from sklearn.model_selection import train_test_split, cross_val_score
+from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler, PolynomialFeatures
 from sklearn.svm import SVC
 from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier
@@ -15,16 +14,27 @@ from sklearn.linear_model import LogisticRegression
 from sklearn.neural_network import MLPClassifier
 from sklearn.naive_bayes import GaussianNB
 from sklearn.neighbors import KNeighborsClassifier
-from sklearn.metrics import classification_report, confusion_matrix, accuracy_score
-from sklearn.metrics import precision_recall_fscore_support
+from sklearn.metrics import classification_report, confusion_matrix
 import matplotlib.pyplot as plt
 import seaborn as sns
 import warnings
+from csds413_term_project.permutation import make_progress_printer
+from csds413_term_project.classifier_permutation import classifier_permutation_test, closed_form_scorer
+from csds413_term_project.feature_store import load_features
+from csds413_term_project.evaluation import make_folds, run_evaluation
+from csds413_term_project.model_registry import (
+    ModelBundle, ModelRegistry, content_hash, fit_transformer, params_fingerprint
+)
+from csds413_term_project import instrumentation
+from csds413_term_project.instrumentation import span
 warnings.filterwarnings('ignore')
 
+# Set CSDS413_PROFILE=<trace.json> to print per-step timings and write a Chrome trace
+instrumentation.enable_from_env()
+
 # Load data
 print("Loading data...")
-df = pd.read_csv('data/tweepfake_features.csv', sep=';')
+df = load_features('data/tweepfake_features.csv')
 
 # Prepare features and labels
 original_features = ['V', 'S', 'W', 'F', 'C']
@@ -40,14 +50,19 @@ X_train_orig, X_test_orig, y_train, y_test = train_test_split(
     X_original, y, test_size=0.2, random_state=42, stratify=y
 )
 
+# Fitted models are cached by a hash of their data and hyperparameters, so
+# re-running on unchanged data reloads them instead of retraining
+registry = ModelRegistry('models')
+
 # Standardize original features
-scaler = StandardScaler()
-X_train_scaled = scaler.fit_transform(X_train_orig)
+scaler = fit_transformer(registry, StandardScaler(), X_train_orig)
+X_train_scaled = scaler.transform(X_train_orig)
 X_test_scaled = scaler.transform(X_test_orig)
 
 # Create polynomial features
-poly = PolynomialFeatures(degree=2, include_bias=False, interaction_only=False)
-X_train_poly = poly.fit_transform(X_train_scaled)
+poly = fit_transformer(registry, PolynomialFeatures(degree=2, include_bias=False, interaction_only=False),
+                       X_train_scaled)
+X_train_poly = poly.transform(X_train_scaled)
 X_test_poly = poly.transform(X_test_scaled)
 
 # Get all feature names
@@ -89,55 +104,41 @@ classifiers = {
     'K-Nearest Neighbors': KNeighborsClassifier(n_neighbors=5)
 }
 
+# Stratified CV folds, shared by both feature sets
+folds = make_folds(y_train, n_splits=5)
+
 # Function to evaluate classifiers
 def evaluate_classifiers(X_train, X_test, feature_set_name):
     print(f"\n{'='*80}")
     print(f"CLASSIFICATION RESULTS - {feature_set_name}")
     print(f"{'='*80}")
     
+    # Test metrics and CV scores of all classifiers in one parallel pass
+    evaluations = run_evaluation(classifiers, X_train, y_train, X_test, y_test, folds,
+                                 registry=registry)
+    
     results = []
     
-    for name, clf in classifiers.items():
+    for name, evaluation in evaluations.items():
         print(f"\n{name}:")
         print("-" * 60)
         
-        # Train
-        clf.fit(X_train, y_train)
-        
-        # Predict
-        y_pred = clf.predict(X_test)
-        
-        # Metrics
-        accuracy = accuracy_score(y_test, y_pred)
-        precision, recall, f1, _ = precision_recall_fscore_support(
-            y_test, y_pred, average='binary'
-        )
+        print(f"  Accuracy:  {evaluation.accuracy:.4f}")
+        print(f"  Precision: {evaluation.precision:.4f}")
+        print(f"  Recall:    {evaluation.recall:.4f}")
+        print(f"  F1-Score:  {evaluation.f1:.4f}")
+        print(f"  CV Accuracy: {evaluation.cv_scores.mean():.4f} (+/- {evaluation.cv_scores.std():.4f})")
         
-        print(f"  Accuracy:  {accuracy:.4f}")
-        print(f"  Precision: {precision:.4f}")
-        print(f"  Recall:    {recall:.4f}")
-        print(f"  F1-Score:  {f1:.4f}")
-        
-        # Cross-validation
-        cv_scores = cross_val_score(clf, X_train, y_train, cv=5)
-        print(f"  CV Accuracy: {cv_scores.mean():.4f} (+/- {cv_scores.std():.4f})")
-        
-        results.append({
-            'Classifier': name,
-            'Feature_Set': feature_set_name,
-            'Accuracy': accuracy,
-            'Precision': precision,
-            'Recall': recall,
-            'F1': f1,
-            'CV_Mean': cv_scores.mean(),
-            'CV_Std': cv_scores.std()
-        })
+        results.append({'Classifier': name, 'Feature_Set': feature_set_name,
+                        **evaluation.summary()})
     
-    return results
+    return results, evaluations
 
 # Evaluate both feature sets
-original_results = evaluate_classifiers(X_train_original, X_test_original, "Original Features")
-enhanced_results = evaluate_classifiers(X_train_enhanced, X_test_enhanced, "Enhanced Features")
+original_results, original_evaluations = evaluate_classifiers(
+    X_train_original, X_test_original, "Original Features")
+enhanced_results, enhanced_evaluations = evaluate_classifiers(
+    X_train_enhanced, X_test_enhanced, "Enhanced Features")
 
 # Combine results
 all_results = original_results + enhanced_results
@@ -189,9 +190,8 @@ if any(model_type in best_enhanced_clf_name for model_type in ['Random Forest',
     print(f"FEATURE IMPORTANCE - {best_enhanced_clf_name}")
     print(f"{'='*80}")
     
-    # Retrain the best model to get feature importance
-    best_clf = classifiers[best_enhanced_clf_name]
-    best_clf.fit(X_train_enhanced, y_train)
+    # Reuse the model fitted during evaluation
+    best_clf = enhanced_evaluations[best_enhanced_clf_name].estimator
     
     importances = best_clf.feature_importances_
     feature_importance_df = pd.DataFrame({
@@ -241,8 +241,9 @@ else:
     type_counts.plot(kind='pie', ax=axes[1, 1], autopct='%1.1f%%')
     axes[1, 1].set_title('Selected Feature Type Distribution')
 
-plt.tight_layout()
-plt.savefig('visuals/enhanced_classification_results.png', dpi=300, bbox_inches='tight')
+with span('plot.enhanced_classification_results'):
+    plt.tight_layout()
+    plt.savefig('visuals/enhanced_classification_results.png', dpi=300, bbox_inches='tight')
 print(f"\n✓ Visualization saved as 'enhanced_classification_results.png'")
 plt.show()
 
@@ -251,33 +252,40 @@ print(f"\n{'='*80}")
 print("PERMUTATION TEST - BEST ENHANCED MODEL")
 print(f"{'='*80}")
 
-best_clf = classifiers[best_enhanced_clf_name]
-best_clf.fit(X_train_enhanced, y_train)
-
-print(f"Testing: {best_enhanced_clf_name} with Enhanced Features")
-print("Running 1000 permutations...")
+best_clf = enhanced_evaluations[best_enhanced_clf_name].estimator
 
-n_permutations = 1000
-permutation_scores = []
+# Store the winner with the scaler and polynomial expansion so it can score new tweets
+bundle_key = content_hash('bundle', params_fingerprint(best_clf), X_train_orig, y_train,
+                          selected_indices)
+registry.save(bundle_key, ModelBundle(best_clf, scaler, poly, selected_indices, selected_features))
+registry.tag('enhanced_classification', bundle_key)
 
-for i in range(n_permutations):
-    y_train_permuted = np.random.permutation(y_train)
-    clf_perm = type(best_clf)(**best_clf.get_params())
-    clf_perm.fit(X_train_enhanced, y_train_permuted)
-    score = clf_perm.score(X_test_enhanced, y_test)
-    permutation_scores.append(score)
-    
-    if (i + 1) % 200 == 0:
-        print(f"  Completed {i + 1}/{n_permutations} permutations")
+print(f"Testing: {best_enhanced_clf_name} with Enhanced Features")
 
-permutation_scores = np.array(permutation_scores)
-real_score = best_clf.score(X_test_enhanced, y_test)
-p_value = (permutation_scores >= real_score).sum() / n_permutations
+# Models refit in closed form (Naive Bayes) can afford 10k permutations
+closed_form = closed_form_scorer(best_clf) is not None
+n_permutations = 10000 if closed_form else 1000
+chunk_size = 500 if closed_form else 10
+print(f"Running {n_permutations} permutations...")
+
+# Chunks run across all cores with their own seeded generators
+perm_key = content_hash('permutation', params_fingerprint(best_clf), X_train_enhanced, y_train,
+                        X_test_enhanced, y_test, n_permutations, chunk_size, 42)
+perm_result = registry.get_or_create(perm_key, lambda: classifier_permutation_test(
+    best_clf, X_train_enhanced, y_train, X_test_enhanced, y_test,
+    n_permutations=n_permutations, seed=42, n_workers=None, chunk_size=chunk_size,
+    progress=make_progress_printer(every=n_permutations // 10)
+))
+real_score = perm_result.observed
+permutation_scores = perm_result.null_distribution
+p_value = perm_result.p_value
 
 print(f"\nReal model accuracy: {real_score:.4f}")
 print(f"Mean permuted accuracy: {permutation_scores.mean():.4f}")
 print(f"Std permuted accuracy: {permutation_scores.std():.4f}")
 print(f"p-value: {p_value:.4f}")
+print(f"Permutation time: {perm_result.timing['total_seconds']:.1f}s "
+      f"({perm_result.timing['permutations_per_second']:.1f} permutations/s, {perm_result.timing['method']})")
 
 if p_value < 0.05:
     print("✓ Enhanced model is significantly better than chance (p < 0.05)")
@@ -306,4 +314,6 @@ print(f"- Performance change: {best_enhanced['Accuracy'] - best_original['Accura
 improvements = (accuracy_comp['Improvement'] > 0).sum()
 total_models = len(accuracy_comp)
 print(f"- Models improved: {improvements}/{total_models}")
-print(f"- Average accuracy improvement: {accuracy_comp['Improvement'].mean():.4f}")
\ No newline at end of file
+print(f"- Average accuracy improvement: {accuracy_comp['Improvement'].mean():.4f}")
+
+instrumentation.report()
@@ -17,10 +17,16 @@ from sklearn.metrics import accuracy_score
 import matplotlib.pyplot as plt
 import seaborn as sns
 from itertools import combinations
+from csds413_term_project.feature_store import load_features
+from csds413_term_project import instrumentation
+from csds413_term_project.instrumentation import span
+
+# Set CSDS413_PROFILE=<trace.json> to print per-step timings and write a Chrome trace
+instrumentation.enable_from_env()
 
 # Load data
 print("Loading data...")
-df = pd.read_csv('data/tweepfake_features.csv', sep=';')
+df = load_features('data/tweepfake_features.csv')
 
 # Prepare features and labels
 original_features = ['V', 'S', 'W', 'F', 'C']
@@ -37,9 +43,10 @@ X_train_orig, X_test_orig, y_train, y_test = train_test_split(
 )
 
 # Standardize original features
-scaler_orig = StandardScaler()
-X_train_scaled = scaler_orig.fit_transform(X_train_orig)
-X_test_scaled = scaler_orig.transform(X_test_orig)
+with span('scale', rows=len(X_train_orig)):
+    scaler_orig = StandardScaler()
+    X_train_scaled = scaler_orig.fit_transform(X_train_orig)
+    X_test_scaled = scaler_orig.transform(X_test_orig)
 
 print(f"\nTraining set: {len(X_train_scaled)} samples")
 print(f"Test set: {len(X_test_scaled)} samples")
@@ -49,9 +56,10 @@ print("\n" + "="*80)
 print("GENERATING POLYNOMIAL FEATURES")
 print("="*80)
 
-poly = PolynomialFeatures(degree=2, include_bias=False, interaction_only=False)
-X_train_poly = poly.fit_transform(X_train_scaled)
-X_test_poly = poly.transform(X_test_scaled)
+with span('expand.polynomial', rows=len(X_train_scaled)):
+    poly = PolynomialFeatures(degree=2, include_bias=False, interaction_only=False)
+    X_train_poly = poly.fit_transform(X_train_scaled)
+    X_test_poly = poly.transform(X_test_scaled)
 
 # Get feature names
 feature_names = poly.get_feature_names_out(original_features)
@@ -260,8 +268,9 @@ for bar, score in zip(bars, scores):
     axes[1, 1].text(bar.get_x() + bar.get_width()/2, bar.get_height() + 0.005,
                    f'{score:.4f}', ha='center', va='bottom')
 
-plt.tight_layout()
-plt.savefig('visuals/feature_engineering_analysis.png', dpi=300, bbox_inches='tight')
+with span('plot.feature_engineering_analysis'):
+    plt.tight_layout()
+    plt.savefig('visuals/feature_engineering_analysis.png', dpi=300, bbox_inches='tight')
 print("\n✓ Visualization saved as 'feature_engineering_analysis.png'")
 plt.show()
 
@@ -295,4 +304,6 @@ print(f"- Generated {len(feature_names)} total features from {len(original_featu
 print(f"- Recommended {len(recommended_features)} features for classification")
 print(f"- Performance improvement: {enhanced_score - baseline_score:.4f}")
 print(f"- Best quadratic features: {top_quadratic['Feature'].tolist()}")
-print(f"- Best interaction features: {top_interaction['Feature'].tolist()}")
\ No newline at end of file
+print(f"- Best interaction features: {top_interaction['Feature'].tolist()}")
+
+instrumentation.report()
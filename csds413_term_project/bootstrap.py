@@ -0,0 +1,543 @@
+'''
+Bootstrap and jackknife confidence intervals for group means, their
+difference and Cohen's d, for every feature at once.
+
+The bootstrap resamples each group separately, keeping the group sizes. A
+block of resamples is drawn as one matrix of row indices per group, which is
+turned into a matrix of counts, so the resampled sums and sums of squares of
+all features come out of one matrix product. Blocks are sized to a memory
+budget. The jackknife needs no refitting: the leave-one-out means and variances
+follow from the full-sample moments in closed form, so all n leave-one-out
+estimates are computed in blocks of rows.
+
+Intervals are percentile, BCa (bias-corrected and accelerated, with the
+acceleration from the jackknife) or normal intervals from the jackknife
+standard error.
+
+For data that does not fit in memory, StreamingBootstrap takes the rows chunk
+by chunk. Every row gets an independent Poisson(1) weight in every resample,
+which approximates the multinomial resampling counts, and the weighted moments
+of the chunks are merged Welford-style. Accumulators of disjoint chunks can be
+merged, e.g. across processes.
+
+:author: Jacob Anderson
+:version: 0.1.0
+'''
+
+from typing import Callable, NamedTuple
+import numpy as np
+from scipy import stats
+from csds413_term_project.instrumentation import span
+
+STATISTICS = ('mean1', 'mean2', 'mean_diff', 'cohens_d')
+
+METHODS = ('bca', 'percentile', 'jackknife')
+
+class ConfidenceInterval(NamedTuple):
+    '''
+    Estimate, interval bounds and standard error of one statistic, with one
+    entry per feature.
+    '''
+    estimate: np.ndarray
+    lower: np.ndarray
+    upper: np.ndarray
+    standard_error: np.ndarray
+
+class JackknifeResult(NamedTuple):
+    '''
+    Jackknife standard errors and BCa accelerations, as dicts mapping each
+    statistic name to one entry per feature.
+    '''
+    standard_error: dict
+    acceleration: dict
+
+def merge_moments(count_a: np.ndarray, mean_a: np.ndarray, m2_a: np.ndarray,
+                  count_b: np.ndarray, mean_b: np.ndarray, m2_b: np.ndarray) -> tuple:
+    '''
+    Merges the counts, means and sums of squared deviations of two disjoint
+    sets of rows (Chan et al.'s parallel form of Welford's update). Arrays
+    broadcast, and counts may be zero.
+
+    :returns: Tuple count, mean, sum of squared deviations
+    :rtype: tuple
+    '''
+    count = count_a + count_b
+    safe_count = np.where(count > 0, count, 1)
+    delta = mean_b - mean_a
+    mean = mean_a + delta * (count_b / safe_count)
+    m2 = m2_a + m2_b + delta**2 * (count_a * count_b / safe_count)
+    return count, mean, m2
+
+def effect_sizes(n1, mean1: np.ndarray, var1: np.ndarray,
+                 n2, mean2: np.ndarray, var2: np.ndarray) -> dict:
+    '''
+    Computes the group means, their difference and Cohen's d with the pooled
+    standard deviation, as sufficient_stats.cohens_d does. Arguments broadcast.
+
+    :returns: Dict mapping each name in STATISTICS to its values
+    :rtype: dict
+    '''
+    pooled_std = np.sqrt(((n1 - 1) * var1 + (n2 - 1) * var2) / (n1 + n2 - 2))
+    mean_diff = mean1 - mean2
+    return {'mean1': mean1, 'mean2': mean2, 'mean_diff': mean_diff,
+            'cohens_d': mean_diff / pooled_std}
+
+def _split_groups(X: np.ndarray, in_group1: np.ndarray) -> tuple:
+    X = np.asarray(X, dtype=float)
+    in_group1 = np.asarray(in_group1, dtype=bool)
+    return X[in_group1], X[~in_group1]
+
+def sample_effect_sizes(X: np.ndarray, in_group1: np.ndarray) -> dict:
+    '''
+    Computes the statistics on the full sample.
+
+    :param X: Feature matrix of shape (n_samples, n_features)
+    :type X: np.ndarray
+    :param in_group1: Boolean array marking group 1
+    :type in_group1: np.ndarray
+    :returns: Dict mapping each name in STATISTICS to one value per feature
+    :rtype: dict
+    '''
+    group1, group2 = _split_groups(X, in_group1)
+    return effect_sizes(len(group1), group1.mean(axis=0), group1.var(axis=0, ddof=1),
+                        len(group2), group2.mean(axis=0), group2.var(axis=0, ddof=1))
+
+def compute_block_size(n_rows: int, max_block_mb: float = 32.0) -> int:
+    '''
+    Computes how many resamples fit in one block under a memory budget. Each
+    resample of a group holds its int32 row indices and its counts as floats.
+
+    :param n_rows: Number of rows in the larger group
+    :type n_rows: int
+    :param max_block_mb: Memory budget for a block in megabytes
+    :type max_block_mb: float
+    :returns: Number of resamples per block
+    :rtype: int
+    '''
+    bytes_per_resample = n_rows * (4 + 8)
+    return max(1, int(max_block_mb * 2**20) // bytes_per_resample)
+
+def _resampled_moments(centered: np.ndarray, center: np.ndarray, n_resamples: int,
+                       rng: np.random.Generator) -> tuple:
+    '''
+    Draws resamples of one group as an index matrix and computes the mean and
+    variance of every feature in every resample.
+
+    :param centered: Group rows minus the group mean, followed by their squares
+    :type centered: np.ndarray
+    :param center: Group mean
+    :type center: np.ndarray
+    :returns: Tuple means, variances, each of shape (n_resamples, n_features)
+    :rtype: tuple
+    '''
+    n = len(centered)
+    indices = rng.integers(0, n, size=(n_resamples, n), dtype=np.int32)
+
+    # One bincount per resample keeps the scattered increments within a row
+    counts = np.empty((n_resamples, n))
+    for row, resample in zip(counts, indices):
+        row[:] = np.bincount(resample, minlength=n)
+
+    sums, squares = np.hsplit(counts @ centered, 2)
+    return center + sums / n, (squares - sums**2 / n) / (n - 1)
+
+def bootstrap_replicates(X: np.ndarray, in_group1: np.ndarray, n_resamples: int = 2000,
+                         seed: int = None, block_size: int = None,
+                         max_block_mb: float = 32.0, progress: Callable = None) -> dict:
+    '''
+    Computes the statistics on stratified bootstrap resamples, block by block.
+    Every block draws from its own generator spawned from one SeedSequence, so
+    the replicates depend only on the seed and the block size.
+
+    :param X: Feature matrix of shape (n_samples, n_features)
+    :type X: np.ndarray
+    :param in_group1: Boolean array marking group 1
+    :type in_group1: np.ndarray
+    :param n_resamples: Number of bootstrap resamples
+    :type n_resamples: int
+    :param seed: Root seed for the SeedSequence
+    :type seed: int
+    :param block_size: Resamples per block, derived from max_block_mb if None
+    :type block_size: int
+    :param max_block_mb: Memory budget for a block in megabytes
+    :type max_block_mb: float
+    :param progress: Callback receiving (n_done, n_total) after every block
+    :type progress: Callable
+    :returns: Dict mapping each name in STATISTICS to an array of shape
+        (n_resamples, n_features)
+    :rtype: dict
+    '''
+    group1, group2 = _split_groups(X, in_group1)
+    n1, n2 = len(group1), len(group2)
+    center1, center2 = group1.mean(axis=0), group2.mean(axis=0)
+    centered1 = np.hstack([group1 - center1, (group1 - center1)**2])
+    centered2 = np.hstack([group2 - center2, (group2 - center2)**2])
+
+    if block_size is None:
+        block_size = compute_block_size(max(n1, n2), max_block_mb)
+
+    starts = range(0, n_resamples, block_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(starts))
+    replicates = {name: np.empty((n_resamples, X.shape[1])) for name in STATISTICS}
+
+    with span('bootstrap', rows=n_resamples):
+        for start, seed_seq in zip(starts, seeds):
+            stop = min(start + block_size, n_resamples)
+            rng = np.random.default_rng(seed_seq)
+
+            with span('bootstrap.block', rows=stop - start, start=start):
+                mean1, var1 = _resampled_moments(centered1, center1, stop - start, rng)
+                mean2, var2 = _resampled_moments(centered2, center2, stop - start, rng)
+
+            for name, values in effect_sizes(n1, mean1, var1, n2, mean2, var2).items():
+                replicates[name][start:stop] = values
+
+            if progress is not None:
+                progress(stop, n_resamples)
+
+    return replicates
+
+def _leave_one_out(rows: np.ndarray, n, mean: np.ndarray, m2: np.ndarray) -> tuple:
+    '''
+    Computes the mean and variance of a group with each of the given rows left
+    out in turn.
+    '''
+    mean_out = (n * mean - rows) / (n - 1)
+    m2_out = m2 - (rows - mean)**2 * (n / (n - 1))
+    return mean_out, m2_out / (n - 2)
+
+def _jackknife_blocks(group1: np.ndarray, group2: np.ndarray, deleted: int, block_rows: int):
+    '''
+    Yields the leave-one-out statistics of the rows of one group, block by
+    block, as arrays of shape (rows in block, n_features).
+    '''
+    groups = [group1, group2]
+    n = [len(group1), len(group2)]
+    mean = [group.mean(axis=0) for group in groups]
+    m2 = [((group - center)**2).sum(axis=0) for group, center in zip(groups, mean)]
+    var = [m2[0] / (n[0] - 1), m2[1] / (n[1] - 1)]
+
+    rows = groups[deleted]
+    for start in range(0, len(rows), block_rows):
+        block = rows[start:start + block_rows]
+        n_out, mean_out, var_out = list(n), list(mean), list(var)
+        n_out[deleted] = n[deleted] - 1
+        mean_out[deleted], var_out[deleted] = _leave_one_out(block, n[deleted], mean[deleted],
+                                                             m2[deleted])
+        values = effect_sizes(n_out[0], mean_out[0], var_out[0], n_out[1], mean_out[1], var_out[1])
+        yield {name: np.broadcast_to(value, block.shape) for name, value in values.items()}
+
+def jackknife(X: np.ndarray, in_group1: np.ndarray, max_block_mb: float = 32.0) -> JackknifeResult:
+    '''
+    Computes the jackknife that deletes one row of one group at a time, from
+    closed-form leave-one-out moments. Each group takes two passes over blocks
+    of its rows: one for the mean of its leave-one-out estimates, one for their
+    spread and skewness. The groups are combined as in Efron and Tibshirani's
+    stratified jackknife (eq. 15.36), as scipy's BCa does.
+
+    :param X: Feature matrix of shape (n_samples, n_features)
+    :type X: np.ndarray
+    :param in_group1: Boolean array marking group 1
+    :type in_group1: np.ndarray
+    :param max_block_mb: Memory budget for a block of rows in megabytes
+    :type max_block_mb: float
+    :returns: Jackknife standard errors and BCa accelerations
+    :rtype: JackknifeResult
+    '''
+    group1, group2 = _split_groups(X, in_group1)
+
+    # Each row of a block holds its leave-one-out means, variances and statistics
+    bytes_per_row = (2 + len(STATISTICS)) * X.shape[1] * np.dtype(np.float64).itemsize
+    block_rows = max(1, int(max_block_mb * 2**20) // bytes_per_row)
+
+    variance = {name: 0.0 for name in STATISTICS}
+    squares = {name: 0.0 for name in STATISTICS}
+    cubes = {name: 0.0 for name in STATISTICS}
+
+    with span('jackknife', rows=len(group1) + len(group2)):
+        for deleted, n in enumerate([len(group1), len(group2)]):
+            totals = {name: 0.0 for name in STATISTICS}
+            for block in _jackknife_blocks(group1, group2, deleted, block_rows):
+                for name, values in block.items():
+                    totals[name] = totals[name] + values.sum(axis=0)
+
+            for block in _jackknife_blocks(group1, group2, deleted, block_rows):
+                for name, values in block.items():
+                    # Influence values, scaled as U = (n - 1)(mean - value)
+                    influence = (n - 1) * (totals[name] / n - values)
+                    group_squares = (influence**2).sum(axis=0)
+                    variance[name] = variance[name] + group_squares / (n * (n - 1))
+                    squares[name] = squares[name] + group_squares / n**2
+                    cubes[name] = cubes[name] + (influence**3).sum(axis=0) / n**3
+
+    standard_error = {name: np.sqrt(variance[name]) for name in STATISTICS}
+    acceleration = {}
+    for name in STATISTICS:
+        denominator = 6 * squares[name]**1.5
+        acceleration[name] = np.divide(cubes[name], denominator,
+                                       out=np.zeros_like(denominator), where=denominator > 0)
+
+    return JackknifeResult(standard_error, acceleration)
+
+def percentile_interval(replicates: np.ndarray, estimate: np.ndarray,
+                        confidence: float = 0.95) -> ConfidenceInterval:
+    '''
+    Computes percentile intervals from bootstrap replicates.
+
+    :param replicates: Replicates of shape (n_resamples, n_features)
+    :type replicates: np.ndarray
+    :param estimate: Full-sample estimate per feature
+    :type estimate: np.ndarray
+    :param confidence: Confidence level
+    :type confidence: float
+    :returns: Interval per feature
+    :rtype: ConfidenceInterval
+    '''
+    alpha = 1 - confidence
+    lower, upper = np.quantile(replicates, [alpha / 2, 1 - alpha / 2], axis=0)
+    return ConfidenceInterval(estimate, lower, upper, replicates.std(axis=0, ddof=1))
+
+def bca_interval(replicates: np.ndarray, estimate: np.ndarray, acceleration: np.ndarray,
+                 confidence: float = 0.95) -> ConfidenceInterval:
+    '''
+    Computes bias-corrected and accelerated intervals from bootstrap replicates.
+
+    :param replicates: Replicates of shape (n_resamples, n_features)
+    :type replicates: np.ndarray
+    :param estimate: Full-sample estimate per feature
+    :type estimate: np.ndarray
+    :param acceleration: Jackknife acceleration per feature
+    :type acceleration: np.ndarray
+    :param confidence: Confidence level
+    :type confidence: float
+    :returns: Interval per feature
+    :rtype: ConfidenceInterval
+    '''
+    alpha = 1 - confidence
+    n_resamples = len(replicates)
+
+    # Ties with the estimate count half, so a degenerate feature gets no bias
+    below = (replicates < estimate).sum(axis=0) + 0.5 * (replicates == estimate).sum(axis=0)
+    bias = stats.norm.ppf(np.clip(below / n_resamples, 1 / n_resamples, 1 - 1 / n_resamples))
+
+    bounds = []
+    for z_alpha in stats.norm.ppf([alpha / 2, 1 - alpha / 2]):
+        shifted = bias + z_alpha
+        levels = stats.norm.cdf(bias + shifted / (1 - acceleration * shifted))
+        bounds.append(np.array([np.quantile(replicates[:, j], level)
+                                for j, level in enumerate(levels)]))
+
+    return ConfidenceInterval(estimate, bounds[0], bounds[1], replicates.std(axis=0, ddof=1))
+
+def jackknife_interval(estimate: np.ndarray, standard_error: np.ndarray,
+                       confidence: float = 0.95) -> ConfidenceInterval:
+    '''
+    Computes normal intervals from jackknife standard errors.
+
+    :param estimate: Full-sample estimate per feature
+    :type estimate: np.ndarray
+    :param standard_error: Jackknife standard error per feature
+    :type standard_error: np.ndarray
+    :param confidence: Confidence level
+    :type confidence: float
+    :returns: Interval per feature
+    :rtype: ConfidenceInterval
+    '''
+    z = stats.norm.ppf(1 - (1 - confidence) / 2)
+    return ConfidenceInterval(estimate, estimate - z * standard_error,
+                              estimate + z * standard_error, standard_error)
+
+def effect_size_intervals(X: np.ndarray, in_group1: np.ndarray, n_resamples: int = 2000,
+                          confidence: float = 0.95, method: str = 'bca', seed: int = None,
+                          block_size: int = None, max_block_mb: float = 32.0,
+                          progress: Callable = None) -> dict:
+    '''
+    Computes confidence intervals of the group means, their difference and
+    Cohen's d for every feature.
+
+    :param X: Feature matrix of shape (n_samples, n_features)
+    :type X: np.ndarray
+    :param in_group1: Boolean array marking group 1
+    :type in_group1: np.ndarray
+    :param n_resamples: Number of bootstrap resamples, unused by the jackknife
+    :type n_resamples: int
+    :param confidence: Confidence level
+    :type confidence: float
+    :param method: bca, percentile or jackknife
+    :type method: str
+    :param seed: Root seed for the resamples
+    :type seed: int
+    :param block_size: Resamples per block, derived from max_block_mb if None
+    :type block_size: int
+    :param max_block_mb: Memory budget for a block in megabytes
+    :type max_block_mb: float
+    :param progress: Callback receiving (n_done, n_total) after every block
+    :type progress: Callable
+    :returns: Dict mapping each name in STATISTICS to its ConfidenceInterval
+    :rtype: dict
+    '''
+    if method not in METHODS:
+        raise ValueError(f"unknown method {method!r}, expected one of {METHODS}")
+
+    estimates = sample_effect_sizes(X, in_group1)
+
+    if method == 'jackknife':
+        standard_error = jackknife(X, in_group1, max_block_mb).standard_error
+        return {name: jackknife_interval(estimates[name], standard_error[name], confidence)
+                for name in STATISTICS}
+
+    replicates = bootstrap_replicates(X, in_group1, n_resamples, seed, block_size,
+                                      max_block_mb, progress)
+    if method == 'percentile':
+        return {name: percentile_interval(replicates[name], estimates[name], confidence)
+                for name in STATISTICS}
+
+    acceleration = jackknife(X, in_group1, max_block_mb).acceleration
+    return {name: bca_interval(replicates[name], estimates[name], acceleration[name], confidence)
+            for name in STATISTICS}
+
+# Poisson(1) CDF up to the count whose tail is below float32 resolution
+_POISSON_CDF = stats.poisson.cdf(np.arange(12), 1.0).astype(np.float32)
+
+def poisson_weights(shape: tuple, rng: np.random.Generator) -> np.ndarray:
+    '''
+    Draws Poisson(1) resampling weights by inverting the CDF at float32
+    uniforms, about twice as fast as rng.poisson.
+
+    :param shape: Shape of the weight array
+    :type shape: tuple
+    :param rng: Random generator
+    :type rng: np.random.Generator
+    :returns: Integer weights
+    :rtype: np.ndarray
+    '''
+    return np.searchsorted(_POISSON_CDF, rng.random(shape, dtype=np.float32))
+
+class StreamingBootstrap:
+    '''
+    Poisson bootstrap over rows arriving in chunks. Keeps, per group, the exact
+    count, mean and sum of squared deviations of every feature, and the same
+    weighted moments for every resample. Memory depends on the number of
+    resamples and features, not on the number of rows.
+    '''
+    def __init__(self, n_resamples: int, n_features: int, seed: int = None,
+                 max_block_mb: float = 32.0):
+        '''
+        :param n_resamples: Number of bootstrap resamples
+        :type n_resamples: int
+        :param n_features: Number of feature columns
+        :type n_features: int
+        :param seed: Seed for the Poisson weights
+        :type seed: int
+        :param max_block_mb: Memory budget for the weights of one chunk in megabytes
+        :type max_block_mb: float
+        '''
+        self.n_resamples = n_resamples
+        self.n_features = n_features
+        self.max_block_mb = max_block_mb
+        self.rng = np.random.default_rng(seed)
+
+        # Index 0 is group 1, index 1 group 2
+        self.count = np.zeros((2, 1))
+        self.mean = np.zeros((2, n_features))
+        self.m2 = np.zeros((2, n_features))
+        self.resample_count = np.zeros((2, n_resamples, 1))
+        self.resample_mean = np.zeros((2, n_resamples, n_features))
+        self.resample_m2 = np.zeros((2, n_resamples, n_features))
+
+    def update(self, X: np.ndarray, in_group1: np.ndarray):
+        '''
+        Adds a chunk of rows.
+
+        :param X: Chunk of the feature matrix
+        :type X: np.ndarray
+        :param in_group1: Boolean array marking the group 1 rows of the chunk
+        :type in_group1: np.ndarray
+        '''
+        with span('bootstrap.stream_chunk', rows=len(X)):
+            for group, rows in enumerate(_split_groups(X, in_group1)):
+                if len(rows):
+                    self._update_group(group, rows)
+
+    def _update_group(self, group: int, rows: np.ndarray):
+        center = rows.mean(axis=0)
+        centered = np.hstack([rows - center, (rows - center)**2])
+
+        self.count[group], self.mean[group], self.m2[group] = merge_moments(
+            self.count[group], self.mean[group], self.m2[group],
+            len(rows), center, centered[:, self.n_features:].sum(axis=0))
+
+        # Uniforms, weights and weights as floats of a block of resamples
+        bytes_per_resample = len(rows) * (4 + 8 + 8)
+        block_size = max(1, int(self.max_block_mb * 2**20) // bytes_per_resample)
+
+        for start in range(0, self.n_resamples, block_size):
+            stop = min(start + block_size, self.n_resamples)
+            weights = poisson_weights((stop - start, len(rows)), self.rng).astype(float)
+
+            count = weights.sum(axis=1, keepdims=True)
+            sums, squares = np.hsplit(weights @ centered, 2)
+            safe_count = np.where(count > 0, count, 1)
+            chunk_mean = center + sums / safe_count
+            chunk_m2 = squares - sums**2 / safe_count
+
+            window = np.s_[group, start:stop]
+            (self.resample_count[window], self.resample_mean[window],
+             self.resample_m2[window]) = merge_moments(
+                self.resample_count[window], self.resample_mean[window],
+                self.resample_m2[window], count, chunk_mean, chunk_m2)
+
+    def merge(self, other: 'StreamingBootstrap') -> 'StreamingBootstrap':
+        '''
+        Adds the rows accumulated by another instance with the same number of
+        resamples and features, which must have seen different rows and used a
+        different seed.
+
+        :param other: Accumulator to merge in
+        :type other: StreamingBootstrap
+        :returns: This accumulator
+        :rtype: StreamingBootstrap
+        '''
+        self.count, self.mean, self.m2 = merge_moments(
+            self.count, self.mean, self.m2, other.count, other.mean, other.m2)
+        self.resample_count, self.resample_mean, self.resample_m2 = merge_moments(
+            self.resample_count, self.resample_mean, self.resample_m2,
+            other.resample_count, other.resample_mean, other.resample_m2)
+        return self
+
+    def estimates(self) -> dict:
+        '''
+        Computes the statistics on all rows seen so far.
+
+        :returns: Dict mapping each name in STATISTICS to one value per feature
+        :rtype: dict
+        '''
+        (n1, n2), var = self.count[:, 0], self.m2 / (self.count - 1)
+        return effect_sizes(n1, self.mean[0], var[0], n2, self.mean[1], var[1])
+
+    def replicates(self) -> dict:
+        '''
+        Computes the statistics of every resample.
+
+        :returns: Dict mapping each name in STATISTICS to an array of shape
+            (n_resamples, n_features)
+        :rtype: dict
+        '''
+        count = self.resample_count
+        var = self.resample_m2 / np.where(count > 1, count - 1, 1)
+        return effect_sizes(count[0], self.resample_mean[0], var[0],
+                            count[1], self.resample_mean[1], var[1])
+
+    def intervals(self, confidence: float = 0.95) -> dict:
+        '''
+        Computes percentile intervals. BCa needs the jackknife, which takes a
+        second pass over the data, so it is not offered here.
+
+        :param confidence: Confidence level
+        :type confidence: float
+        :returns: Dict mapping each name in STATISTICS to its ConfidenceInterval
+        :rtype: dict
+        '''
+        estimates, replicates = self.estimates(), self.replicates()
+        return {name: percentile_interval(replicates[name], estimates[name], confidence)
+                for name in STATISTICS}
@@ -0,0 +1,345 @@
+'''
+Permutation test for the accuracy of a fitted classifier.
+
+The classifier is refit on label permutations of the training set and scored on
+the real test set. The permutations run in parallel on the shared permutation
+runner, so the null distribution depends only on the seed and chunk size.
+Estimators with a convex loss whose warm_start option reuses the previous
+solution as the starting point (logistic regression, SGD) are kept alive across
+the permutations of a chunk instead of being refit from scratch every time.
+
+Gaussian naive Bayes and linear discriminant analysis depend on the labels only
+through per-class sums and sums of squares or cross-products. For those, a whole
+chunk of permutations is refit in closed form from the group sums, which are
+computed in batch as one indicator-matrix product.
+
+:author: Jacob Anderson
+:version: 0.1.0
+'''
+
+import time
+from functools import partial
+from typing import Callable, NamedTuple
+import numpy as np
+from sklearn.base import clone
+from sklearn.discriminant_analysis import LinearDiscriminantAnalysis
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.naive_bayes import GaussianNB
+from sklearn.utils.validation import check_is_fitted
+from sklearn.exceptions import NotFittedError
+from csds413_term_project.instrumentation import span
+from csds413_term_project.permutation import permutation_p_value, run_permutations
+
+# For ensembles warm_start means "add more members", which would silently skip
+# the refit, so only estimators that use it to initialize the solver are listed.
+# Their losses are convex, so the starting point changes how fast the solver
+# converges, not where. An MLP is not convex: starting each permutation from the
+# last one's weights would make the null fits depend on each other, so MLPs are
+# refit from scratch
+WARM_START_ESTIMATORS = (LogisticRegression, SGDClassifier)
+
+class PermutationTestResult(NamedTuple):
+    '''
+    Outcome of a classifier permutation test. The timing dict holds the wall time
+    of the permutations (total_seconds), the throughput (permutations_per_second),
+    the time of fitting the real model (fit_seconds, 0 if it was already fitted)
+    and how the permutations were refit (method: 'closed_form', 'warm_start' or
+    'refit').
+    '''
+    observed: float
+    null_distribution: np.ndarray
+    p_value: float
+    timing: dict
+
+def supports_warm_start(estimator) -> bool:
+    '''
+    Checks whether refits of the estimator can start from the previous solution.
+
+    :param estimator: scikit-learn estimator
+    :returns: True if warm_start initializes the solver from the last fit
+    :rtype: bool
+    '''
+    return isinstance(estimator, WARM_START_ESTIMATORS)
+
+def classifier_permutation_scores(estimator, X_train: np.ndarray,
+                                  y_train: np.ndarray, X_test: np.ndarray,
+                                  y_test: np.ndarray, n: int,
+                                  rng: np.random.Generator,
+                                  warm_start: bool = False) -> np.ndarray:
+    '''
+    Fits the estimator on n label permutations of the training set and scores
+    each fit on the real test set. Without warm starts every permutation gets a
+    fresh copy of the estimator; with them one copy is refit n times, each fit
+    starting from the previous solution. The permutations drawn are the same
+    either way.
+
+    :param estimator: Unfitted or fitted scikit-learn estimator to copy
+    :param X_train: Training features
+    :type X_train: np.ndarray
+    :param y_train: Training labels
+    :type y_train: np.ndarray
+    :param X_test: Test features
+    :type X_test: np.ndarray
+    :param y_test: Test labels
+    :type y_test: np.ndarray
+    :param n: Number of permutations
+    :type n: int
+    :param rng: Random generator used to permute the labels
+    :type rng: np.random.Generator
+    :param warm_start: Whether to refit one copy from its previous solution
+    :type warm_start: bool
+    :returns: Test accuracy for every permutation
+    :rtype: np.ndarray
+    '''
+    y_train = np.asarray(y_train)
+    scores = np.zeros(n)
+
+    clf_perm = clone(estimator)
+    if warm_start:
+        clf_perm.set_params(warm_start=True)
+
+    for i in range(n):
+        if not warm_start and i > 0:
+            clf_perm = clone(estimator)
+        clf_perm.fit(X_train, rng.permutation(y_train))
+        scores[i] = clf_perm.score(X_test, y_test)
+
+    return scores
+
+def permuted_class_indicators(y_train: np.ndarray, n: int,
+                              rng: np.random.Generator) -> tuple:
+    '''
+    Draws n label permutations, exactly as classifier_permutation_scores draws
+    them, and encodes each as one 0/1 indicator row per class. Multiplying the
+    indicators with a feature matrix gives the per-class sums of every permutation
+    in one product.
+
+    :param y_train: Training labels
+    :type y_train: np.ndarray
+    :param n: Number of permutations
+    :type n: int
+    :param rng: Random generator used to permute the labels
+    :type rng: np.random.Generator
+    :returns: Tuple classes, class counts, indicators of shape (n_classes, n, n_samples)
+    :rtype: tuple
+    '''
+    classes, codes, counts = np.unique(np.asarray(y_train), return_inverse=True,
+                                       return_counts=True)
+
+    # Permuting the class codes shuffles the same way as permuting the labels
+    permuted = np.empty((n, len(codes)), dtype=np.intp)
+    for i in range(n):
+        permuted[i] = rng.permutation(codes)
+
+    indicators = np.zeros((len(classes), n, len(codes)))
+    for k in range(len(classes)):
+        np.equal(permuted, k, out=indicators[k], casting='unsafe')
+
+    return classes, counts, indicators
+
+def gaussian_nb_permutation_scores(estimator: GaussianNB, X_train: np.ndarray,
+                                   y_train: np.ndarray, X_test: np.ndarray,
+                                   y_test: np.ndarray, n: int,
+                                   rng: np.random.Generator) -> np.ndarray:
+    '''
+    Closed-form permutation scores for GaussianNB. The class means and variances
+    of every permutation come from its group sums of x and x squared. The priors
+    and the variance smoothing do not depend on the labels, since a permutation
+    keeps the class counts.
+
+    :param estimator: GaussianNB with default priors
+    :type estimator: GaussianNB
+    :param X_train: Training features
+    :type X_train: np.ndarray
+    :param y_train: Training labels
+    :type y_train: np.ndarray
+    :param X_test: Test features
+    :type X_test: np.ndarray
+    :param y_test: Test labels
+    :type y_test: np.ndarray
+    :param n: Number of permutations
+    :type n: int
+    :param rng: Random generator used to permute the labels
+    :type rng: np.random.Generator
+    :returns: Test accuracy for every permutation
+    :rtype: np.ndarray
+    '''
+    # Centering keeps the sum-of-squares variances accurate; train and test are
+    # shifted alike, so the classifier is unchanged
+    X_train = np.asarray(X_train)
+    center = X_train.mean(axis=0)
+    X_train = X_train - center
+    X_test = np.asarray(X_test) - center
+
+    classes, counts, indicators = permuted_class_indicators(y_train, n, rng)
+    epsilon = estimator.var_smoothing * np.var(X_train, axis=0).max()
+    log_priors = np.log(counts / counts.sum())
+
+    # Shapes (n_classes, n, n_features)
+    means = (indicators @ X_train) / counts[:, None, None]
+    variances = (indicators @ X_train ** 2) / counts[:, None, None] - means ** 2
+    variances = np.maximum(variances, 0) + epsilon
+
+    # Joint log likelihood of every test row under every permuted fit, with
+    # sum((x - mean)^2 / var) expanded so the test rows enter through products
+    inv_var = 1 / variances
+    squared_distance = (inv_var @ (X_test ** 2).T
+                        - 2 * (means * inv_var) @ X_test.T
+                        + np.sum(means ** 2 * inv_var, axis=2)[:, :, None])
+    log_likelihood = (log_priors[:, None, None]
+                      - 0.5 * np.sum(np.log(2 * np.pi * variances), axis=2)[:, :, None]
+                      - 0.5 * squared_distance)
+
+    predictions = classes[np.argmax(log_likelihood, axis=0)]
+    return np.mean(predictions == np.asarray(y_test), axis=1)
+
+def lda_permutation_scores(estimator: LinearDiscriminantAnalysis, X_train: np.ndarray,
+                           y_train: np.ndarray, X_test: np.ndarray,
+                           y_test: np.ndarray, n: int,
+                           rng: np.random.Generator) -> np.ndarray:
+    '''
+    Closed-form permutation scores for LinearDiscriminantAnalysis without
+    shrinkage. The pooled within-class covariance of every permutation is the
+    total cross-product matrix minus the outer products of its group sums, so one
+    batch of group sums and one batched solve refit all permutations.
+
+    :param estimator: LinearDiscriminantAnalysis with default priors, no shrinkage
+    :type estimator: LinearDiscriminantAnalysis
+    :param X_train: Training features
+    :type X_train: np.ndarray
+    :param y_train: Training labels
+    :type y_train: np.ndarray
+    :param X_test: Test features
+    :type X_test: np.ndarray
+    :param y_test: Test labels
+    :type y_test: np.ndarray
+    :param n: Number of permutations
+    :type n: int
+    :param rng: Random generator used to permute the labels
+    :type rng: np.random.Generator
+    :returns: Test accuracy for every permutation
+    :rtype: np.ndarray
+    '''
+    X_train = np.asarray(X_train)
+    center = X_train.mean(axis=0)
+    X_train = X_train - center
+    X_test = np.asarray(X_test) - center
+
+    classes, counts, indicators = permuted_class_indicators(y_train, n, rng)
+    n_samples = counts.sum()
+    log_priors = np.log(counts / n_samples)
+
+    # Shapes (n, n_classes, n_features)
+    sums = (indicators @ X_train).transpose(1, 0, 2)
+    means = sums / counts[None, :, None]
+
+    # Prior-weighted class covariances, as LinearDiscriminantAnalysis pools them
+    between = np.einsum('bkd,bke->bde', sums, means)
+    covariance = (X_train.T @ X_train - between) / n_samples
+
+    coef = np.linalg.solve(covariance, means.transpose(0, 2, 1)).transpose(0, 2, 1)
+    intercept = -0.5 * np.sum(means * coef, axis=2) + log_priors
+
+    decision = coef @ X_test.T + intercept[:, :, None]
+    predictions = classes[np.argmax(decision, axis=1)]
+    return np.mean(predictions == np.asarray(y_test), axis=1)
+
+def closed_form_scorer(estimator) -> Callable:
+    '''
+    Picks the closed-form permutation scorer for an estimator, if there is one.
+    Only the default settings are covered: no fixed priors for either model and
+    no shrinkage or custom covariance estimator for LDA.
+
+    :param estimator: scikit-learn estimator
+    :returns: Scorer with the signature of classifier_permutation_scores, or None
+    :rtype: Callable
+    '''
+    if type(estimator) is GaussianNB and estimator.priors is None:
+        return gaussian_nb_permutation_scores
+
+    if (type(estimator) is LinearDiscriminantAnalysis and estimator.priors is None
+            and estimator.shrinkage is None and estimator.covariance_estimator is None):
+        return lda_permutation_scores
+
+    return None
+
+def classifier_permutation_test(estimator, X_train: np.ndarray,
+                                y_train: np.ndarray, X_test: np.ndarray,
+                                y_test: np.ndarray, n_permutations: int = 1000,
+                                seed: int = None, n_workers: int = None,
+                                chunk_size: int = 10, warm_start: bool = True,
+                                closed_form: bool = True,
+                                progress: Callable = None) -> PermutationTestResult:
+    '''
+    Tests whether a classifier's test accuracy is better than chance by refitting
+    it on permuted training labels. The features are expected to be preprocessed
+    already (scaled, expanded), so the preprocessing is fit once and shared by all
+    permutations. An unfitted estimator is fit on the real labels first.
+
+    GaussianNB and LinearDiscriminantAnalysis are refit in closed form from batched
+    group sums, which makes 10k-permutation tests practical; larger chunks pay off
+    there since each chunk is a handful of matrix products.
+
+    :param estimator: scikit-learn classifier, fitted or not
+    :param X_train: Preprocessed training features
+    :type X_train: np.ndarray
+    :param y_train: Training labels
+    :type y_train: np.ndarray
+    :param X_test: Preprocessed test features
+    :type X_test: np.ndarray
+    :param y_test: Test labels
+    :type y_test: np.ndarray
+    :param n_permutations: Number of permutations
+    :type n_permutations: int
+    :param seed: Root seed for the permutation runner
+    :type seed: int
+    :param n_workers: Number of worker processes, all cores if None
+    :type n_workers: int
+    :param chunk_size: Number of permutations per chunk
+    :type chunk_size: int
+    :param warm_start: Whether to warm-start refits when the estimator allows it
+    :type warm_start: bool
+    :param closed_form: Whether to use the closed-form refit when there is one
+    :type closed_form: bool
+    :param progress: Callback receiving progress after every chunk
+    :type progress: Callable
+    :returns: Observed accuracy, null distribution, p-value and timing stats
+    :rtype: PermutationTestResult
+    '''
+    fit_seconds = 0.0
+    try:
+        check_is_fitted(estimator)
+    except NotFittedError:
+        start_time = time.perf_counter()
+        with span(f'fit.{type(estimator).__name__}', rows=len(X_train)):
+            estimator.fit(X_train, y_train)
+        fit_seconds = time.perf_counter() - start_time
+
+    observed = estimator.score(X_test, y_test)
+
+    scorer = closed_form_scorer(estimator) if closed_form else None
+    if scorer is not None:
+        method = 'closed_form'
+        statistic = partial(scorer, estimator, X_train, y_train, X_test, y_test)
+    else:
+        warm_start = warm_start and supports_warm_start(estimator)
+        method = 'warm_start' if warm_start else 'refit'
+        statistic = partial(classifier_permutation_scores, estimator, X_train, y_train,
+                            X_test, y_test, warm_start=warm_start)
+
+    start_time = time.perf_counter()
+    null_distribution = run_permutations(
+        statistic, n_permutations, observed=observed, seed=seed, n_workers=n_workers,
+        chunk_size=chunk_size, progress=progress
+    )
+    total_seconds = time.perf_counter() - start_time
+
+    timing = {
+        'total_seconds': total_seconds,
+        'permutations_per_second': n_permutations / total_seconds if total_seconds > 0 else float('inf'),
+        'fit_seconds': fit_seconds,
+        'method': method,
+    }
+
+    return PermutationTestResult(observed, null_distribution,
+                                 permutation_p_value(null_distribution, observed), timing)
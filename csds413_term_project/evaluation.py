@@ -0,0 +1,178 @@
+'''
+Evaluation engine for the classifier comparisons.
+
+Every classifier is fit once per cross-validation fold and once on the whole
+training set, and all of these fits run as a single batch on a joblib pool.
+The folds are computed once up front. The hold-out split is just one more
+"fold" whose training rows are the full training set and whose test rows are
+the test set. The fitted estimators are kept in the results, so later steps
+such as feature importances, the confusion matrix and the permutation baseline
+reuse them instead of refitting. With a model registry, evaluations are
+also persisted, so re-running a script on unchanged data and hyperparameters
+reloads them instead of training again.
+
+:author: Jacob Anderson
+:version: 0.1.0
+'''
+
+from typing import NamedTuple
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.metrics import accuracy_score, precision_recall_fscore_support
+from sklearn.model_selection import StratifiedKFold
+from csds413_term_project.model_registry import ModelRegistry, content_hash, params_fingerprint
+from csds413_term_project import instrumentation
+from csds413_term_project.instrumentation import span
+
+class ClassifierEvaluation(NamedTuple):
+    '''
+    Result of evaluating one classifier. The estimator is fitted on the full
+    training set, and y_pred holds its predictions on the test set.
+    '''
+    estimator: object
+    y_pred: np.ndarray
+    accuracy: float
+    precision: float
+    recall: float
+    f1: float
+    cv_scores: np.ndarray
+
+    def summary(self) -> dict:
+        '''
+        Collects the metrics in the layout of the results tables.
+
+        :returns: Dict with Accuracy, Precision, Recall, F1, CV_Mean and CV_Std
+        :rtype: dict
+        '''
+        return {
+            'Accuracy': self.accuracy,
+            'Precision': self.precision,
+            'Recall': self.recall,
+            'F1': self.f1,
+            'CV_Mean': self.cv_scores.mean(),
+            'CV_Std': self.cv_scores.std()
+        }
+
+def make_folds(y: np.ndarray, n_splits: int = 5) -> list:
+    '''
+    Precomputes the stratified cross-validation folds. Without shuffling, these
+    are the same folds that cross_val_score(cv=n_splits) uses for a classifier.
+
+    :param y: Training labels
+    :type y: np.ndarray
+    :param n_splits: Number of folds
+    :type n_splits: int
+    :returns: List of (train indices, validation indices) tuples
+    :rtype: list
+    '''
+    y = np.asarray(y)
+    return list(StratifiedKFold(n_splits=n_splits).split(np.zeros(len(y)), y))
+
+def _fit_and_predict(estimator, X_fit: np.ndarray, y_fit: np.ndarray,
+                     X_eval: np.ndarray, span_name: str = 'fit') -> tuple:
+    '''
+    Fits a copy of the estimator and predicts the evaluation rows.
+
+    :returns: Tuple fitted estimator, predictions
+    :rtype: tuple
+    '''
+    with span(span_name, rows=len(y_fit)):
+        estimator = clone(estimator).fit(X_fit, y_fit)
+        return estimator, estimator.predict(X_eval)
+
+def run_evaluation(classifiers: dict, X_train: np.ndarray, y_train: np.ndarray,
+                   X_test: np.ndarray, y_test: np.ndarray, folds: list = None,
+                   n_workers: int = None, registry: ModelRegistry = None) -> dict:
+    '''
+    Computes the test metrics and the cross-validation scores of every classifier
+    in one parallel pass. The classifiers passed in are left unfitted; fitted
+    copies are returned. Given a registry, each evaluation is stored under a hash
+    of the classifier's hyperparameters, the data and the folds, and only the
+    classifiers without a stored evaluation are fit.
+
+    :param classifiers: Dict mapping names to scikit-learn classifiers
+    :type classifiers: dict
+    :param X_train: Training features
+    :type X_train: np.ndarray
+    :param y_train: Training labels
+    :type y_train: np.ndarray
+    :param X_test: Test features
+    :type X_test: np.ndarray
+    :param y_test: Test labels
+    :type y_test: np.ndarray
+    :param folds: Precomputed folds from make_folds, 5 stratified folds if None
+    :type folds: list
+    :param n_workers: Number of worker processes, all cores if None
+    :type n_workers: int
+    :param registry: Model registry caching the evaluations, no caching if None
+    :type registry: ModelRegistry
+    :returns: Dict mapping names to ClassifierEvaluation, in the input order
+    :rtype: dict
+    '''
+    y_train = np.asarray(y_train)
+    y_test = np.asarray(y_test)
+    folds = make_folds(y_train) if folds is None else folds
+
+    keys = {}
+    cached = {}
+    if registry is not None:
+        for name, clf in classifiers.items():
+            keys[name] = content_hash('evaluation', params_fingerprint(clf), X_train,
+                                      y_train, X_test, y_test, folds)
+            if keys[name] in registry:
+                cached[name] = registry.load(keys[name])
+
+    pending = {name: clf for name, clf in classifiers.items() if name not in cached}
+    with span('evaluate', rows=len(y_train), classifiers=len(pending)):
+        evaluations = _evaluate(pending, X_train, y_train, X_test, y_test, folds, n_workers)
+
+    if registry is not None:
+        for name, evaluation in evaluations.items():
+            registry.save(keys[name], evaluation)
+
+    evaluations.update(cached)
+    return {name: evaluations[name] for name in classifiers}
+
+def _evaluate(classifiers: dict, X_train: np.ndarray, y_train: np.ndarray,
+              X_test: np.ndarray, y_test: np.ndarray, folds: list,
+              n_workers: int) -> dict:
+    '''
+    Fits and scores the classifiers for run_evaluation.
+    '''
+    if not classifiers:
+        return {}
+
+    # Job list: the hold-out fit of each classifier followed by its fold fits
+    jobs = []
+    for name, clf in classifiers.items():
+        jobs.append((f'fit.{name}', clf, X_train, y_train, X_test))
+        for train_idx, val_idx in folds:
+            jobs.append((f'cv.{name}', clf, X_train[train_idx], y_train[train_idx],
+                         X_train[val_idx]))
+
+    # With profiling on, the workers' spans come back with their fits
+    fit_and_predict = instrumentation.in_worker(_fit_and_predict)
+    parallel = Parallel(n_jobs=-1 if n_workers is None else n_workers)
+    outputs = [instrumentation.unwrap(output) for output in
+               parallel(delayed(fit_and_predict)(clf, X_fit, y_fit, X_eval, span_name)
+                        for span_name, clf, X_fit, y_fit, X_eval in jobs)]
+
+    evaluations = {}
+    n_jobs_per_clf = 1 + len(folds)
+    for i, name in enumerate(classifiers):
+        estimator, y_pred = outputs[i * n_jobs_per_clf]
+        fold_outputs = outputs[i * n_jobs_per_clf + 1:(i + 1) * n_jobs_per_clf]
+
+        precision, recall, f1, _ = precision_recall_fscore_support(
+            y_test, y_pred, average='binary'
+        )
+        cv_scores = np.array([accuracy_score(y_train[val_idx], fold_pred)
+                              for (_, val_idx), (_, fold_pred) in zip(folds, fold_outputs)])
+
+        evaluations[name] = ClassifierEvaluation(
+            estimator, y_pred, accuracy_score(y_test, y_pred),
+            precision, recall, f1, cv_scores
+        )
+
+    return evaluations
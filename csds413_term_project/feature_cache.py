@@ -0,0 +1,197 @@
+'''
+Content-addressed cache of extracted tweet features.
+
+Every cleaned tweet is keyed by a hash of its text together with a namespace
+describing the extractor: its version, the tokenizer backend and the stopword
+set. Any change to those gives new keys, so stale features are never served.
+Entries live in one SQLite table, which holds millions of small rows without a
+file per tweet. Each entry records when it was last written or read. Every
+stored chunk is committed, so an interrupted run keeps the features extracted
+so far. After a run, entries beyond the size limit are evicted least recently
+used first, and entries older than the age limit are dropped.
+
+:author: Jacob Anderson
+:version: 0.1.0
+'''
+
+import hashlib
+import sqlite3
+import time
+from typing import Iterable
+import numpy as np
+import pandas as pd
+
+# SQLite caps the number of parameters in one statement
+_BATCH_SIZE = 500
+
+def cache_namespace(*parts) -> str:
+    '''
+    Fingerprints everything that determines the features besides the text.
+
+    :param parts: Extractor version, tokenizer name, stopword set, ...
+    :returns: Hex digest
+    :rtype: str
+    '''
+    description = repr([sorted(part) if isinstance(part, (set, frozenset)) else part
+                        for part in parts])
+    return hashlib.blake2b(description.encode(), digest_size=16).hexdigest()
+
+class FeatureCache:
+    '''
+    On-disk mapping from (namespace, cleaned text) to a row of feature values.
+    '''
+    def __init__(self, path: str, namespace: str, columns: list,
+                 max_entries: int = None, max_age_days: float = None):
+        self.path = path
+        self.columns = list(columns)
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+
+        self._prefix = namespace.encode() + b'\0'
+        self._now = int(time.time())
+        self._connection = sqlite3.connect(path)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+
+        value_columns = ', '.join(f'"{column}" REAL' for column in self.columns)
+        self._connection.execute(
+            f'CREATE TABLE IF NOT EXISTS features '
+            f'(key BLOB PRIMARY KEY, {value_columns}, last_used INTEGER) WITHOUT ROWID'
+        )
+        self._connection.execute('CREATE INDEX IF NOT EXISTS features_last_used ON features (last_used)')
+
+    def __enter__(self) -> 'FeatureCache':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def keys(self, texts: Iterable[str]) -> list:
+        '''
+        Computes the cache keys of cleaned texts.
+
+        :param texts: Cleaned tweet texts
+        :type texts: Iterable[str]
+        :returns: List of keys
+        :rtype: list
+        '''
+        prefix = self._prefix
+        return [hashlib.blake2b(prefix + text.encode(), digest_size=16).digest() for text in texts]
+
+    def get(self, keys: list) -> dict:
+        '''
+        Looks up keys and marks the hits as used by this run.
+
+        :param keys: Cache keys
+        :type keys: list
+        :returns: Dict mapping the keys found to tuples of feature values
+        :rtype: dict
+        '''
+        columns = ', '.join(f'"{column}"' for column in self.columns)
+        found = {}
+        distinct = list(dict.fromkeys(keys))
+
+        for i in range(0, len(distinct), _BATCH_SIZE):
+            batch = distinct[i:i + _BATCH_SIZE]
+            placeholders = ', '.join('?' * len(batch))
+            rows = self._connection.execute(
+                f'SELECT key, {columns} FROM features WHERE key IN ({placeholders})', batch
+            )
+            found.update((row[0], row[1:]) for row in rows)
+
+        hit_keys = list(found)
+        for i in range(0, len(hit_keys), _BATCH_SIZE):
+            batch = hit_keys[i:i + _BATCH_SIZE]
+            self._connection.execute(
+                f'UPDATE features SET last_used = ? WHERE key IN ({", ".join("?" * len(batch))})',
+                [self._now] + batch
+            )
+
+        n_hits = sum(key in found for key in keys)
+        self.hits += n_hits
+        self.misses += len(keys) - n_hits
+        return found
+
+    def put(self, keys: list, values: np.ndarray):
+        '''
+        Stores feature rows under their keys.
+
+        :param keys: Cache keys
+        :type keys: list
+        :param values: Array of shape (len(keys), len(columns))
+        :type values: np.ndarray
+        '''
+        placeholders = ', '.join('?' * (len(self.columns) + 2))
+        self._connection.executemany(
+            f'INSERT OR REPLACE INTO features VALUES ({placeholders})',
+            ((key, *map(float, row), self._now) for key, row in zip(keys, values))
+        )
+
+    def lookup(self, chunk: pd.DataFrame) -> tuple:
+        '''
+        Splits a chunk of cleaned tweets into cached and uncached rows.
+
+        :param chunk: DataFrame with a text column
+        :type chunk: pd.DataFrame
+        :returns: Tuple DataFrame of the cached features (indexed like the
+            cached rows of the chunk), boolean mask of the uncached rows
+        :rtype: tuple
+        '''
+        keys = self.keys(chunk['text'])
+        found = self.get(keys)
+
+        missing = np.array([key not in found for key in keys], dtype=bool)
+        cached_index = chunk.index[~missing]
+        cached = pd.DataFrame([found[key] for key, miss in zip(keys, missing) if not miss],
+                              columns=self.columns, index=cached_index, dtype=float)
+        return cached, missing
+
+    def store(self, features_df: pd.DataFrame):
+        '''
+        Stores the features of freshly extracted tweets and commits them,
+        together with the use marks of the lookups before.
+
+        :param features_df: DataFrame with a text column and the feature columns
+        :type features_df: pd.DataFrame
+        '''
+        self.put(self.keys(features_df['text']), features_df[self.columns].to_numpy(dtype=float))
+        self._connection.commit()
+
+    def __len__(self) -> int:
+        return self._connection.execute('SELECT COUNT(*) FROM features').fetchone()[0]
+
+    def evict(self) -> int:
+        '''
+        Applies the age and size limits.
+
+        :returns: Number of evicted entries
+        :rtype: int
+        '''
+        evicted = 0
+        if self.max_age_days is not None:
+            cutoff = self._now - int(self.max_age_days * 86400)
+            evicted += self._connection.execute(
+                'DELETE FROM features WHERE last_used < ?', (cutoff,)
+            ).rowcount
+
+        if self.max_entries is not None:
+            excess = len(self) - self.max_entries
+            if excess > 0:
+                evicted += self._connection.execute(
+                    'DELETE FROM features WHERE key IN '
+                    '(SELECT key FROM features ORDER BY last_used LIMIT ?)', (excess,)
+                ).rowcount
+
+        return evicted
+
+    def close(self):
+        '''
+        Evicts over-limit entries and commits the rest of the run.
+        '''
+        if self._connection is None:
+            return
+        self.evict()
+        self._connection.commit()
+        self._connection.close()
+        self._connection = None
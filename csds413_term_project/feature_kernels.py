@@ -0,0 +1,189 @@
+'''
+Batch feature kernels for the stylometric features.
+
+The alphabetic words of many tweets are laid out CSR-style: one flat list of
+words, an offsets array giving the words of each tweet, and a flat array of
+sentence start positions with its own per-tweet offsets. All characters of all
+words are decoded into a single codepoint array. Per-word counts are then
+reductions over that array (np.add.reduceat), and per-tweet totals are
+bincounts over the word-to-tweet index. The five features come out the same as
+compute_features gives them tweet by tweet, for thousands of tweets per call.
+
+:author: Jacob Anderson
+:version: 0.1.0
+'''
+
+from typing import Iterable, NamedTuple
+import numpy as np
+import pandas as pd
+from csds413_term_project.instrumentation import span
+
+FEATURE_NAMES = ['V', 'S', 'W', 'F', 'C']
+
+class TokenBatch(NamedTuple):
+    '''
+    Alphabetic words of a batch of tweets in CSR layout. The words of tweet i
+    are words[word_offsets[i]:word_offsets[i + 1]], and the positions (into
+    words) at which its sentences start are
+    sentence_starts[sentence_offsets[i]:sentence_offsets[i + 1]].
+    '''
+    words: list
+    word_offsets: np.ndarray
+    sentence_starts: np.ndarray
+    sentence_offsets: np.ndarray
+
+    @property
+    def n_tweets(self) -> int:
+        return len(self.word_offsets) - 1
+
+    @classmethod
+    def from_tokenized(cls, tweets: Iterable) -> 'TokenBatch':
+        '''
+        Packs tokenized tweets into a batch.
+
+        :param tweets: Iterable of TokenizedTweet
+        :type tweets: Iterable
+        :returns: Batch of the tweets
+        :rtype: TokenBatch
+        '''
+        words = []
+        word_offsets = [0]
+        sentence_starts = []
+        sentence_offsets = [0]
+
+        for tweet in tweets:
+            base = len(words)
+            sentence_starts.extend(base + start for start in tweet.sentence_starts)
+            words.extend(tweet.words)
+            word_offsets.append(len(words))
+            sentence_offsets.append(len(sentence_starts))
+
+        return cls(words, np.array(word_offsets, dtype=np.int64),
+                   np.array(sentence_starts, dtype=np.int64),
+                   np.array(sentence_offsets, dtype=np.int64))
+
+def character_classes(codepoints: np.ndarray) -> tuple:
+    '''
+    Classifies every codepoint as upper case, lower case or neither. The
+    unicode properties are looked up once per distinct character and spread
+    back out through a lookup table indexed by codepoint.
+
+    :param codepoints: Array of unicode codepoints
+    :type codepoints: np.ndarray
+    :returns: Tuple is_upper, is_lower, is_title; is_title marks titlecase
+        letters that are neither upper nor lower case
+    :rtype: tuple
+    '''
+    distinct = np.flatnonzero(np.bincount(codepoints))
+    chars = [chr(codepoint) for codepoint in distinct]
+
+    # Bit 0 upper, bit 1 lower, bit 2 title case
+    table = np.zeros(distinct[-1] + 1 if len(distinct) else 1, dtype=np.uint8)
+    table[distinct] = [char.isupper() | char.islower() << 1
+                       | (char.istitle() and not char.isupper()) << 2 for char in chars]
+    classes = table[codepoints]
+
+    return (classes & 1).astype(bool), (classes & 2).astype(bool), (classes & 4).astype(bool)
+
+def word_lengths(words: list) -> np.ndarray:
+    '''
+    Counts the characters of every word.
+
+    :param words: Words
+    :type words: list
+    :returns: Array of word lengths
+    :rtype: np.ndarray
+    '''
+    return np.fromiter(map(len, words), dtype=np.int64, count=len(words))
+
+def abnormal_capitalization(words: list, sentence_start: np.ndarray,
+                            lengths: np.ndarray = None) -> np.ndarray:
+    '''
+    Vectorized is_abnormal_capitalization over a flat list of words.
+
+    :param words: Non-empty alphabetic words
+    :type words: list
+    :param sentence_start: Flags of the words that open a sentence
+    :type sentence_start: np.ndarray
+    :param lengths: Precomputed word_lengths(words)
+    :type lengths: np.ndarray
+    :returns: Boolean array, True where the capitalization is abnormal
+    :rtype: np.ndarray
+    '''
+    if not words:
+        return np.zeros(0, dtype=bool)
+
+    lengths = word_lengths(words) if lengths is None else lengths
+    starts = np.cumsum(lengths) - lengths
+
+    codepoints = np.frombuffer(''.join(words).encode('utf-32-le'), dtype='<u4')
+    is_upper, is_lower, is_title = character_classes(codepoints)
+
+    n_upper = np.add.reduceat(is_upper.astype(np.int64), starts)
+    n_not_upper = np.add.reduceat((is_lower | is_title).astype(np.int64), starts)
+
+    # str.isupper: at least one upper case letter and no lower or title case ones
+    all_upper = (n_upper > 0) & (n_not_upper == 0)
+
+    abnormal = (all_upper & (lengths >= 5)) | (n_upper > 1) | (sentence_start & is_lower[starts])
+
+    # Single letters are only abnormal as a lower case "i"
+    single = lengths <= 1
+    abnormal[single] = codepoints[starts[single]] == ord('i')
+
+    return abnormal
+
+def batch_features(batch: TokenBatch, stopwords_set: set) -> dict:
+    '''
+    Computes the five features of every tweet in a batch. Tweets without words
+    or sentences get zeros, as in compute_features.
+
+    :param batch: Tokenized tweets in CSR layout
+    :type batch: TokenBatch
+    :param stopwords_set: Set of functional words
+    :type stopwords_set: set
+    :returns: Dict mapping V, S, W, F and C to arrays with one value per tweet
+    :rtype: dict
+    '''
+    n_tweets = batch.n_tweets
+    words = batch.words
+    n_words = np.diff(batch.word_offsets)
+    n_sentences = np.diff(batch.sentence_offsets)
+
+    tweet_of_word = np.repeat(np.arange(n_tweets), n_words)
+
+    # Distinct words, and the first occurrence of each word in its tweet for V
+    with span('feature.V', rows=n_tweets):
+        codes, vocabulary = pd.factorize(np.asarray(words, dtype=object))
+        repeated = pd.Series(tweet_of_word * len(vocabulary) + codes).duplicated().to_numpy()
+        n_unique = np.bincount(tweet_of_word[~repeated], minlength=n_tweets)
+
+    with span('feature.F', rows=n_tweets):
+        is_function = np.array([word.lower() in stopwords_set for word in vocabulary], dtype=bool)
+        n_function = np.bincount(tweet_of_word, weights=is_function[codes], minlength=n_tweets)
+
+    with span('feature.W', rows=n_tweets):
+        lengths = word_lengths(words)
+        n_chars = np.bincount(tweet_of_word, weights=lengths, minlength=n_tweets)
+
+    with span('feature.C', rows=n_tweets):
+        # Sentences with no words start at the end of their tweet and flag nothing
+        tweet_of_sentence = np.repeat(np.arange(n_tweets), n_sentences)
+        starts = batch.sentence_starts[batch.sentence_starts < batch.word_offsets[1:][tweet_of_sentence]]
+        sentence_start = np.zeros(len(words), dtype=bool)
+        sentence_start[starts] = True
+
+        abnormal = abnormal_capitalization(words, sentence_start, lengths)
+        n_abnormal = np.bincount(tweet_of_word, weights=abnormal, minlength=n_tweets)
+
+    # S needs only the word and sentence counts, so it is timed with the ratios
+    with span('feature.ratios', rows=n_tweets):
+        valid = (n_words > 0) & (n_sentences > 0)
+        totals = {'V': n_unique, 'S': n_words, 'W': n_chars, 'F': n_function, 'C': n_abnormal}
+        features = {}
+        for name in FEATURE_NAMES:
+            denominator = n_sentences if name == 'S' else n_words
+            features[name] = np.divide(totals[name], denominator, out=np.zeros(n_tweets),
+                                       where=valid)
+
+    return features
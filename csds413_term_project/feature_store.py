@@ -0,0 +1,363 @@
+'''
+Columnar feature store for the extracted tweet features.
+
+Every column of tweepfake_features.csv except the tweet text is kept as its own
+.npy file in a directory next to the CSV, so loaders can memory-map just the
+columns they ask for instead of parsing the whole CSV. String columns such as
+the label are stored as integer codes plus their list of categories. The
+chunked readers hand out ranges of rows, for analyses that stream over the
+features instead of loading them, and scan_features reduces the chunks to a
+mergeable summary, optionally over row ranges in parallel.
+
+:author: Jacob Anderson
+:version: 0.1.0
+'''
+
+import json
+import os
+import shutil
+from typing import Callable, Iterator
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed, effective_n_jobs
+from csds413_term_project import instrumentation
+from csds413_term_project.instrumentation import span
+
+META_FILE = 'meta.json'
+
+def store_path_for(csv_path: str) -> str:
+    '''
+    Gives the store directory that sits next to a features CSV.
+
+    :param csv_path: Path to the features CSV
+    :type csv_path: str
+    :returns: Path to the store directory
+    :rtype: str
+    '''
+    return os.path.splitext(csv_path)[0] + '_store'
+
+def _source_stamp(path: str) -> dict:
+    '''
+    Records size and modification time of a file to detect when it changes.
+    '''
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+class FeatureStoreWriter:
+    '''
+    Writes a feature store chunk by chunk. Columns are appended to raw files as
+    chunks arrive and turned into .npy files on close, so the full table never
+    has to be in memory. It has the same write/close interface as the pipeline
+    sinks, so it can be used as one.
+    '''
+    def __init__(self, store_path: str, exclude: tuple = ('text',),
+                 source_path: str = None):
+        self.store_path = store_path
+        self.exclude = set(exclude)
+        self.source_path = source_path
+        self.columns = None
+        self.dtypes = {}
+        self.categories = {}
+        self.n_rows = 0
+
+        # Removing the metadata first marks any previous store as incomplete
+        if os.path.exists(store_path):
+            shutil.rmtree(store_path)
+        os.makedirs(store_path)
+
+    def _part_path(self, column: str) -> str:
+        return os.path.join(self.store_path, f'{column}.part')
+
+    def write(self, chunk: pd.DataFrame):
+        if self.columns is None:
+            self.columns = [col for col in chunk.columns if col not in self.exclude]
+
+        for col in self.columns:
+            values = chunk[col]
+
+            if pd.api.types.is_numeric_dtype(values):
+                data = values.to_numpy()
+            else:
+                # Grows the category list as new values show up
+                known = self.categories.setdefault(col, [])
+                new_values = pd.unique(values[~values.isin(known)])
+                known.extend(str(value) for value in new_values)
+                data = pd.Index(known).get_indexer(values).astype(np.int32)
+
+            self.dtypes.setdefault(col, data.dtype)
+            with open(self._part_path(col), 'ab') as part:
+                part.write(np.ascontiguousarray(data, dtype=self.dtypes[col]).tobytes())
+
+        self.n_rows += len(chunk)
+
+    def close(self, source_path: str = None):
+        '''
+        Finishes the .npy files and writes the metadata.
+
+        :param source_path: CSV the store mirrors, recorded to detect staleness;
+            defaults to the one given to the constructor
+        :type source_path: str
+        '''
+        source_path = source_path or self.source_path
+
+        for col in self.columns or []:
+            header = {'descr': np.lib.format.dtype_to_descr(self.dtypes[col]),
+                      'fortran_order': False, 'shape': (self.n_rows,)}
+
+            with open(os.path.join(self.store_path, f'{col}.npy'), 'wb') as output:
+                np.lib.format.write_array_header_1_0(output, header)
+                with open(self._part_path(col), 'rb') as part:
+                    shutil.copyfileobj(part, output)
+            os.remove(self._part_path(col))
+
+        meta = {'columns': self.columns or [], 'n_rows': self.n_rows,
+                'categories': self.categories,
+                'source': _source_stamp(source_path) if source_path else None}
+        with open(os.path.join(self.store_path, META_FILE), 'w') as output:
+            json.dump(meta, output)
+
+def write_feature_store(features_df: pd.DataFrame, store_path: str,
+                        source_path: str = None):
+    '''
+    Writes a features DataFrame to a store in one go.
+
+    :param features_df: DataFrame with label and feature columns
+    :type features_df: pd.DataFrame
+    :param store_path: Store directory
+    :type store_path: str
+    :param source_path: CSV the store mirrors
+    :type source_path: str
+    '''
+    writer = FeatureStoreWriter(store_path)
+    writer.write(features_df)
+    writer.close(source_path)
+
+def build_feature_store(csv_path: str, store_path: str = None,
+                        chunk_size: int = 100000) -> str:
+    '''
+    Converts a features CSV into a store, reading the CSV in chunks and skipping
+    the text column.
+
+    :param csv_path: Path to the features CSV
+    :type csv_path: str
+    :param store_path: Store directory, next to the CSV if None
+    :type store_path: str
+    :param chunk_size: Number of rows per chunk
+    :type chunk_size: int
+    :returns: Path to the store directory
+    :rtype: str
+    '''
+    store_path = store_path or store_path_for(csv_path)
+    writer = FeatureStoreWriter(store_path)
+
+    for chunk in pd.read_csv(csv_path, sep=';', chunksize=chunk_size,
+                             usecols=lambda col: col != 'text'):
+        writer.write(chunk)
+    writer.close(csv_path)
+
+    return store_path
+
+def _open_columns(store_path: str, columns: list = None, mmap: bool = True) -> tuple:
+    '''
+    Opens the column files of a store.
+
+    :returns: Tuple metadata, dict mapping column names to their arrays
+    :rtype: tuple
+    '''
+    with open(os.path.join(store_path, META_FILE)) as meta_file:
+        meta = json.load(meta_file)
+
+    arrays = {col: np.load(os.path.join(store_path, f'{col}.npy'),
+                           mmap_mode='r' if mmap else None)
+              for col in columns or meta['columns']}
+    return meta, arrays
+
+def _frame(meta: dict, arrays: dict, rows: slice = slice(None)) -> pd.DataFrame:
+    '''
+    Wraps a range of rows of the column arrays in a DataFrame, decoding string
+    columns into categoricals.
+    '''
+    data = {}
+    for col, values in arrays.items():
+        values = values[rows]
+        if col in meta['categories']:
+            values = pd.Categorical.from_codes(values, meta['categories'][col])
+        data[col] = values
+
+    return pd.DataFrame(data, copy=False)
+
+def read_feature_store(store_path: str, columns: list = None,
+                       mmap: bool = True) -> pd.DataFrame:
+    '''
+    Loads columns from a store. Numeric columns are memory-mapped and wrapped
+    without copying; string columns come back as categoricals over their codes.
+
+    :param store_path: Store directory
+    :type store_path: str
+    :param columns: Columns to load, all stored columns if None
+    :type columns: list
+    :param mmap: Whether to memory-map the column files
+    :type mmap: bool
+    :returns: DataFrame with the requested columns
+    :rtype: pd.DataFrame
+    '''
+    meta, arrays = _open_columns(store_path, columns, mmap)
+    return _frame(meta, arrays)
+
+def iter_feature_store(store_path: str, columns: list = None, chunk_size: int = 100000,
+                       start: int = 0, stop: int = None) -> Iterator[pd.DataFrame]:
+    '''
+    Yields columns from a store in chunks of rows. The column files are
+    memory-mapped, so only the current chunk is read into memory.
+
+    :param store_path: Store directory
+    :type store_path: str
+    :param columns: Columns to load, all stored columns if None
+    :type columns: list
+    :param chunk_size: Number of rows per chunk
+    :type chunk_size: int
+    :param start: First row to read
+    :type start: int
+    :param stop: Row to stop before, the end of the store if None
+    :type stop: int
+    :returns: Iterator over DataFrames with the requested columns
+    :rtype: Iterator[pd.DataFrame]
+    '''
+    meta, arrays = _open_columns(store_path, columns)
+    stop = meta['n_rows'] if stop is None else min(stop, meta['n_rows'])
+
+    for chunk_start in range(start, stop, chunk_size):
+        yield _frame(meta, arrays, slice(chunk_start, min(chunk_start + chunk_size, stop)))
+
+def store_size(store_path: str) -> int:
+    '''
+    Gives the number of rows in a store.
+
+    :param store_path: Store directory
+    :type store_path: str
+    :returns: Number of rows
+    :rtype: int
+    '''
+    with open(os.path.join(store_path, META_FILE)) as meta_file:
+        return json.load(meta_file)['n_rows']
+
+def is_store_current(csv_path: str, store_path: str) -> bool:
+    '''
+    Checks that a store exists, is complete and matches the CSV on disk.
+
+    :param csv_path: Path to the features CSV
+    :type csv_path: str
+    :param store_path: Store directory
+    :type store_path: str
+    :returns: True if the store can be used in place of the CSV
+    :rtype: bool
+    '''
+    meta_path = os.path.join(store_path, META_FILE)
+    if not os.path.exists(meta_path):
+        return False
+    if not os.path.exists(csv_path):
+        return True
+
+    with open(meta_path) as meta_file:
+        return json.load(meta_file)['source'] == _source_stamp(csv_path)
+
+def load_features(csv_path: str, columns: list = None) -> pd.DataFrame:
+    '''
+    Loads feature columns, from the store next to the CSV when it is up to date.
+    Otherwise the store is (re)built from the CSV first, so only the first load
+    after an extraction pays for parsing the CSV.
+
+    :param csv_path: Path to the features CSV
+    :type csv_path: str
+    :param columns: Columns to load, all but the text if None
+    :type columns: list
+    :returns: DataFrame with the requested columns
+    :rtype: pd.DataFrame
+    '''
+    return read_feature_store(ensure_feature_store(csv_path), columns)
+
+def ensure_feature_store(csv_path: str) -> str:
+    '''
+    Builds or rebuilds the store next to a features CSV unless it is up to date.
+
+    :param csv_path: Path to the features CSV
+    :type csv_path: str
+    :returns: Path to the store directory
+    :rtype: str
+    '''
+    store_path = store_path_for(csv_path)
+    if not is_store_current(csv_path, store_path):
+        build_feature_store(csv_path, store_path)
+
+    return store_path
+
+def iter_features(csv_path: str, columns: list = None,
+                  chunk_size: int = 100000) -> Iterator[pd.DataFrame]:
+    '''
+    Yields feature columns in chunks of rows, from the store next to the CSV, so
+    the full table is never held in memory.
+
+    :param csv_path: Path to the features CSV
+    :type csv_path: str
+    :param columns: Columns to load, all but the text if None
+    :type columns: list
+    :param chunk_size: Number of rows per chunk
+    :type chunk_size: int
+    :returns: Iterator over DataFrames with the requested columns
+    :rtype: Iterator[pd.DataFrame]
+    '''
+    return iter_feature_store(ensure_feature_store(csv_path), columns, chunk_size)
+
+def _scan_range(store_path: str, columns: list, summarize: Callable, chunk_size: int,
+                start: int, stop: int):
+    '''
+    Summarizes a range of rows of a store chunk by chunk, merging the chunk
+    summaries. Returns None for an empty range.
+    '''
+    result = None
+    with span('features.scan', rows=stop - start, start=start):
+        for chunk in iter_feature_store(store_path, columns, chunk_size, start, stop):
+            summary = summarize(chunk)
+            result = summary if result is None else result.merge(summary)
+    return result
+
+def scan_features(csv_path: str, columns: list, summarize: Callable, chunk_size: int = 100000,
+                  n_workers: int = 1):
+    '''
+    Makes one pass over the features in chunks of rows and reduces them to a
+    summary. summarize maps a chunk to a summary object whose merge method adds
+    the summary of the following rows and returns the result. With several
+    workers, each takes a contiguous range of rows and the range summaries are
+    merged in row order.
+
+    :param csv_path: Path to the features CSV
+    :type csv_path: str
+    :param columns: Columns to read
+    :type columns: list
+    :param summarize: Picklable function mapping a chunk DataFrame to a summary
+    :type summarize: Callable
+    :param chunk_size: Number of rows per chunk
+    :type chunk_size: int
+    :param n_workers: Number of worker processes, all cores if None
+    :type n_workers: int
+    :returns: Summary of all rows, None if there are none
+    '''
+    store_path = ensure_feature_store(csv_path)
+    n_rows = store_size(store_path)
+
+    if n_workers == 1:
+        return _scan_range(store_path, columns, summarize, chunk_size, 0, n_rows)
+
+    n_jobs = -1 if n_workers is None else n_workers
+    bounds = np.linspace(0, n_rows, effective_n_jobs(n_jobs) + 1).astype(int)
+
+    scan_range = instrumentation.in_worker(_scan_range)
+    parallel = Parallel(n_jobs=n_jobs)
+    result = None
+    for output in parallel(delayed(scan_range)(store_path, columns, summarize, chunk_size,
+                                               start, stop)
+                           for start, stop in zip(bounds[:-1], bounds[1:])):
+        summary = instrumentation.unwrap(output)
+        if summary is not None:
+            result = summary if result is None else result.merge(summary)
+    return result
@@ -0,0 +1,342 @@
+'''
+Lightweight timing spans for the preprocessing and analysis scripts.
+
+A span wraps one step of a run, e.g. a filter, the tokenization of a chunk or
+a classifier fit, and records its wall time, CPU time, row count and peak
+resident memory. Spans nest, and on Linux the peak of every span is its own:
+the peak is reset when a span opens and handed up to the enclosing span when
+it closes. Recording is off by default, and a disabled span costs one global
+lookup, so the library code can stay instrumented permanently.
+
+Work that runs on a process pool is recorded in the worker. Functions
+submitted to a pool are wrapped with in_worker, and their results passed
+through unwrap, which merges the worker's spans into the parent's. The Chrome
+trace then shows one track per process.
+
+A finished run can be summarized as a table per span name and exported as a
+Chrome trace (chrome://tracing or https://ui.perfetto.dev).
+
+:author: Jacob Anderson
+:version: 0.1.0
+'''
+
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, NamedTuple
+import pandas as pd
+from csds413_term_project.memory import peak_rss_mb, reset_peak_rss
+
+# Environment variable naming the trace file, for scripts without a command line
+PROFILE_ENV = 'CSDS413_PROFILE'
+
+class Span:
+    '''
+    One timed step. rows may be set inside the with block once it is known.
+    '''
+    __slots__ = ('name', 'rows', 'args', 'start', 'wall', 'cpu', 'peak_rss_mb',
+                 'depth', 'pid', 'tid', '_child_peak')
+
+    def __init__(self, name: str, rows: int = None, args: dict = None):
+        self.name = name
+        self.rows = rows
+        self.args = args or {}
+        self.start = 0.0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.peak_rss_mb = None
+        self.depth = 0
+        self.pid = 0
+        self.tid = 0
+        self._child_peak = None
+
+    def __repr__(self) -> str:
+        return f"Span({self.name!r}, rows={self.rows}, wall={self.wall:.6f})"
+
+class WorkerOutput(NamedTuple):
+    '''
+    Result of a function run by in_worker, together with the spans it recorded.
+    '''
+    result: object
+    spans: list
+
+_enabled = False
+_trace_path = None
+_spans = []
+_open = threading.local()
+_peak_resettable = None
+
+# Handed out while recording is off; whatever is set on it is discarded
+_NULL_SPAN = Span('')
+
+def enable(trace_path: str = None):
+    '''
+    Turns recording on.
+
+    :param trace_path: Where report writes the Chrome trace, no trace if None
+    :type trace_path: str
+    '''
+    global _enabled, _trace_path, _peak_resettable
+    _enabled = True
+    _trace_path = trace_path
+    if _peak_resettable is None:
+        _peak_resettable = reset_peak_rss()
+
+def enable_from_env() -> bool:
+    '''
+    Turns recording on if the CSDS413_PROFILE environment variable is set. Its
+    value is the trace path; an empty value records without writing a trace.
+
+    :returns: Whether recording is on
+    :rtype: bool
+    '''
+    if PROFILE_ENV in os.environ:
+        enable(os.environ[PROFILE_ENV] or None)
+    return _enabled
+
+def disable():
+    '''
+    Turns recording off. Spans recorded so far are kept.
+    '''
+    global _enabled
+    _enabled = False
+
+def is_enabled() -> bool:
+    return _enabled
+
+def reset():
+    '''
+    Drops all recorded spans.
+    '''
+    _spans.clear()
+
+def spans() -> list:
+    '''
+    Returns the finished spans in the order they closed.
+
+    :returns: List of Span
+    :rtype: list
+    '''
+    return list(_spans)
+
+def _open_spans() -> list:
+    stack = getattr(_open, 'stack', None)
+    if stack is None:
+        stack = _open.stack = []
+    return stack
+
+@contextmanager
+def span(name: str, rows: int = None, **args) -> Iterator[Span]:
+    '''
+    Times the enclosed block. Extra keyword arguments are stored with the span
+    and shown in the Chrome trace.
+
+    :param name: Span name, dotted by convention, e.g. clean.filter_html
+    :type name: str
+    :param rows: Number of rows the step processes
+    :type rows: int
+    :returns: Context manager yielding the Span
+    :rtype: Iterator[Span]
+    '''
+    if not _enabled:
+        yield _NULL_SPAN
+        return
+
+    record = Span(name, rows, args)
+    stack = _open_spans()
+    record.depth = len(stack)
+    record.pid = os.getpid()
+    record.tid = threading.get_native_id()
+
+    # The enclosing span keeps the peak reached so far before it is reset
+    if _peak_resettable:
+        if stack:
+            parent = stack[-1]
+            parent._child_peak = max(parent._child_peak or 0.0, peak_rss_mb())
+        reset_peak_rss()
+
+    stack.append(record)
+    start_cpu = time.process_time()
+    record.start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record.wall = time.perf_counter() - record.start
+        record.cpu = time.process_time() - start_cpu
+        stack.pop()
+
+        record.peak_rss_mb = peak_rss_mb()
+        if record._child_peak is not None:
+            record.peak_rss_mb = max(record.peak_rss_mb, record._child_peak)
+        if _peak_resettable and stack:
+            stack[-1]._child_peak = max(stack[-1]._child_peak or 0.0, record.peak_rss_mb)
+
+        _spans.append(record)
+
+def traced(name: str = None, rows: Callable = None) -> Callable:
+    '''
+    Decorator running every call of a function in a span.
+
+    :param name: Span name, the function's qualified name if None
+    :type name: str
+    :param rows: Function of the first argument giving the row count, e.g. len
+    :type rows: Callable
+    :returns: Decorator
+    :rtype: Callable
+    '''
+    def decorate(func: Callable) -> Callable:
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            n_rows = rows(args[0]) if rows is not None and args else None
+            with span(span_name, n_rows):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+class _WorkerCall:
+    '''
+    Picklable wrapper recording the spans of a function run in another process.
+    '''
+    def __init__(self, func: Callable):
+        self.func = func
+
+    def __call__(self, *args, **kwargs) -> WorkerOutput:
+        global _enabled, _spans
+        was_enabled, outer_spans = _enabled, _spans
+
+        # Pool workers are reused, so every call records into a fresh list
+        _spans = []
+        enable(_trace_path)
+        try:
+            result = self.func(*args, **kwargs)
+            return WorkerOutput(result, _spans)
+        finally:
+            _enabled, _spans = was_enabled, outer_spans
+
+def in_worker(func: Callable) -> Callable:
+    '''
+    Wraps a function submitted to a process pool so that the spans it records
+    come back with its result. Returns the function itself while recording is
+    off, so the result needs no unwrapping then.
+
+    :param func: Picklable function
+    :type func: Callable
+    :returns: Function to submit instead
+    :rtype: Callable
+    '''
+    return _WorkerCall(func) if _enabled else func
+
+def unwrap(output):
+    '''
+    Takes the result of a function wrapped by in_worker, merging its spans.
+
+    :param output: Value returned by the pool
+    :returns: Result of the wrapped function
+    '''
+    if isinstance(output, WorkerOutput):
+        _spans.extend(output.spans)
+        return output.result
+    return output
+
+def summary_table(recorded: list = None) -> pd.DataFrame:
+    '''
+    Aggregates spans per name, slowest first.
+
+    :param recorded: List of Span, all recorded spans if None
+    :type recorded: list
+    :returns: DataFrame with calls, wall and CPU seconds, rows, rows per second
+        and the highest peak RSS of each span name
+    :rtype: pd.DataFrame
+    '''
+    recorded = _spans if recorded is None else recorded
+    columns = ['span', 'calls', 'wall_s', 'cpu_s', 'rows', 'rows_per_s', 'peak_rss_mb']
+    if not recorded:
+        return pd.DataFrame(columns=columns)
+
+    frame = pd.DataFrame({
+        'span': [record.name for record in recorded],
+        'wall_s': [record.wall for record in recorded],
+        'cpu_s': [record.cpu for record in recorded],
+        'rows': [record.rows for record in recorded],
+        'peak_rss_mb': [record.peak_rss_mb for record in recorded],
+    })
+
+    table = frame.groupby('span', sort=False).agg(
+        calls=('wall_s', 'size'), wall_s=('wall_s', 'sum'), cpu_s=('cpu_s', 'sum'),
+        rows=('rows', lambda rows: rows.sum(min_count=1)), peak_rss_mb=('peak_rss_mb', 'max')
+    ).reset_index()
+    table['rows_per_s'] = table['rows'] / table['wall_s']
+
+    return table[columns].sort_values('wall_s', ascending=False, ignore_index=True)
+
+def chrome_trace(recorded: list = None) -> dict:
+    '''
+    Converts spans to the Chrome trace event format.
+
+    :param recorded: List of Span, all recorded spans if None
+    :type recorded: list
+    :returns: Trace as a JSON-serializable dict
+    :rtype: dict
+    '''
+    recorded = _spans if recorded is None else recorded
+    origin = min((record.start for record in recorded), default=0.0)
+    main_pid = os.getpid()
+
+    events = []
+    for pid in dict.fromkeys(record.pid for record in recorded):
+        events.append({'name': 'process_name', 'ph': 'M', 'pid': pid,
+                       'args': {'name': 'main' if pid == main_pid else f'worker {pid}'}})
+
+    for record in recorded:
+        args = {'rows': record.rows, 'cpu_ms': record.cpu * 1e3,
+                'peak_rss_mb': record.peak_rss_mb, **record.args}
+        events.append({
+            'name': record.name, 'cat': record.name.split('.')[0], 'ph': 'X',
+            'ts': (record.start - origin) * 1e6, 'dur': record.wall * 1e6,
+            'pid': record.pid, 'tid': record.tid,
+            'args': {key: value for key, value in args.items() if value is not None},
+        })
+
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+def write_chrome_trace(path: str, recorded: list = None):
+    '''
+    Writes spans as a Chrome trace JSON file.
+
+    :param path: Output path
+    :type path: str
+    :param recorded: List of Span, all recorded spans if None
+    :type recorded: list
+    '''
+    with open(path, 'w') as trace_file:
+        json.dump(chrome_trace(recorded), trace_file, default=str)
+
+def report():
+    '''
+    Prints the summary table and writes the Chrome trace given to enable. Does
+    nothing while recording is off.
+    '''
+    if not _enabled:
+        return
+
+    def fixed(decimals: int) -> Callable:
+        return lambda value: f"{value:.{decimals}f}"
+
+    print("\nProfile (peak RSS per span" + ("" if _peak_resettable else ", cumulative") + "):")
+    print(summary_table().to_string(index=False, na_rep='-', formatters={
+        'wall_s': fixed(3), 'cpu_s': fixed(3), 'rows': fixed(0),
+        'rows_per_s': fixed(0), 'peak_rss_mb': fixed(1),
+    }))
+
+    if _trace_path is not None:
+        write_chrome_trace(_trace_path)
+        print(f"Chrome trace saved to {_trace_path}")
@@ -1,53 +1,136 @@
 '''
 Cohen's d effect size computation.
 
+The point estimates come from one streaming pass of group statistics. Besides
+them, reports bootstrap or jackknife confidence intervals for the group means,
+their difference and Cohen's d of all features.
+
 :author: Jacob Anderson
 :version: 0.1.0
 '''
 
+import argparse
 import pandas as pd
 import numpy as np
+from csds413_term_project.bootstrap import METHODS, StreamingBootstrap, effect_size_intervals
+from csds413_term_project.feature_store import iter_features, load_features
+from csds413_term_project.sufficient_stats import cohens_d, feature_statistics
+from csds413_term_project import instrumentation
 
-def compute_cohens_d(group1: np.ndarray, group2: np.ndarray) -> float:
+def streaming_intervals(csv_path: str, features: list, n_resamples: int, confidence: float,
+                        seed: int, chunk_size: int, max_block_mb: float) -> dict:
     '''
-    Computes Cohen's d effect size between two groups.
-    
-    :param group1: Data for first group
-    :type group1: np.ndarray
-    :param group2: Data for second group
-    :type group2: np.ndarray
-    :returns: Cohen's d effect size
-    :rtype: float
+    Computes Poisson bootstrap percentile intervals reading the features chunk
+    by chunk, so the table is never held in memory.
+
+    :param csv_path: Path to the features CSV
+    :type csv_path: str
+    :param features: Feature columns
+    :type features: list
+    :param n_resamples: Number of bootstrap resamples
+    :type n_resamples: int
+    :param confidence: Confidence level
+    :type confidence: float
+    :param seed: Seed for the resampling weights
+    :type seed: int
+    :param chunk_size: Rows per chunk
+    :type chunk_size: int
+    :param max_block_mb: Memory budget for the weights of a chunk in megabytes
+    :type max_block_mb: float
+    :returns: Dict mapping statistic names to ConfidenceInterval
+    :rtype: dict
     '''
-    n1, n2 = len(group1), len(group2)
-    var1, var2 = np.var(group1, ddof=1), np.var(group2, ddof=1)
-    
-    pooled_std = np.sqrt(((n1 - 1) * var1 + (n2 - 1) * var2) / (n1 + n2 - 2))
-    
-    d = (np.mean(group1) - np.mean(group2)) / pooled_std
-    
-    return d
+    accumulator = StreamingBootstrap(n_resamples, len(features), seed=seed,
+                                     max_block_mb=max_block_mb)
+    for chunk in iter_features(csv_path, ['label'] + features, chunk_size):
+        accumulator.update(chunk[features].to_numpy(dtype=float),
+                           (chunk['label'] == 'human').to_numpy())
+
+    return accumulator.intervals(confidence)
+
+def interval_table(intervals: dict, features: list) -> pd.DataFrame:
+    '''
+    Lays the intervals out with one row per feature and statistic.
+
+    :param intervals: Dict mapping statistic names to ConfidenceInterval
+    :type intervals: dict
+    :param features: Feature names
+    :type features: list
+    :returns: DataFrame with estimate, lower, upper and std_error columns
+    :rtype: pd.DataFrame
+    '''
+    rows = []
+    for j, feature in enumerate(features):
+        for statistic, interval in intervals.items():
+            rows.append({
+                'feature': feature,
+                'statistic': statistic,
+                'estimate': interval.estimate[j],
+                'lower': interval.lower[j],
+                'upper': interval.upper[j],
+                'std_error': interval.standard_error[j]
+            })
+
+    return pd.DataFrame(rows)
 
 def main():
+    parser = argparse.ArgumentParser(description="Cohen's d with confidence intervals")
+    parser.add_argument('--resamples', type=int, default=2000,
+                       help='Bootstrap resamples (0 for point estimates only)')
+    parser.add_argument('--method', type=str, default='bca', choices=METHODS,
+                       help='Interval method')
+    parser.add_argument('--confidence', type=float, default=0.95,
+                       help='Confidence level')
+    parser.add_argument('--max-block-mb', type=float, default=32.0,
+                       help='Memory budget for a block of resamples in megabytes')
+    parser.add_argument('--streaming', action='store_true',
+                       help='Read the features in chunks with a Poisson bootstrap (percentile intervals)')
+    parser.add_argument('--chunk-size', type=int, default=100000,
+                       help='Rows per chunk when streaming over the features')
+    parser.add_argument('--seed', type=int, default=42,
+                       help='Seed for the resamples')
+    parser.add_argument('--profile', type=str, default=None, metavar='TRACE_JSON',
+                       help='Print per-step timings and write a Chrome trace')
+    args = parser.parse_args()
+
+    if args.profile:
+        instrumentation.enable(args.profile)
+
     np.random.seed(42)
     
-    df = pd.read_csv('../../data/tweepfake_features.csv', sep=';')
+    features = ['V', 'S', 'W', 'F', 'C']
+    csv_path = '../../data/tweepfake_features.csv'
     
-    human_data = df[df['label'] == 'human']
-    bot_data = df[df['label'] == 'bot']
+    # Point estimates come from one pass of per-group sums and cross-products
+    stats = feature_statistics(csv_path, features, chunk_size=args.chunk_size)
+    means = stats.means
+    effect_sizes = cohens_d(stats)
     
-    features = ['V', 'S', 'W', 'F', 'C']
     print(f"{'Feature':<30} {'Human Mean':<12} {'Bot Mean':<12} {'Cohen\'s d':<12}")
     
-    for feature in features:
-        human_vals = human_data[feature].values
-        bot_vals = bot_data[feature].values
-        
-        human_mean = np.mean(human_vals)
-        bot_mean = np.mean(bot_vals)
-        
-        d = compute_cohens_d(human_vals, bot_vals)
+    for j, feature in enumerate(features):
+        print(f"{feature:<30} {means[0, j]:<12.4f} {means[1, j]:<12.4f} {effect_sizes[j]:<12.4f}")
+    
+    if args.resamples > 0:
+        if args.streaming:
+            method = 'percentile, Poisson bootstrap'
+            intervals = streaming_intervals(csv_path, features, args.resamples, args.confidence,
+                                            args.seed, args.chunk_size, args.max_block_mb)
+        else:
+            method = args.method
+            df = load_features(csv_path, columns=['label'] + features)
+            X = df[features].to_numpy(dtype=float)
+            in_human = (df['label'] == 'human').to_numpy()
+            
+            intervals = effect_size_intervals(X, in_human, n_resamples=args.resamples,
+                                              confidence=args.confidence, method=args.method,
+                                              seed=args.seed, max_block_mb=args.max_block_mb)
         
-        print(f"{feature:<30} {human_mean:<12.4f} {bot_mean:<12.4f} {d:<12.4f}")
+        print(f"\n{args.confidence:.0%} confidence intervals ({method}"
+              + ("" if method == 'jackknife' else f", {args.resamples} resamples")
+              + "; mean1 human, mean2 bot):")
+        print(interval_table(intervals, features).to_string(index=False))
+    
+    instrumentation.report()
         
 if __name__ == "__main__": main()
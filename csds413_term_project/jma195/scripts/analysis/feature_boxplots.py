@@ -1,16 +1,37 @@
 '''
 Feature box plot visualization script.
 
+The box statistics are streamed: the quartiles come from quantile sketches of
+one pass over the features, the whiskers and a sample of the outliers from a
+second pass, so the feature table is never loaded as a whole.
+
 :author: Jacob Anderson
 :version: 0.1.0
 '''
 
-import pandas as pd
+import argparse
 import matplotlib.pyplot as plt
 import seaborn as sns
+from csds413_term_project.streaming import box_statistics, summarize_features
+from csds413_term_project.sufficient_stats import GROUPS
+from csds413_term_project import instrumentation
+from csds413_term_project.instrumentation import span
 
 def main():
-    df = pd.read_csv('../../data/tweepfake_features.csv', sep=';')
+    parser = argparse.ArgumentParser(description='Feature box plots')
+    parser.add_argument('--relative-accuracy', type=float, default=0.001,
+                       help='Relative accuracy of the sketched quartiles')
+    parser.add_argument('--max-outliers', type=int, default=1000,
+                       help='Outliers drawn per group and feature')
+    parser.add_argument('--chunk-size', type=int, default=100000,
+                       help='Rows per chunk when streaming over the features')
+    parser.add_argument('--workers', type=int, default=1,
+                       help='Worker processes (-1 for all cores)')
+    args = parser.parse_args()
+    
+    instrumentation.enable_from_env()
+    
+    csv_path = '../../data/tweepfake_features.csv'
     
     features = {
         'V': 'Vocabulary Richness',
@@ -20,6 +41,13 @@ def main():
         'C': 'Capitalization Abnormality'
     }
     
+    feature_cols = list(features)
+    summary = summarize_features(csv_path, feature_cols,
+                                 relative_accuracy=args.relative_accuracy,
+                                 chunk_size=args.chunk_size, n_workers=args.workers)
+    boxes = box_statistics(csv_path, feature_cols, summary, max_outliers=args.max_outliers,
+                           chunk_size=args.chunk_size, n_workers=args.workers)
+    
     sns.set_style("whitegrid")
     fig, axes = plt.subplots(2, 3, figsize=(18, 10))
     axes = axes.flatten()
@@ -29,10 +57,15 @@ def main():
     for i, (feature, feature_name) in enumerate(features.items()):
         ax = axes[i]
         
-        data = df[[feature, 'label']].copy()
-        data['label'] = data['label'].str.capitalize()
+        labels = [label.capitalize() for label in GROUPS]
+        stats = [dict(boxes[group][i], label=label) for group, label in enumerate(labels)]
         
-        sns.boxplot(x='label', y=feature, data=data, ax=ax, palette=colors)
+        artists = ax.bxp(stats, patch_artist=True, widths=0.8,
+                         medianprops={'color': '0.25'},
+                         flierprops={'marker': 'd', 'markerfacecolor': '0.25',
+                                     'markeredgecolor': '0.25', 'markersize': 4})
+        for box, label in zip(artists['boxes'], labels):
+            box.set_facecolor(colors[label])
         
         ax.set_xlabel('', fontsize=12)
         ax.set_ylabel(feature_name, fontsize=12, labelpad=10)
@@ -41,7 +74,10 @@ def main():
     
     fig.delaxes(axes[5])
     
-    plt.tight_layout()
-    plt.savefig('../../figures/feature_boxplots.png', dpi=300, bbox_inches='tight')
+    with span('plot.boxplots'):
+        plt.tight_layout()
+        plt.savefig('../../figures/feature_boxplots.png', dpi=300, bbox_inches='tight')
+    
+    instrumentation.report()
 
 if __name__ == "__main__": main()
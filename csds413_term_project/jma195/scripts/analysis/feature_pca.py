@@ -5,24 +5,29 @@ PCA visualization script.
 :version: 0.1.0
 '''
 
-import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 from sklearn.decomposition import PCA
 from sklearn.preprocessing import StandardScaler
+from csds413_term_project.feature_store import load_features
+from csds413_term_project import instrumentation
+from csds413_term_project.instrumentation import span
 
 def main():
+    instrumentation.enable_from_env()
     np.random.seed(42)
     
-    df = pd.read_csv('../../data/tweepfake_features.csv', sep=';')
+    df = load_features('../../data/tweepfake_features.csv')
     feature_cols = ['V', 'S', 'W', 'F', 'C']
     
-    scaler = StandardScaler()
-    features_standardized = scaler.fit_transform(df[feature_cols])
+    with span('scale', rows=len(df)):
+        scaler = StandardScaler()
+        features_standardized = scaler.fit_transform(df[feature_cols])
     
-    pca = PCA(n_components=2)
-    pca_coords = pca.fit_transform(features_standardized)
+    with span('fit.PCA', rows=len(df)):
+        pca = PCA(n_components=2)
+        pca_coords = pca.fit_transform(features_standardized)
     
     df['PC1'] = pca_coords[:, 0]
     df['PC2'] = pca_coords[:, 1]
@@ -46,7 +51,10 @@ def main():
     plt.legend(fontsize=12, loc='best')
     plt.grid(True, alpha=0.3)
     
-    plt.tight_layout()
-    plt.savefig('../../figures/pca_projection.png', dpi=300, bbox_inches='tight')
+    with span('plot.pca'):
+        plt.tight_layout()
+        plt.savefig('../../figures/pca_projection.png', dpi=300, bbox_inches='tight')
+    
+    instrumentation.report()
 
 if __name__ == "__main__": main()
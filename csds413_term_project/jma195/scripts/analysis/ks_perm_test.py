@@ -1,34 +1,105 @@
 '''
 KS test script.
 
+Every feature column is sorted once, and the observed KS statistics of all
+features come from that one sort. A label-permutation KS test scores every
+feature on the same permutations, and the summary adds p-values corrected for
+testing several features.
+
 :author: Jacob Anderson
 :version: 0.1.0
 '''
 
+import argparse
 import pandas as pd
 import numpy as np
 from scipy import stats
+from csds413_term_project.feature_store import load_features
+from csds413_term_project.ks_permutation import (
+    CORRECTIONS, MAX_EXACT_N, adjust_p_values, ks_analytic_p_values, ks_permutation_test,
+    presort_columns
+)
+from csds413_term_project.permutation import make_progress_printer
+from csds413_term_project import instrumentation
+from csds413_term_project.instrumentation import span
+
+def ks_p_values(X: np.ndarray, in_group1: np.ndarray, statistics: np.ndarray) -> np.ndarray:
+    '''
+    Computes the p-values scipy's ks_2samp reports: exact for small groups,
+    asymptotic otherwise, so the large case needs no further pass over the data.
 
+    :param X: Feature matrix of shape (n_samples, n_features)
+    :type X: np.ndarray
+    :param in_group1: Boolean array marking group 1
+    :type in_group1: np.ndarray
+    :param statistics: Observed KS statistics
+    :type statistics: np.ndarray
+    :returns: p-values
+    :rtype: np.ndarray
+    '''
+    n1 = int(in_group1.sum())
+    n2 = len(in_group1) - n1
+    if max(n1, n2) <= MAX_EXACT_N:
+        return np.array([stats.ks_2samp(X[in_group1, j], X[~in_group1, j]).pvalue
+                         for j in range(X.shape[1])])
+    return ks_analytic_p_values(statistics, n1, n2)
 
 def main():
-    np.random.seed(42)
-    df = pd.read_csv('../../data/tweepfake_features.csv', sep=';')
-    
-    results = []
-    for feature in ['V', 'S', 'W', 'F', 'C']:
-        human_data = df[df['label'] == 'human'][feature].values
-        bot_data = df[df['label'] == 'bot'][feature].values
-        
-        ks_stat, p_value = stats.ks_2samp(human_data, bot_data)
-        
-        results.append({
-            'feature': feature,
-            'ks_statistic': ks_stat,
-            'p_value': p_value
-        })
-    
-    results_df = pd.DataFrame(results)
-    
+    parser = argparse.ArgumentParser(description='Multi-feature KS permutation test')
+    parser.add_argument('--features', type=str, default='V,S,W,F,C',
+                       help='Comma-separated feature list')
+    parser.add_argument('--permutations', type=int, default=10000,
+                       help='Number of label permutations (0 for the observed statistics only)')
+    parser.add_argument('--correction', type=str, default='holm', choices=CORRECTIONS,
+                       help='Multiple-testing correction of the permutation p-values')
+    parser.add_argument('--max-block-mb', type=float, default=32.0,
+                       help='Memory budget for a permutation block in megabytes')
+    parser.add_argument('--workers', type=int, default=1,
+                       help='Worker processes (-1 for all cores)')
+    parser.add_argument('--chunk-size', type=int, default=1000,
+                       help='Permutations per worker chunk')
+    parser.add_argument('--seed', type=int, default=42,
+                       help='Seed for the permutations')
+    parser.add_argument('--profile', type=str, default=None, metavar='TRACE_JSON',
+                       help='Print per-step timings and write a Chrome trace')
+    args = parser.parse_args()
+
+    if args.profile:
+        instrumentation.enable(args.profile)
+
+    feature_cols = [f.strip() for f in args.features.split(',')]
+
+    df = load_features('../../data/tweepfake_features.csv', columns=['label'] + feature_cols)
+    X = df[feature_cols].to_numpy(dtype=float)
+    in_group1 = (df['label'] == 'human').to_numpy()
+
+    with span('ks.presort', rows=len(X)):
+        presorted = presort_columns(X)
+
+    result = ks_permutation_test(
+        X, in_group1, n_permutations=args.permutations, seed=args.seed,
+        n_workers=args.workers, chunk_size=args.chunk_size,
+        max_block_mb=args.max_block_mb, presorted=presorted,
+        progress=make_progress_printer(every=args.chunk_size))
+
+    results_df = pd.DataFrame({
+        'feature': feature_cols,
+        'ks_statistic': result.statistics,
+        'p_value': ks_p_values(X, in_group1, result.statistics),
+    })
+
+    if args.permutations > 0:
+        results_df['perm_p_value'] = result.p_values
+        if args.correction == 'max_t':
+            results_df['adjusted_p_value'] = result.max_t_p_values
+        else:
+            results_df['adjusted_p_value'] = adjust_p_values(result.p_values, args.correction)
+        results_df['max_t_p_value'] = result.max_t_p_values
+
     print(results_df.to_string(index=False))
+    if args.permutations > 0:
+        print(f"\n{args.permutations} permutations, adjusted p-values: {args.correction}")
+
+    instrumentation.report()
 
 if __name__ == "__main__": main()
@@ -1,112 +1,464 @@
 '''
 Mahalanobis distance permutation test script for TweepFake dataset.
 
+With --sweep or --subsets, every feature subset is tested in one run. The
+features are loaded and standardized once, every permutation block draws its
+labels and group sums once for all features, and the distance of each subset
+comes from the submatrix of the full pooled covariance.
+
 :author: Jacob Anderson
 :version: 0.1.0
 '''
 
 import argparse
+from functools import partial
+from itertools import combinations
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.patches import Patch
 import seaborn as sns
-from sklearn.preprocessing import StandardScaler
+from scipy import linalg
+from csds413_term_project.ks_permutation import adjust_p_values
+from csds413_term_project.permutation import (
+    make_progress_printer, permutation_p_value, run_permutations, run_sequential_permutations
+)
+from csds413_term_project.feature_store import load_features
+from csds413_term_project.sufficient_stats import (
+    GroupStatistics, cholesky_factor, group_codes, mahalanobis_distance, mean_difference,
+    whiten
+)
+from csds413_term_project import instrumentation
+from csds413_term_project.instrumentation import span, traced
 
-def compute_mahalanobis_distance(mean_human: np.ndarray, mean_bot: np.ndarray,
-                                 cov_inv: np.ndarray) -> float:
+def compute_block_size(n_samples: int, max_block_mb: float = 32.0) -> int:
     '''
-    Computes Mahalanobis distance between two group centroids.
+    Computes how many permutations fit in one block under a memory budget. Each
+    permutation in a block holds a row of random keys, which is overwritten in
+    place by its indicator row, plus scratch space for the partition.
     
-    :param mean_human: Mean feature vector for human tweets
-    :type mean_human: np.ndarray
-    :param mean_bot: Mean feature vector for bot tweets
-    :type mean_bot: np.ndarray
-    :param cov_inv: Inverse of pooled covariance matrix
-    :type cov_inv: np.ndarray
-    :returns: Mahalanobis distance
-    :rtype: float
+    :param n_samples: Number of tweets being permuted
+    :type n_samples: int
+    :param max_block_mb: Memory budget for a block in megabytes
+    :type max_block_mb: float
+    :returns: Number of permutations per block
+    :rtype: int
     '''
-    diff = mean_human - mean_bot
-    distance = np.sqrt(diff.T @ cov_inv @ diff)
-    return distance
+    bytes_per_permutation = 2 * n_samples * np.dtype(np.float64).itemsize
+    return max(1, int(max_block_mb * 2**20) // bytes_per_permutation)
 
-def compute_pooled_covariance(data_human: np.ndarray, 
-                              data_bot: np.ndarray) -> np.ndarray:
+def permutation_block_differences(data: np.ndarray, n_human: int, block_size: int,
+                                  rng: np.random.Generator) -> np.ndarray:
     '''
-    Computes pooled covariance matrix for two groups.
+    Computes the differences of the group means for a whole block of label
+    permutations. Each row of the indicator matrix marks the tweets relabelled as
+    human, so the group sums of every permutation in the block come out of a
+    single matrix product.
     
-    :param data_human: Feature matrix for human tweets
-    :type data_human: np.ndarray
-    :param data_bot: Feature matrix for bot tweets
-    :type data_bot: np.ndarray
-    :returns: Pooled covariance matrix
+    :param data: Feature matrix for all tweets
+    :type data: np.ndarray
+    :param n_human: Number of tweets in the human group
+    :type n_human: int
+    :param block_size: Number of permutations in the block
+    :type block_size: int
+    :param rng: Random generator used to draw the permutations
+    :type rng: np.random.Generator
+    :returns: Array of shape (block_size, n_features), human minus bot means
     :rtype: np.ndarray
     '''
-    n_human = data_human.shape[0]
-    n_bot = data_bot.shape[0]
+    n_total = data.shape[0]
+    
+    # The n_human smallest random keys in a row pick a uniform random human group;
+    # float64 keys make a tie at the cutoff vanishingly unlikely
+    keys = rng.random((block_size, n_total))
+    cutoff = np.partition(keys, n_human - 1, axis=1)[:, n_human - 1:n_human]
+    indicator = np.less_equal(keys, cutoff, out=keys)
     
-    cov_human = np.cov(data_human, rowvar=False)
-    cov_bot = np.cov(data_bot, rowvar=False)
+    human_sums = indicator @ data
+    total_sums = data.sum(axis=0)
     
-    pooled_cov = ((n_human - 1) * cov_human + (n_bot - 1) * cov_bot) / \
-                 (n_human + n_bot - 2)
+    mean_human = human_sums / n_human
+    mean_bot = (total_sums - human_sums) / (n_total - n_human)
     
-    return pooled_cov
+    return mean_human - mean_bot
 
-def mahalanobis_permutation_test(features_df: pd.DataFrame, 
-                                 feature_cols: list,
-                                 n_permutations: int = 10000) -> tuple:
+def permutation_block_distances(whitened_data: np.ndarray, n_human: int,
+                                block_size: int, rng: np.random.Generator) -> np.ndarray:
     '''
-    Performs permutation test using Mahalanobis distance as test statistic.
+    Computes Mahalanobis distances for a whole block of label permutations. The
+    data is whitened with the pooled covariance, so each distance is the
+    Euclidean norm of the difference of the group means.
+    
+    :param whitened_data: Whitened feature matrix for all tweets
+    :type whitened_data: np.ndarray
+    :param n_human: Number of tweets in the human group
+    :type n_human: int
+    :param block_size: Number of permutations in the block
+    :type block_size: int
+    :param rng: Random generator used to draw the permutations
+    :type rng: np.random.Generator
+    :returns: Array of permuted distances
+    :rtype: np.ndarray
+    '''
+    differences = permutation_block_differences(whitened_data, n_human, block_size, rng)
+    return np.linalg.norm(differences, axis=1)
+
+def mahalanobis_null_chunk(whitened_data: np.ndarray, n_human: int, block_size: int,
+                           n: int, rng: np.random.Generator) -> np.ndarray:
+    '''
+    Computes n permuted distances block by block. Used as the statistic for the
+    shared permutation runner, which calls it once per chunk.
+    
+    :param whitened_data: Whitened feature matrix for all tweets
+    :type whitened_data: np.ndarray
+    :param n_human: Number of tweets in the human group
+    :type n_human: int
+    :param block_size: Number of permutations per block
+    :type block_size: int
+    :param n: Number of permutations in the chunk
+    :type n: int
+    :param rng: Random generator for the chunk
+    :type rng: np.random.Generator
+    :returns: Array of permuted distances
+    :rtype: np.ndarray
+    '''
+    distances = np.zeros(n)
+    
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        distances[start:stop] = permutation_block_distances(
+            whitened_data, n_human, stop - start, rng)
+    
+    return distances
+
+def standardized_features(features_df: pd.DataFrame, feature_cols: list) -> tuple:
+    '''
+    Standardizes the features from one pass of group statistics. Human rows come
+    first, then bot rows. Every feature is scaled on its own, so the columns of
+    any subset are the standardized subset.
     
     :param features_df: DataFrame containing features and labels
     :type features_df: pd.DataFrame
     :param feature_cols: List of feature column names
     :type feature_cols: list
+    :returns: Tuple standardized data, number of human rows, standardized statistics
+    :rtype: tuple
+    '''
+    X = features_df[feature_cols].to_numpy(dtype=float)
+    codes = group_codes(features_df['label'])
+    
+    stats = GroupStatistics.from_arrays(X, codes)
+    mean, std = stats.scale()
+    standardized = stats.standardized()
+    
+    # The reordered copy is standardized in place, so at most two copies of the
+    # features are held at once
+    order = np.concatenate([np.flatnonzero(codes == 0), np.flatnonzero(codes == 1)])
+    scaled = X[order]
+    del X
+    scaled -= mean
+    scaled /= std
+    
+    return scaled, int(standardized.counts[0]), standardized
+
+def whitened_features(features_df: pd.DataFrame, feature_cols: list) -> tuple:
+    '''
+    Standardizes the features and whitens them in place with the Cholesky factor
+    of the pooled covariance. Human rows come first, then bot rows.
+    
+    :param features_df: DataFrame containing features and labels
+    :type features_df: pd.DataFrame
+    :param feature_cols: List of feature column names
+    :type feature_cols: list
+    :returns: Tuple whitened data, number of human rows, standardized statistics
+    :rtype: tuple
+    '''
+    scaled, n_human, standardized = standardized_features(features_df, feature_cols)
+    factor = cholesky_factor(standardized.pooled_covariance())
+    return whiten(scaled, factor, overwrite=True), n_human, standardized
+
+def all_subsets(feature_cols: list) -> list:
+    '''
+    Lists every non-empty subset of the features, smallest first.
+    
+    :param feature_cols: List of feature column names
+    :type feature_cols: list
+    :returns: List of feature lists, in the order of feature_cols
+    :rtype: list
+    '''
+    return [list(subset) for size in range(1, len(feature_cols) + 1)
+            for subset in combinations(feature_cols, size)]
+
+def subset_factors(pooled_covariance: np.ndarray, subsets: list) -> list:
+    '''
+    Takes the Cholesky factor of the pooled covariance submatrix of every subset.
+    
+    :param pooled_covariance: Pooled covariance of all features
+    :type pooled_covariance: np.ndarray
+    :param subsets: Lists of feature indices
+    :type subsets: list
+    :returns: List of tuples feature indices, lower Cholesky factor
+    :rtype: list
+    '''
+    return [(np.asarray(indices), cholesky_factor(pooled_covariance[np.ix_(indices, indices)]))
+            for indices in subsets]
+
+def subset_distances(differences: np.ndarray, factors: list) -> np.ndarray:
+    '''
+    Computes the Mahalanobis distance of every subset from mean differences of
+    all features. Solving with the subset's Cholesky factor whitens the
+    difference of its features, whose norm is the distance.
+    
+    :param differences: Mean differences of shape (n, n_features)
+    :type differences: np.ndarray
+    :param factors: Feature indices and Cholesky factor of every subset
+    :type factors: list
+    :returns: Array of shape (n, n_subsets)
+    :rtype: np.ndarray
+    '''
+    distances = np.empty((differences.shape[0], len(factors)))
+    
+    for k, (indices, factor) in enumerate(factors):
+        whitened = linalg.solve_triangular(factor, differences[:, indices].T, lower=True)
+        distances[:, k] = np.linalg.norm(whitened, axis=0)
+    
+    return distances
+
+def subset_null_chunk(scaled_data: np.ndarray, n_human: int, factors: list,
+                      block_size: int, n: int, rng: np.random.Generator) -> np.ndarray:
+    '''
+    Computes the permuted distances of every subset for n permutations, block by
+    block. Each block draws its permutations and group sums once for all
+    subsets. Used as the statistic for the shared permutation runner.
+    
+    :param scaled_data: Standardized feature matrix for all tweets
+    :type scaled_data: np.ndarray
+    :param n_human: Number of tweets in the human group
+    :type n_human: int
+    :param factors: Feature indices and Cholesky factor of every subset
+    :type factors: list
+    :param block_size: Number of permutations per block
+    :type block_size: int
+    :param n: Number of permutations in the chunk
+    :type n: int
+    :param rng: Random generator for the chunk
+    :type rng: np.random.Generator
+    :returns: Array of shape (n, n_subsets)
+    :rtype: np.ndarray
+    '''
+    distances = np.zeros((n, len(factors)))
+    
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        differences = permutation_block_differences(scaled_data, n_human, stop - start, rng)
+        distances[start:stop] = subset_distances(differences, factors)
+    
+    return distances
+
+def mahalanobis_subset_sweep(features_df: pd.DataFrame,
+                             feature_cols: list,
+                             subsets: list = None,
+                             n_permutations: int = 10000,
+                             block_size: int = None,
+                             max_block_mb: float = 32.0,
+                             random_state: int = None,
+                             n_workers: int = 1,
+                             chunk_size: int = 250,
+                             progress: callable = None) -> tuple:
+    '''
+    Runs the batched Mahalanobis permutation test on many feature subsets at
+    once. All subsets are scored on the same permutations, so with the same seed
+    and block size the null distribution of the subset holding every feature is
+    the one mahalanobis_permutation_test gives in batched mode.
+    
+    :param features_df: DataFrame containing features and labels
+    :type features_df: pd.DataFrame
+    :param feature_cols: List of all feature column names
+    :type feature_cols: list
+    :param subsets: Lists of feature names to test, all non-empty subsets if None
+    :type subsets: list
     :param n_permutations: Number of permutations
     :type n_permutations: int
-    :returns: Tuple observed distance, p-value, null distribution
+    :param block_size: Permutations per block, derived from max_block_mb if None
+    :type block_size: int
+    :param max_block_mb: Memory budget for a block in megabytes
+    :type max_block_mb: float
+    :param random_state: Root seed for the permutation generators
+    :type random_state: int
+    :param n_workers: Number of worker processes, all cores if None
+    :type n_workers: int
+    :param chunk_size: Permutations per runner chunk
+    :type chunk_size: int
+    :param progress: Callback receiving (n_done, n_total, interim p-values)
+    :type progress: callable
+    :returns: Tuple subsets, observed distances, p-values, null distribution of
+        shape (n_permutations, n_subsets)
     :rtype: tuple
     '''
+    if subsets is None:
+        subsets = all_subsets(feature_cols)
     
-    scaler = StandardScaler()
-    features_standardized = scaler.fit_transform(features_df[feature_cols])
+    with span('scale', rows=len(features_df)):
+        scaled_data, n_human, stats = standardized_features(features_df, feature_cols)
     
-    df_scaled = features_df.copy()
-    df_scaled[feature_cols] = features_standardized
+    factors = subset_factors(stats.pooled_covariance(),
+                             [[feature_cols.index(f) for f in subset] for subset in subsets])
+    d_obs = subset_distances(mean_difference(stats)[None, :], factors)[0]
     
-    human_data = df_scaled[df_scaled['label'] == 'human'][feature_cols].values
-    bot_data = df_scaled[df_scaled['label'] == 'bot'][feature_cols].values
+    if block_size is None:
+        block_size = compute_block_size(scaled_data.shape[0], max_block_mb)
     
-    mean_human_obs = human_data.mean(axis=0)
-    mean_bot_obs = bot_data.mean(axis=0)
+    statistic = partial(subset_null_chunk, scaled_data, n_human, factors, block_size)
+    null_distribution = run_permutations(statistic, n_permutations, observed=d_obs,
+                                         seed=random_state, n_workers=n_workers,
+                                         chunk_size=chunk_size, progress=progress)
+    null_distribution = null_distribution.reshape(n_permutations, len(subsets))
     
-    pooled_cov = compute_pooled_covariance(human_data, bot_data)
-    cov_inv = np.linalg.inv(pooled_cov)
+    return subsets, d_obs, permutation_p_value(null_distribution, d_obs), null_distribution
+
+def sweep_table(subsets: list, d_obs: np.ndarray, p_values: np.ndarray,
+                null_distribution: np.ndarray, correction: str = 'holm') -> pd.DataFrame:
+    '''
+    Ranks the subsets by observed distance. The distances of subsets of
+    different sizes are not on one scale under the null, so the table also gives
+    each distance relative to the 95th percentile of its own null distribution.
     
-    d_obs = compute_mahalanobis_distance(mean_human_obs, mean_bot_obs, cov_inv)
+    :param subsets: Lists of feature names
+    :type subsets: list
+    :param d_obs: Observed distance of every subset
+    :type d_obs: np.ndarray
+    :param p_values: Permutation p-value of every subset
+    :type p_values: np.ndarray
+    :param null_distribution: Permuted distances of shape (n_permutations, n_subsets)
+    :type null_distribution: np.ndarray
+    :param correction: holm, bonferroni or fdr_bh correction across subsets
+    :type correction: str
+    :returns: DataFrame with one row per subset, largest distance first
+    :rtype: pd.DataFrame
+    '''
+    null_95 = np.quantile(null_distribution, 0.95, axis=0)
     
-    combined_data = np.vstack([human_data, bot_data])
-    labels = np.array(['human'] * len(human_data) + ['bot'] * len(bot_data))
+    table = pd.DataFrame({
+        'subset': [''.join(subset) for subset in subsets],
+        'n_features': [len(subset) for subset in subsets],
+        'mahalanobis_distance': d_obs,
+        'null_95': null_95,
+        'distance_ratio': d_obs / null_95,
+        'p_value': p_values,
+        'adjusted_p_value': adjust_p_values(p_values, correction)
+    })
     
-    null_distribution = np.zeros(n_permutations)
+    table = table.sort_values('mahalanobis_distance', ascending=False, kind='stable')
+    table.insert(0, 'rank', np.arange(1, len(table) + 1))
+    return table.reset_index(drop=True)
+
+def mahalanobis_permutation_test(features_df: pd.DataFrame, 
+                                 feature_cols: list,
+                                 n_permutations: int = 10000,
+                                 batched: bool = False,
+                                 block_size: int = None,
+                                 max_block_mb: float = 32.0,
+                                 random_state: int = None,
+                                 n_workers: int = 1,
+                                 chunk_size: int = 250,
+                                 progress: callable = None,
+                                 sequential: bool = False,
+                                 alpha: float = 0.05,
+                                 error_rate: float = 0.001,
+                                 look_every: int = 500) -> tuple:
+    '''
+    Performs permutation test using Mahalanobis distance as test statistic.
+    
+    The default mode permutes labels one at a time with the global numpy seed. The
+    batched mode draws permutations in blocks and scores each block with one matrix
+    product; blocks are sized to stay under max_block_mb unless block_size is given.
+    Batched runs go through the shared permutation runner, so they can be spread
+    over worker processes and give the same result for any n_workers. With
+    sequential set, a batched run checks the p-value every look_every permutations
+    and stops as soon as it is decided relative to alpha; the returned null
+    distribution then only holds the permutations used.
+    
+    :param features_df: DataFrame containing features and labels
+    :type features_df: pd.DataFrame
+    :param feature_cols: List of feature column names
+    :type feature_cols: list
+    :param n_permutations: Number of permutations
+    :type n_permutations: int
+    :param batched: Whether to use the block matrix engine
+    :type batched: bool
+    :param block_size: Permutations per block, derived from max_block_mb if None
+    :type block_size: int
+    :param max_block_mb: Memory budget for a block in megabytes
+    :type max_block_mb: float
+    :param random_state: Root seed for the batched mode generators
+    :type random_state: int
+    :param n_workers: Number of worker processes in batched mode, all cores if None
+    :type n_workers: int
+    :param chunk_size: Permutations per runner chunk in batched mode
+    :type chunk_size: int
+    :param progress: Callback receiving (n_done, n_total, interim p-value)
+    :type progress: callable
+    :param sequential: Whether to stop early once the p-value is decided
+    :type sequential: bool
+    :param alpha: Significance level for sequential stopping
+    :type alpha: float
+    :param error_rate: Bound on the probability of a wrong sequential decision
+    :type error_rate: float
+    :param look_every: Permutations between sequential looks
+    :type look_every: int
+    :returns: Tuple observed distance, p-value, null distribution
+    :rtype: tuple
+    '''
+    
+    with span('scale', rows=len(features_df)):
+        whitened_data, n_human, stats = whitened_features(features_df, feature_cols)
     
-    for i in range(n_permutations):
-        permuted_labels = np.random.permutation(labels)
+    d_obs = mahalanobis_distance(stats)
+    
+    if batched:
+        if block_size is None:
+            block_size = compute_block_size(whitened_data.shape[0], max_block_mb)
+        
+        statistic = partial(mahalanobis_null_chunk, whitened_data, n_human, block_size)
         
-        perm_human_data = combined_data[permuted_labels == 'human']
-        perm_bot_data = combined_data[permuted_labels == 'bot']
+        if sequential:
+            null_distribution, p_value, _ = run_sequential_permutations(
+                statistic, d_obs, n_permutations, alpha=alpha, error_rate=error_rate,
+                seed=random_state, n_workers=n_workers, chunk_size=chunk_size,
+                look_every=look_every, progress=progress)
+            
+            return d_obs, p_value, null_distribution
         
-        mean_human_perm = perm_human_data.mean(axis=0)
-        mean_bot_perm = perm_bot_data.mean(axis=0)
+        null_distribution = run_permutations(statistic, n_permutations, observed=d_obs,
+                                             seed=random_state, n_workers=n_workers,
+                                             chunk_size=chunk_size, progress=progress)
         
-        d_perm = compute_mahalanobis_distance(mean_human_perm, mean_bot_perm, cov_inv)
-        null_distribution[i] = d_perm
+        p_value = permutation_p_value(null_distribution, d_obs)
+        
+        return d_obs, p_value, null_distribution
+    
+    labels = np.array(['human'] * n_human + ['bot'] * (len(whitened_data) - n_human))
+    
+    null_distribution = np.zeros(n_permutations)
+    
+    with span('permutations', rows=n_permutations):
+        for i in range(n_permutations):
+            permuted_labels = np.random.permutation(labels)
+            
+            perm_human_data = whitened_data[permuted_labels == 'human']
+            perm_bot_data = whitened_data[permuted_labels == 'bot']
+            
+            mean_human_perm = perm_human_data.mean(axis=0)
+            mean_bot_perm = perm_bot_data.mean(axis=0)
+            
+            d_perm = np.linalg.norm(mean_human_perm - mean_bot_perm)
+            null_distribution[i] = d_perm
     
     p_value = (np.sum(null_distribution >= d_obs) + 1) / (n_permutations + 1)
     
     return d_obs, p_value, null_distribution
 
+@traced('plot.mahalanobis')
 def plot_permutation_results(d_obs: float, null_distribution: np.ndarray,
                              p_value: float, output_path: str):
     '''
@@ -151,22 +503,133 @@ def plot_permutation_results(d_obs: float, null_distribution: np.ndarray,
     plt.tight_layout()
     plt.savefig(output_path, dpi=300, bbox_inches='tight')
 
+@traced('plot.mahalanobis_sweep')
+def plot_sweep_results(table: pd.DataFrame, output_path: str):
+    '''
+    Plots the observed distance of every subset against the 95th percentile of
+    its null distribution, in rank order.
+    
+    :param table: Ranked table from sweep_table
+    :type table: pd.DataFrame
+    :param output_path: Path to save the figure
+    :type output_path: str
+    '''
+    sns.set_style("whitegrid")
+    sns.set_palette("muted")
+    plt.figure(figsize=(12, max(6, 0.35 * len(table))))
+    
+    positions = np.arange(len(table))[::-1]
+    sizes = sorted(table['n_features'].unique())
+    palette = dict(zip(sizes, sns.color_palette("muted", len(sizes))))
+    
+    plt.barh(positions, table['mahalanobis_distance'],
+            color=[palette[size] for size in table['n_features']], edgecolor='white')
+    null_marker = plt.scatter(table['null_95'], positions, color='black', marker='|', s=120,
+                             zorder=3, label='Null 95th Percentile')
+    
+    handles = [Patch(color=palette[size], label=f'{size} Feature{"s" if size > 1 else ""}')
+               for size in sizes]
+    
+    plt.yticks(positions, table['subset'])
+    plt.xlabel('Mahalanobis Distance', fontsize=14, labelpad=15)
+    plt.ylabel('Feature Subset', fontsize=14, labelpad=15)
+    plt.title('Mahalanobis Distance by Feature Subset', fontsize=16, pad=20)
+    
+    plt.legend(handles=[null_marker] + handles, fontsize=11, loc='lower right')
+    plt.grid(True, alpha=0.3, axis='x')
+    
+    plt.tight_layout()
+    plt.savefig(output_path, dpi=300, bbox_inches='tight')
+
 def main():    
     parser = argparse.ArgumentParser(description='Mahalanobis distance permutation test')
     parser.add_argument('--features', type=str, default='V,S,W,F,C',
                        help='Comma-separated feature list')
+    parser.add_argument('--permutations', type=int, default=10000,
+                       help='Number of permutations')
+    parser.add_argument('--batched', action='store_true',
+                       help='Score permutations in blocks with one matrix product each')
+    parser.add_argument('--block-size', type=int, default=None,
+                       help='Permutations per block (default: derived from --max-block-mb)')
+    parser.add_argument('--max-block-mb', type=float, default=32.0,
+                       help='Memory budget for a permutation block in megabytes')
+    parser.add_argument('--workers', type=int, default=1,
+                       help='Worker processes for --batched mode (-1 for all cores)')
+    parser.add_argument('--chunk-size', type=int, default=250,
+                       help='Permutations per worker chunk in --batched mode')
+    parser.add_argument('--sequential', action='store_true',
+                       help='Stop once the p-value is decided against --alpha (implies --batched)')
+    parser.add_argument('--alpha', type=float, default=0.05,
+                       help='Significance level for --sequential stopping')
+    parser.add_argument('--error-rate', type=float, default=0.001,
+                       help='Bound on the probability of a wrong --sequential decision')
+    parser.add_argument('--look-every', type=int, default=500,
+                       help='Permutations between --sequential looks')
+    parser.add_argument('--sweep', action='store_true',
+                       help='Test every non-empty subset of --features in one batched run')
+    parser.add_argument('--subsets', type=str, nargs='+', default=None,
+                       help='Comma-separated feature subsets to test in one batched run')
+    parser.add_argument('--correction', type=str, default='holm',
+                       choices=('holm', 'bonferroni', 'fdr_bh'),
+                       help='Multiple-testing correction across the subsets')
+    parser.add_argument('--profile', type=str, default=None, metavar='TRACE_JSON',
+                       help='Print per-step timings and write a Chrome trace')
     args = parser.parse_args()
     
-    np.random.seed(42)
+    if args.profile:
+        instrumentation.enable(args.profile)
+    
+    batched = args.batched or args.sequential
     
-    df = pd.read_csv('../../data/tweepfake_features.csv', sep=';')
+    np.random.seed(42)
     
     feature_cols = [f.strip() for f in args.features.split(',')]
     
-    d_obs, p_value, null_dist = mahalanobis_permutation_test(df, feature_cols, n_permutations=10000)
+    if args.sweep or args.subsets:
+        subsets = None
+        if args.subsets:
+            subsets = [[f.strip() for f in subset.split(',')] for subset in args.subsets]
+            feature_cols = list(dict.fromkeys(f for subset in subsets for f in subset))
+        
+        df = load_features('../../data/tweepfake_features.csv', columns=['label'] + feature_cols)
+        
+        # One interim p-value per subset is too much for a progress line
+        print_progress = make_progress_printer()
+        
+        subsets, d_obs, p_values, null_dist = mahalanobis_subset_sweep(
+            df, feature_cols, subsets, n_permutations=args.permutations,
+            block_size=args.block_size, max_block_mb=args.max_block_mb, random_state=42,
+            n_workers=args.workers, chunk_size=args.chunk_size,
+            progress=lambda n_done, n_total, _: print_progress(n_done, n_total, None))
+        
+        table = sweep_table(subsets, d_obs, p_values, null_dist, args.correction)
+        print(table.to_string(index=False))
+        print(f"\n{args.permutations} permutations shared by {len(subsets)} subsets, "
+              f"adjusted p-values: {args.correction}")
+        
+        plot_sweep_results(table, '../../figures/mahalanobis_sweep.png')
+        
+        instrumentation.report()
+        return
+    
+    df = load_features('../../data/tweepfake_features.csv', columns=['label'] + feature_cols)
+    
+    d_obs, p_value, null_dist = mahalanobis_permutation_test(
+        df, feature_cols, n_permutations=args.permutations, batched=batched,
+        block_size=args.block_size, max_block_mb=args.max_block_mb, random_state=42,
+        n_workers=args.workers, chunk_size=args.chunk_size,
+        progress=make_progress_printer() if batched else None,
+        sequential=args.sequential, alpha=args.alpha, error_rate=args.error_rate,
+        look_every=args.look_every)
+    
+    if args.sequential:
+        print(f"Stopped after {len(null_dist)}/{args.permutations} permutations "
+              f"(p-value: {p_value:.6f})")
     
     feature_string = ''.join(feature_cols)
     
     plot_permutation_results(d_obs, null_dist, p_value, f'../../figures/mahalanobis_test_{feature_string}.png')
+    
+    instrumentation.report()
 
 if __name__ == "__main__": main()
@@ -1,24 +1,30 @@
 '''
 Feature distribution visualization script for the extracted features.
 
+The histograms are counted in two streaming passes over the features, one for
+the range of every group and feature and one for the bin counts, so the
+feature table is never loaded as a whole.
+
 :author: Jacob Anderson
 :version: 0.1.0
 '''
 
-import pandas as pd
+import argparse
 import matplotlib.pyplot as plt
 import seaborn as sns
 import os
+from csds413_term_project.streaming import feature_histograms, range_edges, summarize_features
+from csds413_term_project.sufficient_stats import GROUPS
+from csds413_term_project import instrumentation
+from csds413_term_project.instrumentation import traced
 
-def plot_feature_distribution(features_df: pd.DataFrame, feature: str, 
-                              feature_name: str, output_path: str):
+@traced('plot.distribution')
+def plot_feature_distribution(histograms: dict, feature_name: str, output_path: str):
     '''
     Plots the distribution of a single feature for human and bot tweets.
     
-    :param features_df: DataFrame containing features and labels
-    :type features_df: pd.DataFrame
-    :param feature: Feature column name
-    :type feature: str
+    :param histograms: Dict mapping each label to its bin counts and bin edges
+    :type histograms: dict
     :param feature_name: Full descriptive name of the feature
     :type feature_name: str
     :param output_path: Path to save the figure
@@ -31,8 +37,8 @@ def plot_feature_distribution(features_df: pd.DataFrame, feature: str,
     colors = {'human': 'steelblue', 'bot': 'coral'}
     
     for label in ['human', 'bot']:
-        data = features_df[features_df['label'] == label][feature]
-        plt.hist(data, bins=40, alpha=0.6, label=label.capitalize(), 
+        counts, edges = histograms[label]
+        plt.hist(edges[:-1], bins=edges, weights=counts, alpha=0.6, label=label.capitalize(), 
                 color=colors[label], edgecolor='white', density=True)
     
     plt.xlabel(feature_name, fontsize=14, labelpad=15)
@@ -45,7 +51,18 @@ def plot_feature_distribution(features_df: pd.DataFrame, feature: str,
     plt.savefig(output_path, dpi=300, bbox_inches='tight')
 
 def main():
-    df = pd.read_csv('../../data/tweepfake_features.csv', sep=';')
+    parser = argparse.ArgumentParser(description='Feature distribution plots')
+    parser.add_argument('--bins', type=int, default=40,
+                       help='Histogram bins per group')
+    parser.add_argument('--chunk-size', type=int, default=100000,
+                       help='Rows per chunk when streaming over the features')
+    parser.add_argument('--workers', type=int, default=1,
+                       help='Worker processes (-1 for all cores)')
+    args = parser.parse_args()
+    
+    instrumentation.enable_from_env()
+    
+    csv_path = '../../data/tweepfake_features.csv'
     
     features = {
         'V': 'Vocabulary Richness',
@@ -55,8 +72,21 @@ def main():
         'C': 'Capitalization Abnormality'
     }
     
-    for feature, feature_name in features.items():
+    feature_cols = list(features)
+    
+    # The first pass gives the range of every group, as plt.hist would take it
+    summary = summarize_features(csv_path, feature_cols, chunk_size=args.chunk_size,
+                                 n_workers=args.workers)
+    edges = range_edges(summary, args.bins)
+    histograms = feature_histograms(csv_path, feature_cols, edges, chunk_size=args.chunk_size,
+                                    n_workers=args.workers)
+    
+    for j, (feature, feature_name) in enumerate(features.items()):
         output_path = os.path.join('../../figures', f'{feature}_distribution.png')
-        plot_feature_distribution(df, feature, feature_name, output_path)
+        plot_feature_distribution({label: (histograms.counts[group, j], edges[group, j])
+                                   for group, label in enumerate(GROUPS)},
+                                  feature_name, output_path)
+    
+    instrumentation.report()
 
 if __name__ == "__main__": main()
@@ -0,0 +1,280 @@
+'''
+Benchmark suite for the preprocessing and analysis hot paths.
+
+Times cleaning, feature extraction, the Mahalanobis permutation test and the
+classifier permutation tests on synthetic data of a configurable size. Every
+stage runs in its own process, so the peak memory of one stage is not hidden
+by an earlier one. Data generation happens before the timer starts. Results
+are written as JSON together with the environment they were measured in. Given
+a baseline from an earlier run, the suite fails if any stage got slower than
+the tolerance allows.
+
+:author: Jacob Anderson
+:version: 0.1.0
+'''
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import sklearn
+
+# The stages live in the sibling script directories, whose modules import each
+# other by bare name
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(SCRIPTS_DIR, 'preprocessing'), os.path.join(SCRIPTS_DIR, 'analysis')]
+
+from csds413_term_project.memory import current_rss_mb, peak_rss_mb, reset_peak_rss
+from csds413_term_project.synthetic import FEATURE_NAMES, synthetic_features, synthetic_raw_tweets
+
+def setup_clean(rows: int, options: dict):
+    from tweepfake_clean import clean_frame
+    raw_df = synthetic_raw_tweets(rows, seed=options['seed'])
+    return lambda: clean_frame(raw_df)
+
+def setup_clean_vectorized(rows: int, options: dict):
+    from tweepfake_clean import clean_frame_vectorized, vectorized_patterns
+    # Builds the cached RE2 patterns outside the timed runs
+    vectorized_patterns()
+    raw_df = synthetic_raw_tweets(rows, seed=options['seed'])
+    return lambda: clean_frame_vectorized(raw_df)
+
+def setup_extract(rows: int, options: dict):
+    from tweepfake_clean import clean_frame
+    from feature_extract import download_nltk_resources, iter_extracted_chunks
+    download_nltk_resources(options['tokenizer'])
+    cleaned_df = clean_frame(synthetic_raw_tweets(rows, seed=options['seed']))
+    chunk_size = options['chunk_size']
+
+    def extract():
+        chunks = (cleaned_df.iloc[start:start + chunk_size]
+                  for start in range(0, len(cleaned_df), chunk_size))
+        for _ in iter_extracted_chunks(chunks, n_workers=options['workers'],
+                                       tokenizer=options['tokenizer']):
+            pass
+    return extract
+
+def setup_mahalanobis(rows: int, options: dict):
+    from mahalanobis_perm_test import mahalanobis_permutation_test
+    features_df = synthetic_features(rows, seed=options['seed'])
+    return lambda: mahalanobis_permutation_test(
+        features_df, FEATURE_NAMES, n_permutations=options['permutations'], batched=True,
+        random_state=options['seed'], n_workers=options['workers']
+    )
+
+def setup_ks_permutation(rows: int, options: dict):
+    from csds413_term_project.ks_permutation import ks_permutation_test
+    features_df = synthetic_features(rows, seed=options['seed'])
+    X = features_df[FEATURE_NAMES].to_numpy()
+    in_group1 = (features_df['label'] == 'human').to_numpy()
+    return lambda: ks_permutation_test(
+        X, in_group1, n_permutations=options['permutations'], seed=options['seed'],
+        n_workers=options['workers']
+    )
+
+def setup_bootstrap(rows: int, options: dict):
+    from csds413_term_project.bootstrap import effect_size_intervals
+    features_df = synthetic_features(rows, seed=options['seed'])
+    X = features_df[FEATURE_NAMES].to_numpy()
+    in_group1 = (features_df['label'] == 'human').to_numpy()
+    return lambda: effect_size_intervals(
+        X, in_group1, n_resamples=options['permutations'], seed=options['seed']
+    )
+
+def _classifier_setup(estimator, rows: int, options: dict):
+    from csds413_term_project.classifier_permutation import classifier_permutation_test
+    features_df = synthetic_features(rows, seed=options['seed'])
+    X = features_df[FEATURE_NAMES].to_numpy()
+    X = (X - X.mean(axis=0)) / X.std(axis=0)
+    y = (features_df['label'] == 'bot').to_numpy(dtype=int)
+    n_train = int(0.8 * rows)
+    estimator.fit(X[:n_train], y[:n_train])
+    return lambda: classifier_permutation_test(
+        estimator, X[:n_train], y[:n_train], X[n_train:], y[n_train:],
+        n_permutations=options['permutations'], seed=options['seed'], n_workers=options['workers']
+    )
+
+def setup_permutation_logreg(rows: int, options: dict):
+    from sklearn.linear_model import LogisticRegression
+    return _classifier_setup(LogisticRegression(max_iter=1000), rows, options)
+
+def setup_permutation_nb(rows: int, options: dict):
+    from sklearn.naive_bayes import GaussianNB
+    return _classifier_setup(GaussianNB(), rows, options)
+
+# Stage name -> function building the timed callable from (rows, options)
+STAGES = {
+    'clean': setup_clean,
+    'clean_vectorized': setup_clean_vectorized,
+    'extract': setup_extract,
+    'mahalanobis': setup_mahalanobis,
+    'ks_permutation': setup_ks_permutation,
+    'bootstrap': setup_bootstrap,
+    'permutation_logreg': setup_permutation_logreg,
+    'permutation_nb': setup_permutation_nb,
+}
+
+def run_stage(name: str, rows: int, options: dict) -> dict:
+    '''
+    Builds the data for a stage, then times it. Meant to run in a fresh process.
+
+    :param name: Stage name, one of STAGES
+    :type name: str
+    :param rows: Number of input rows
+    :type rows: int
+    :param options: Benchmark options (seed, repeat, workers, ...)
+    :type options: dict
+    :returns: Dict with timings in seconds and memory in megabytes
+    :rtype: dict
+    '''
+    func = STAGES[name](rows, options)
+
+    baseline_rss = current_rss_mb()
+    peak_isolated = reset_peak_rss()
+
+    seconds = []
+    for _ in range(options['repeat']):
+        start_time = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start_time)
+
+    peak_rss = peak_rss_mb()
+    return {
+        'rows': rows,
+        'seconds': min(seconds),
+        'seconds_median': float(np.median(seconds)),
+        'seconds_all': seconds,
+        'rows_per_second': rows / min(seconds),
+        'peak_rss_mb': peak_rss,
+        'stage_rss_mb': peak_rss - baseline_rss if peak_isolated and baseline_rss is not None else None,
+    }
+
+def environment() -> dict:
+    '''
+    Describes the machine and software versions a run was measured with.
+
+    :returns: Dict of environment details
+    :rtype: dict
+    '''
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=SCRIPTS_DIR, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'sklearn': sklearn.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+def check_regressions(baseline: dict, results: dict, tolerance: float) -> list:
+    '''
+    Compares a run against a baseline run. Only stages measured on the same
+    number of rows and with the same options are compared; a baseline run with
+    different options is not compared at all.
+
+    :param baseline: Results of the baseline run
+    :type baseline: dict
+    :param results: Results of the current run
+    :type results: dict
+    :param tolerance: Allowed relative slowdown, e.g. 0.2 for 20%
+    :type tolerance: float
+    :returns: List of (stage, baseline seconds, current seconds) that regressed
+    :rtype: list
+    '''
+    regressions = []
+    if baseline.get('options') != results.get('options'):
+        print("Baseline was run with different options, skipping the comparison")
+        return regressions
+
+    for name, current in results['stages'].items():
+        previous = baseline['stages'].get(name)
+        if previous is None or previous['rows'] != current['rows']:
+            continue
+
+        ratio = current['seconds'] / previous['seconds']
+        status = 'REGRESSION' if ratio > 1 + tolerance else 'ok'
+        print(f"  {name:<20} {previous['seconds']:>9.3f}s -> {current['seconds']:>9.3f}s "
+              f"({ratio - 1:+.1%}) {status}")
+        if status == 'REGRESSION':
+            regressions.append((name, previous['seconds'], current['seconds']))
+
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark suite for the hot paths')
+    parser.add_argument('--rows', type=int, default=10000,
+                       help='Input rows per stage (tweets or feature rows)')
+    parser.add_argument('--stages', type=str, default=','.join(STAGES),
+                       help='Comma-separated stages to run')
+    parser.add_argument('--repeat', type=int, default=3,
+                       help='Timed runs per stage; the fastest is reported')
+    parser.add_argument('--permutations', type=int, default=1000,
+                       help='Permutations (or bootstrap resamples) for the resampling stages')
+    parser.add_argument('--workers', type=int, default=1,
+                       help='Worker processes inside each stage')
+    parser.add_argument('--chunk-size', type=int, default=10000,
+                       help='Tweets per chunk for the extraction stage')
+    parser.add_argument('--tokenizer', type=str, default='nltk',
+                       help='Tokenizer backend for the extraction stage')
+    parser.add_argument('--seed', type=int, default=42,
+                       help='Seed of the synthetic data')
+    parser.add_argument('--output', type=str, default=None,
+                       help='Results JSON (default: ../../benchmarks/benchmark_<time>.json)')
+    parser.add_argument('--baseline', type=str, default=None,
+                       help='Earlier results JSON to check for regressions against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                       help='Allowed relative slowdown against the baseline')
+    args = parser.parse_args()
+
+    stages = [name.strip() for name in args.stages.split(',')]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages {sorted(unknown)}, expected some of {list(STAGES)}")
+
+    options = {'seed': args.seed, 'repeat': args.repeat, 'permutations': args.permutations,
+               'workers': args.workers, 'chunk_size': args.chunk_size, 'tokenizer': args.tokenizer}
+    results = {'environment': environment(), 'options': options, 'stages': {}}
+
+    print(f"{'Stage':<20} {'Rows':>10} {'Seconds':>10} {'Rows/s':>12} {'Peak MB':>10} {'Stage MB':>10}")
+    for name in stages:
+        # A fresh process per stage keeps the peak memory of the stages apart
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            stage = executor.submit(run_stage, name, args.rows, options).result()
+
+        results['stages'][name] = stage
+        stage_mb = '-' if stage['stage_rss_mb'] is None else f"{stage['stage_rss_mb']:.1f}"
+        print(f"{name:<20} {stage['rows']:>10} {stage['seconds']:>10.3f} "
+              f"{stage['rows_per_second']:>12.0f} {stage['peak_rss_mb']:>10.1f} {stage_mb:>10}")
+
+    output = args.output
+    if output is None:
+        os.makedirs('../../benchmarks', exist_ok=True)
+        output = f"../../benchmarks/benchmark_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    with open(output, 'w') as results_file:
+        json.dump(results, results_file, indent=2)
+    print(f"\nResults saved to {output}")
+
+    if args.baseline is not None:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+        print(f"\nAgainst {args.baseline} (tolerance {args.tolerance:.0%}):")
+        regressions = check_regressions(baseline, results, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} stage(s) slowed down beyond the tolerance")
+            sys.exit(1)
+
+if __name__ == "__main__": main()
@@ -0,0 +1,201 @@
+'''
+Regression check for the compiled cleaning engine in tweepfake_clean.
+
+Runs the original per-pattern implementations of clean_tweet and the three
+filters side by side with the compiled ones, and the vectorized pyarrow path
+against the per-row path, and reports every input where the output differs.
+Inputs are the raw TweepFake tweets (if present) plus random strings built
+from the characters the patterns care about.
+
+:author: Jacob Anderson
+:version: 0.1.0
+'''
+
+import argparse
+import os
+import random
+import re
+import sys
+import pandas as pd
+from tweepfake_clean import (
+    clean_frame, clean_frame_vectorized, clean_tweet, contains_html_markup, contains_mojibake, contains_file_paths
+)
+
+def reference_clean_tweet(text: str) -> str:
+    '''
+    Original clean_tweet, one re.sub pass per pattern.
+
+    :param text: Raw tweet text
+    :type text: str
+    :returns: Cleaned tweet text with normalized whitespace
+    :rtype: str
+    '''
+    text = re.sub(r'http\S+|https\S+|www\.\S+', '', text)
+    text = re.sub(r'@\w+', '', text)
+    text = re.sub(r'#\w+', '', text)
+    text = re.sub(r'\\n', ' ', text)
+    text = re.sub(r'\\t', ' ', text)
+    text = re.sub(r'\\r', ' ', text)
+    text = re.sub(r'\\\\', '', text)
+    text = re.sub(r'<U\+[0-9A-Fa-f]+>', '', text)
+
+    emoji_pt = re.compile(
+        "["
+        "\U0001F600-\U0001F64F"
+        "\U0001F300-\U0001F5FF"
+        "\U0001F680-\U0001F6FF"
+        "\U0001F1E0-\U0001F1FF"
+        "\U00002702-\U000027B0"
+        "\U000024C2-\U0001F251"
+        "]+",
+        flags=re.UNICODE
+    )
+    text = emoji_pt.sub('', text)
+
+    text = re.sub(r'\s+', ' ', text)
+    text = text.strip()
+    text = text.strip('"""')
+    text = text.strip('""')
+
+    return text
+
+def reference_contains_html_markup(text: str) -> bool:
+    '''
+    Original contains_html_markup, one re.search per pattern.
+    '''
+    if pd.isna(text):
+        return False
+
+    html_pt = [r'<[^>]+>', r'&[a-z]+;', r'class=', r'src=', r'id=',
+               r'alt=', r'\\r\\n', r'\\"']
+
+    for pattern in html_pt:
+        if re.search(pattern, text, re.IGNORECASE):
+            return True
+    return False
+
+def reference_contains_mojibake(text: str) -> bool:
+    '''
+    Original contains_mojibake, one re.search per pattern.
+    '''
+    moj_pt = [r'Ã[\x80-\xBF]', r'Â[\x80-\xBF]', r'Ã¯Â¿Â½', r'[ÃÂ¯¿½]{3,}']
+
+    for pattern in moj_pt:
+        if re.search(pattern, text):
+            return True
+    return False
+
+def reference_contains_file_paths(text: str) -> bool:
+    '''
+    Original contains_file_paths, one re.search per pattern.
+    '''
+    if pd.isna(text):
+        return False
+
+    path_patterns = [r'dev', r'/usr/', r'/etc/', r'/var/',
+                     r'/vars/', r'/home/', r'/opt/', r'[A-Z]:\\',
+                     r'/[\w.-]+/[\w.-]+/', r'\d{10,}']
+
+    for pattern in path_patterns:
+        if re.search(pattern, text):
+            return True
+    return False
+
+# Fragments that exercise the boundaries between the patterns
+FRAGMENTS = [
+    'http', 'https://t.co/x', 'www.', 'www.site.com', '@', '@user', '#', '#tag',
+    '\\', '\\n', '\\t', '\\r', '\\\\', '\\"', '<', '>', '<U+', '<U+1F600>', '1F',
+    '\U0001F600', '\u2702', '\u24C2', '\u4E2D', 'Ã', 'Â', '\x80', '\xBF', '¯', '¿', '½',
+    '&amp;', 'class=', 'ID=', '/usr/', '/a/b/', 'C:\\', 'dev', '1234567890',
+    ' ', '  ', '\t', '\n', '\u00A0', '\u2003', '\x1c', '"', '""', 'a', 'Word', '_', '.', ':'
+]
+
+def random_texts(n: int, seed: int = 42) -> list:
+    '''
+    Builds random strings by concatenating pattern fragments.
+
+    :param n: Number of strings
+    :type n: int
+    :param seed: Random seed
+    :type seed: int
+    :returns: List of strings
+    :rtype: list
+    '''
+    rng = random.Random(seed)
+    return [''.join(rng.choice(FRAGMENTS) for _ in range(rng.randint(0, 12)))
+            for _ in range(n)]
+
+def compare(texts: list) -> int:
+    '''
+    Compares the compiled and reference implementations on every text and prints
+    the first few mismatches.
+
+    :param texts: Raw tweet texts
+    :type texts: list
+    :returns: Number of mismatching texts
+    :rtype: int
+    '''
+    checks = [
+        (clean_tweet, reference_clean_tweet),
+        (contains_html_markup, reference_contains_html_markup),
+        (contains_mojibake, reference_contains_mojibake),
+        (contains_file_paths, reference_contains_file_paths),
+    ]
+
+    mismatches = 0
+    for text in texts:
+        for func, reference in checks:
+            if func(text) != reference(text):
+                mismatches += 1
+                if mismatches <= 10:
+                    print(f"  {func.__name__}({text!r}): {func(text)!r} != {reference(text)!r}")
+                break
+
+    return mismatches
+
+def compare_vectorized(texts: list) -> int:
+    '''
+    Compares the vectorized cleaning path with the per-row clean_frame and
+    prints the first few mismatches.
+
+    :param texts: Raw tweet texts
+    :type texts: list
+    :returns: Number of mismatching rows
+    :rtype: int
+    '''
+    df = pd.DataFrame({'text': texts, 'account.type': 'human'})
+
+    expected = clean_frame(df)['text']
+    actual = clean_frame_vectorized(df)['text']
+
+    rows = expected.index.symmetric_difference(actual.index)
+    shared = expected.index.intersection(actual.index)
+    rows = rows.union(shared[expected[shared] != actual[shared]])
+
+    for row in rows[:10]:
+        print(f"  vectorized({texts[row]!r}): {actual.get(row)!r} != {expected.get(row)!r}")
+
+    return len(rows)
+
+def main():
+    parser = argparse.ArgumentParser(description='Cleaning engine regression check')
+    parser.add_argument('--raw', type=str, default='../../data/tweepfake_raw.csv',
+                       help='Raw TweepFake CSV to replay, skipped if missing')
+    parser.add_argument('--random', type=int, default=200000,
+                       help='Number of random fragment strings')
+    args = parser.parse_args()
+
+    texts = random_texts(args.random)
+    if os.path.exists(args.raw):
+        texts += pd.read_csv(args.raw, sep=';')['text'].dropna().tolist()
+
+    mismatches = compare(texts)
+    print(f"{mismatches} mismatches in {len(texts)} texts")
+
+    vectorized_mismatches = compare_vectorized(texts)
+    print(f"{vectorized_mismatches} vectorized mismatches in {len(texts)} texts")
+    mismatches += vectorized_mismatches
+
+    sys.exit(1 if mismatches else 0)
+
+if __name__ == "__main__": main()
@@ -5,17 +5,36 @@ Feature extraction script for the permutation test.
 :version: 0.1.0
 '''
 
+import argparse
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator
 import pandas as pd
 import nltk
-from nltk.tokenize import word_tokenize, sent_tokenize
 from nltk.corpus import stopwords
+from csds413_term_project.tokenization import TOKENIZERS, TokenizedTweet, get_tokenizer, tokenize_tweet
+from csds413_term_project.feature_store import FeatureStoreWriter, store_path_for
+from csds413_term_project.feature_kernels import FEATURE_NAMES, TokenBatch, batch_features
+from csds413_term_project.feature_cache import FeatureCache, cache_namespace
+from csds413_term_project import instrumentation
+from csds413_term_project.instrumentation import span
 
-def download_nltk_resources():
+# Bump when the tokenization or the feature definitions change, so that cached
+# features from an older extractor are not reused
+EXTRACTOR_VERSION = 1
+
+def download_nltk_resources(tokenizer: str = 'nltk'):
     '''
-    Downloads NLTK resources.
+    Downloads NLTK resources. The punkt model is only needed by the nltk
+    tokenizer backend.
+    
+    :param tokenizer: Tokenizer backend the resources are for
+    :type tokenizer: str
     '''
-    try: nltk.data.find('tokenizers/punkt')
-    except LookupError: nltk.download('punkt', quiet=True)
+    if tokenizer == 'nltk':
+        try: nltk.data.find('tokenizers/punkt')
+        except LookupError: nltk.download('punkt', quiet=True)
     
     try: nltk.data.find('corpora/stopwords')
     except LookupError: nltk.download('stopwords', quiet=True)
@@ -49,37 +68,32 @@ def is_abnormal_capitalization(word: str, is_sentence_start: bool) -> bool:
     
     return False
 
-def extract_features(text: str, stopwords_set: set) -> dict:
+def compute_features(tokens: TokenizedTweet, stopwords_set: set) -> dict:
     '''
-    Extracts the five statistical features for a single tweet.
+    Computes the five statistical features from an already tokenized tweet.
     
-    :param text: Cleaned tweet text
-    :type text: str
+    :param tokens: Sentence-indexed alphabetic words of the tweet
+    :type tokens: TokenizedTweet
     :param stopwords_set: Set of functional words
     :type stopwords_set: set
     :returns: Dictionary containing the five features
     :rtype: dict
     '''
-    # Tokenizes text into sentences
-    sentences = sent_tokenize(text)
-    
-    # Tokenizes into words and filters to alphabetic only
-    all_tokens = word_tokenize(text)
-    words = [token for token in all_tokens if token.isalpha()]
+    words = tokens.words
     
     # Handles empty tweet edge case. The cleaning does handle empty tweets,
     # but after tokenizing, some tweets filled with just smybols or something
     # else weird may come up empty and give div by zero errors
-    if len(words) == 0 or len(sentences) == 0:
+    if tokens.n_words == 0 or tokens.n_sentences == 0:
         return {'V': 0.0, 'S': 0.0, 'W': 0.0, 'F': 0.0, 'C': 0.0}
     
     # Vocab richness
     unique_words = len(set(words))
-    total_words = len(words)
+    total_words = tokens.n_words
     V = unique_words / total_words
     
     # Sentence length
-    total_sentences = len(sentences)
+    total_sentences = tokens.n_sentences
     S = total_words / total_sentences
     
     # Word length
@@ -92,37 +106,261 @@ def extract_features(text: str, stopwords_set: set) -> dict:
     
     # Capitalization abnormality
     abnormal_count = 0
-    for sentence in sentences:
-        sentence_tokens = word_tokenize(sentence)
-        sentence_words = [token for token in sentence_tokens if token.isalpha()]
-        
-        for i, word in enumerate(sentence_words):
-            is_sentence_start = (i == 0)
-            if is_abnormal_capitalization(word, is_sentence_start):
-                abnormal_count += 1
+    for word, is_sentence_start in zip(words, tokens.sentence_start_flags()):
+        if is_abnormal_capitalization(word, is_sentence_start):
+            abnormal_count += 1
     C = abnormal_count / total_words
     
     return {'V': V, 'S': S, 'W': W, 'F': F, 'C': C}
 
-def main():
-    # Loads NLTK resources
-    download_nltk_resources()
-    stopwords_set = set(stopwords.words('english'))
+def extract_features(text: str, stopwords_set: set,
+                     custom_features: dict = None, tokenizer=tokenize_tweet) -> dict:
+    '''
+    Extracts the five statistical features for a single tweet. The tweet is
+    tokenized once, and the same tokens are handed to every custom feature
+    function, which is called as func(tokens) and returns the feature value.
+    
+    :param text: Cleaned tweet text
+    :type text: str
+    :param stopwords_set: Set of functional words
+    :type stopwords_set: set
+    :param custom_features: Mapping of extra feature names to functions of the tokens
+    :type custom_features: dict
+    :param tokenizer: Tokenizer backend, see tokenization.TOKENIZERS
+    :type tokenizer: Callable
+    :returns: Dictionary containing the five features and any custom ones
+    :rtype: dict
+    '''
+    tokens = tokenizer(text)
+    features = compute_features(tokens, stopwords_set)
     
-    df = pd.read_csv('../../data/tweepfake.csv', sep=';')
+    for name, func in (custom_features or {}).items():
+        features[name] = func(tokens)
     
-    # Performs feature extraction
-    features_list = []
-    for _, row in df.iterrows():
-        features = extract_features(row['text'], stopwords_set)
-        features['text'] = row['text']
-        features['label'] = row['label']
-        features_list.append(features)
+    return features
 
-    # Frames and orders cols    
-    features_df = pd.DataFrame(features_list)
-    features_df = features_df[['text', 'label', 'V', 'S', 'W', 'F', 'C']]
+# Per-process stopwords and tokenizer, loaded once by init_worker
+_worker_stopwords = None
+_worker_tokenizer = tokenize_tweet
+
+def init_worker(tokenizer: str = 'nltk'):
+    '''
+    Loads the stopwords and the tokenizer backend once for the current process.
+    
+    :param tokenizer: Tokenizer backend name
+    :type tokenizer: str
+    '''
+    global _worker_stopwords, _worker_tokenizer
+    _worker_stopwords = set(stopwords.words('english'))
+    _worker_tokenizer = get_tokenizer(tokenizer)
+    
+    # The punkt model is cached after its first use
+    _worker_tokenizer('Warm up.')
+
+def extract_chunk(chunk: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Extracts the features for a chunk of cleaned tweets. The tweets are
+    tokenized one by one, and the features of the whole chunk are computed at
+    once by the batch kernels.
+    
+    :param chunk: DataFrame with text and label columns
+    :type chunk: pd.DataFrame
+    :returns: DataFrame with text, label and the five features
+    :rtype: pd.DataFrame
+    '''
+    with span('extract.tokenize', rows=len(chunk)):
+        batch = TokenBatch.from_tokenized(_worker_tokenizer(text) for text in chunk['text'])
+    
+    with span('extract.features', rows=len(chunk)):
+        features_df = pd.DataFrame(batch_features(batch, _worker_stopwords),
+                                   columns=FEATURE_NAMES, index=chunk.index)
+    features_df.insert(0, 'text', chunk['text'])
+    features_df.insert(1, 'label', chunk['label'])
+    
+    return features_df
+
+def open_feature_cache(path: str, tokenizer: str = 'nltk', max_entries: int = None,
+                       max_age_days: float = None) -> FeatureCache:
+    '''
+    Opens the feature cache for the current extractor version, tokenizer
+    backend and stopword set.
+    
+    :param path: Path of the cache database
+    :type path: str
+    :param tokenizer: Tokenizer backend name
+    :type tokenizer: str
+    :param max_entries: Most entries kept, least recently used are evicted first
+    :type max_entries: int
+    :param max_age_days: Entries unused for longer than this are evicted
+    :type max_age_days: float
+    :returns: Feature cache
+    :rtype: FeatureCache
+    '''
+    namespace = cache_namespace(EXTRACTOR_VERSION, tokenizer, set(stopwords.words('english')))
+    return FeatureCache(path, namespace, FEATURE_NAMES, max_entries, max_age_days)
 
-    features_df.to_csv('../../data/tweepfake_features.csv', sep=';', index=False)
+def _split_cached(chunk: pd.DataFrame, cache: FeatureCache) -> tuple:
+    '''
+    Returns the rows of a chunk that still need extracting, and the cached
+    features of the others.
+    '''
+    if cache is None:
+        return chunk, None
+    with span('cache.lookup', rows=len(chunk)):
+        cached, missing = cache.lookup(chunk)
+    return chunk[missing], cached
+
+def _merge_cached(chunk: pd.DataFrame, cached: pd.DataFrame, extracted: pd.DataFrame,
+                  cache: FeatureCache) -> pd.DataFrame:
+    '''
+    Caches freshly extracted features and merges them with the cached ones in
+    the row order of the chunk.
+    '''
+    if cache is None:
+        return extracted
+    with span('cache.store', rows=len(extracted)):
+        cache.store(extracted)
+    
+    features_df = pd.concat([cached, extracted[FEATURE_NAMES]]).reindex(chunk.index)
+    features_df.insert(0, 'text', chunk['text'])
+    features_df.insert(1, 'label', chunk['label'])
+    
+    return features_df
+
+def iter_extracted_chunks(chunks: Iterable[pd.DataFrame], n_workers: int = None,
+                          tokenizer: str = 'nltk',
+                          cache: FeatureCache = None) -> Iterator[pd.DataFrame]:
+    '''
+    Extracts features for a stream of cleaned chunks on a process pool and yields
+    the results in input order. At most two chunks per worker are in flight, so
+    memory stays flat no matter how long the stream is. With a feature cache,
+    only the tweets without cached features are sent to the workers.
+    
+    :param chunks: Iterable of DataFrames with text and label columns
+    :type chunks: Iterable[pd.DataFrame]
+    :param n_workers: Number of worker processes, all cores if None
+    :type n_workers: int
+    :param tokenizer: Tokenizer backend name
+    :type tokenizer: str
+    :param cache: Feature cache from open_feature_cache, no caching if None
+    :type cache: FeatureCache
+    :returns: Iterator of DataFrames with text, label and the five features
+    :rtype: Iterator[pd.DataFrame]
+    '''
+    n_workers = n_workers or os.cpu_count()
+    
+    if n_workers == 1:
+        init_worker(tokenizer)
+        for chunk in chunks:
+            pending, cached = _split_cached(chunk, cache)
+            yield _merge_cached(chunk, cached, extract_chunk(pending), cache)
+        return
+    
+    # With profiling on, the workers' spans come back with their chunks
+    extract = instrumentation.in_worker(extract_chunk)
+    
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=init_worker,
+                             initargs=(tokenizer,)) as executor:
+        in_flight = deque()
+        for chunk in chunks:
+            pending, cached = _split_cached(chunk, cache)
+            in_flight.append((chunk, cached, executor.submit(extract, pending)))
+            if len(in_flight) >= 2 * n_workers:
+                chunk, cached, future = in_flight.popleft()
+                yield _merge_cached(chunk, cached, instrumentation.unwrap(future.result()), cache)
+        
+        while in_flight:
+            chunk, cached, future = in_flight.popleft()
+            yield _merge_cached(chunk, cached, instrumentation.unwrap(future.result()), cache)
+
+def extract_features_chunked(input_path: str, output_path: str,
+                             chunk_size: int = 10000, n_workers: int = None,
+                             store_path: str = None, tokenizer: str = 'nltk',
+                             cache: FeatureCache = None):
+    '''
+    Extracts features from the cleaned CSV chunk by chunk, writing each chunk to
+    the output as soon as it and all chunks before it are done. If a store path
+    is given, the feature columns are also written to a columnar feature store
+    that the analysis scripts load instead of the CSV. With a feature cache, the
+    output is still written in full, but only new or changed tweets are
+    extracted.
+    
+    :param input_path: Path to the cleaned tweets CSV
+    :type input_path: str
+    :param output_path: Path to write the features CSV to
+    :type output_path: str
+    :param chunk_size: Number of tweets per chunk
+    :type chunk_size: int
+    :param n_workers: Number of worker processes, all cores if None
+    :type n_workers: int
+    :param store_path: Directory of the feature store, no store if None
+    :type store_path: str
+    :param tokenizer: Tokenizer backend name
+    :type tokenizer: str
+    :param cache: Feature cache from open_feature_cache, no caching if None
+    :type cache: FeatureCache
+    '''
+    reader = pd.read_csv(input_path, sep=';', chunksize=chunk_size)
+    store = FeatureStoreWriter(store_path) if store_path else None
+    
+    with open(output_path, 'w', newline='') as output:
+        header = True
+        for features_df in iter_extracted_chunks(reader, n_workers, tokenizer, cache):
+            with span('extract.write', rows=len(features_df)):
+                features_df.to_csv(output, sep=';', index=False, header=header)
+                header = False
+                if store is not None:
+                    store.write(features_df)
+    
+    # Closed after the CSV so the store records its final size and mtime
+    if store is not None:
+        store.close(output_path)
+
+def main():
+    parser = argparse.ArgumentParser(description='TweepFake feature extraction')
+    parser.add_argument('--chunk-size', type=int, default=10000,
+                       help='Number of tweets per chunk')
+    parser.add_argument('--workers', type=int, default=None,
+                       help='Worker processes (default: all cores)')
+    parser.add_argument('--tokenizer', choices=sorted(TOKENIZERS), default='nltk',
+                       help='Tokenizer backend (regex needs no punkt model)')
+    parser.add_argument('--cache', type=str, default='../../data/tweepfake_features_cache.sqlite',
+                       help='Feature cache; only uncached tweets are extracted')
+    parser.add_argument('--no-cache', action='store_true',
+                       help='Extract every tweet without reading or writing the cache')
+    parser.add_argument('--cache-max-entries', type=int, default=None,
+                       help='Most cached tweets kept, least recently used evicted first')
+    parser.add_argument('--cache-max-age-days', type=float, default=None,
+                       help='Evict cached tweets unused for this many days')
+    parser.add_argument('--profile', type=str, default=None, metavar='TRACE_JSON',
+                       help='Print per-step timings and write a Chrome trace')
+    args = parser.parse_args()
+    
+    if args.profile:
+        instrumentation.enable(args.profile)
+    
+    # Loads NLTK resources
+    download_nltk_resources(args.tokenizer)
+    
+    cache = None
+    if not args.no_cache:
+        cache = open_feature_cache(args.cache, args.tokenizer, args.cache_max_entries,
+                                   args.cache_max_age_days)
+    
+    output_path = '../../data/tweepfake_features.csv'
+    try:
+        extract_features_chunked('../../data/tweepfake.csv', output_path,
+                                 chunk_size=args.chunk_size, n_workers=args.workers,
+                                 store_path=store_path_for(output_path),
+                                 tokenizer=args.tokenizer, cache=cache)
+        
+        if cache is not None:
+            print(f"Feature cache: {cache.hits} cached, {cache.misses} extracted")
+    finally:
+        # Keeps what was cached before a crash or Ctrl-C
+        if cache is not None:
+            cache.close()
+    
+    instrumentation.report()
     
 if __name__ == "__main__": main()
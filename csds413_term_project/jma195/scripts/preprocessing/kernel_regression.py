@@ -0,0 +1,101 @@
+'''
+Regression check for the batch feature kernels.
+
+Computes the five features of every tweet both with the per-tweet
+compute_features and with the batch kernels, and reports every tweet where they
+differ. Inputs are the cleaned TweepFake tweets (if present) plus random
+tweets built from letters that exercise the capitalization rules, including
+non-ASCII and titlecase letters.
+
+:author: Jacob Anderson
+:version: 0.1.0
+'''
+
+import argparse
+import os
+import random
+import sys
+import time
+import pandas as pd
+from nltk.corpus import stopwords
+from csds413_term_project.feature_kernels import FEATURE_NAMES, TokenBatch, batch_features
+from csds413_term_project.tokenization import TOKENIZERS, TokenizedTweet, get_tokenizer
+from feature_extract import compute_features, download_nltk_resources
+
+# Letters that exercise the capitalization rules
+LETTERS = ['a', 'i', 'I', 'A', 'b', 'B', 'z', 'Z', 'é', 'É', 'ß', 'İ', 'ǅ', 'ª', 'Σ', '中']
+
+def random_tweets(n: int, seed: int = 42) -> list:
+    '''
+    Builds random tokenized tweets, including ones without words or sentences.
+
+    :param n: Number of tweets
+    :type n: int
+    :param seed: Random seed
+    :type seed: int
+    :returns: List of TokenizedTweet
+    :rtype: list
+    '''
+    rng = random.Random(seed)
+    tweets = []
+    for _ in range(n):
+        words = [''.join(rng.choice(LETTERS) for _ in range(rng.randint(1, 7)))
+                 for _ in range(rng.randint(0, 8))]
+        sentence_starts = sorted(rng.randint(0, len(words)) for _ in range(rng.randint(0, 3)))
+        tweets.append(TokenizedTweet(words, sentence_starts))
+    return tweets
+
+def compare(tweets: list, stopwords_set: set) -> int:
+    '''
+    Compares the batch kernels with compute_features and prints the first few
+    mismatches.
+
+    :param tweets: List of TokenizedTweet
+    :type tweets: list
+    :param stopwords_set: Set of functional words
+    :type stopwords_set: set
+    :returns: Number of mismatching tweets
+    :rtype: int
+    '''
+    start_time = time.perf_counter()
+    expected = [compute_features(tweet, stopwords_set) for tweet in tweets]
+    scalar_seconds = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    actual = batch_features(TokenBatch.from_tokenized(tweets), stopwords_set)
+    batch_seconds = time.perf_counter() - start_time
+
+    mismatches = 0
+    for i, features in enumerate(expected):
+        if any(features[name] != actual[name][i] for name in FEATURE_NAMES):
+            mismatches += 1
+            if mismatches <= 10:
+                print(f"  {tweets[i]}: {features} != {({name: actual[name][i] for name in FEATURE_NAMES})}")
+
+    print(f"compute_features {scalar_seconds:.2f}s, batch_features {batch_seconds:.2f}s "
+          f"({scalar_seconds / max(batch_seconds, 1e-9):.1f}x faster)")
+    return mismatches
+
+def main():
+    parser = argparse.ArgumentParser(description='Batch feature kernel regression check')
+    parser.add_argument('--tweets', type=str, default='../../data/tweepfake.csv',
+                       help='Cleaned TweepFake CSV to replay, skipped if missing')
+    parser.add_argument('--random', type=int, default=100000,
+                       help='Number of random tweets')
+    parser.add_argument('--tokenizer', choices=sorted(TOKENIZERS), default='regex',
+                       help='Tokenizer backend for the replayed tweets')
+    args = parser.parse_args()
+
+    download_nltk_resources(args.tokenizer)
+    stopwords_set = set(stopwords.words('english'))
+
+    tweets = random_tweets(args.random)
+    if os.path.exists(args.tweets):
+        tokenizer = get_tokenizer(args.tokenizer)
+        tweets += [tokenizer(text) for text in pd.read_csv(args.tweets, sep=';')['text'].dropna()]
+
+    mismatches = compare(tweets, stopwords_set)
+    print(f"{mismatches} mismatches in {len(tweets)} tweets")
+    sys.exit(1 if mismatches else 0)
+
+if __name__ == "__main__": main()
@@ -0,0 +1,225 @@
+'''
+Streaming clean -> extract pipeline for the TweepFake dataset.
+
+Reads the raw tweets in chunks, cleans and filters each chunk, extracts the
+features and hands the result to a sink, without writing the intermediate
+cleaned CSV. Only a few chunks are held in memory at once, so feeds larger
+than RAM can be processed.
+
+:author: Jacob Anderson
+:version: 0.1.0
+'''
+
+import argparse
+import os
+from typing import Iterable, Iterator
+import pandas as pd
+from csds413_term_project.feature_store import FeatureStoreWriter, store_path_for
+from csds413_term_project.tokenization import TOKENIZERS
+from csds413_term_project import instrumentation
+from csds413_term_project.instrumentation import span
+from tweepfake_clean import clean_frame, clean_frame_vectorized
+from feature_extract import download_nltk_resources, iter_extracted_chunks, open_feature_cache
+
+class CsvSink:
+    '''
+    Appends feature chunks to a semicolon separated CSV.
+    '''
+    def __init__(self, path: str):
+        self.output = open(path, 'w', newline='')
+        self.header = True
+
+    def write(self, chunk: pd.DataFrame):
+        chunk.to_csv(self.output, sep=';', index=False, header=self.header)
+        self.header = False
+
+    def close(self):
+        self.output.close()
+
+class ParquetSink:
+    '''
+    Appends feature chunks to a Parquet file as row groups. Needs pyarrow.
+    '''
+    def __init__(self, path: str):
+        self.path = path
+        self.writer = None
+
+    def write(self, chunk: pd.DataFrame):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+class MemorySink:
+    '''
+    Collects feature chunks into a single DataFrame in memory.
+    '''
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, chunk: pd.DataFrame):
+        self.chunks.append(chunk)
+
+    def close(self):
+        pass
+
+    def result(self) -> pd.DataFrame:
+        return pd.concat(self.chunks, ignore_index=True)
+
+class TeeSink:
+    '''
+    Hands every feature chunk to several sinks, closing them in the given order.
+    '''
+    def __init__(self, *sinks):
+        self.sinks = sinks
+
+    def write(self, chunk: pd.DataFrame):
+        for sink in self.sinks:
+            sink.write(chunk)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+def make_sink(path: str, store: bool = False):
+    '''
+    Picks a sink from the output file extension.
+
+    :param path: Output path ending in .csv or .parquet
+    :type path: str
+    :param store: Whether to also write a feature store next to the output
+    :type store: bool
+    :returns: Sink writing to the path
+    '''
+    sink = ParquetSink(path) if os.path.splitext(path)[1] == '.parquet' else CsvSink(path)
+    if not store:
+        return sink
+
+    # The output is closed first so the store records its final size and mtime
+    return TeeSink(sink, FeatureStoreWriter(store_path_for(path), source_path=path))
+
+def iter_raw_chunks(path: str, chunk_size: int = 10000) -> Iterator[pd.DataFrame]:
+    '''
+    Reads the raw TweepFake CSV in chunks.
+
+    :param path: Path to the raw CSV
+    :type path: str
+    :param chunk_size: Number of tweets per chunk
+    :type chunk_size: int
+    :returns: Iterator of raw DataFrames
+    :rtype: Iterator[pd.DataFrame]
+    '''
+    yield from pd.read_csv(path, sep=';', chunksize=chunk_size)
+
+def iter_cleaned_chunks(chunks: Iterable[pd.DataFrame],
+                        vectorized: bool = False) -> Iterator[pd.DataFrame]:
+    '''
+    Cleans and filters a stream of raw chunks, skipping chunks that end up empty.
+
+    :param chunks: Iterable of raw DataFrames
+    :type chunks: Iterable[pd.DataFrame]
+    :param vectorized: Whether to clean with the pyarrow string kernels
+    :type vectorized: bool
+    :returns: Iterator of DataFrames with text and label columns
+    :rtype: Iterator[pd.DataFrame]
+    '''
+    clean = clean_frame_vectorized if vectorized else clean_frame
+
+    for chunk in chunks:
+        cleaned = clean(chunk)
+        if len(cleaned) > 0:
+            yield cleaned
+
+def run_pipeline(chunks: Iterable[pd.DataFrame], sink, vectorized: bool = False,
+                 n_workers: int = None, keep_text: bool = True, tokenizer: str = 'nltk',
+                 cache=None):
+    '''
+    Streams raw chunks through cleaning, filtering and feature extraction into a
+    sink. The sink is closed when the stream ends.
+
+    :param chunks: Iterable of raw DataFrames
+    :type chunks: Iterable[pd.DataFrame]
+    :param sink: Object with write(chunk) and close() methods
+    :param vectorized: Whether to clean with the pyarrow string kernels
+    :type vectorized: bool
+    :param n_workers: Number of extraction worker processes, all cores if None
+    :type n_workers: int
+    :param keep_text: Whether to keep the tweet text next to the features
+    :type keep_text: bool
+    :param tokenizer: Tokenizer backend name
+    :type tokenizer: str
+    :param cache: Feature cache, only uncached tweets are extracted; no caching if None
+    :type cache: FeatureCache
+    '''
+    cleaned = iter_cleaned_chunks(chunks, vectorized)
+
+    try:
+        for features_df in iter_extracted_chunks(cleaned, n_workers, tokenizer, cache):
+            if not keep_text:
+                features_df = features_df.drop(columns='text')
+            with span('pipeline.write', rows=len(features_df)):
+                sink.write(features_df)
+    finally:
+        sink.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Streaming TweepFake clean and extract pipeline')
+    parser.add_argument('--input', type=str, default='../../data/tweepfake_raw.csv',
+                       help='Raw TweepFake CSV')
+    parser.add_argument('--output', type=str, default='../../data/tweepfake_features.csv',
+                       help='Output path; .parquet writes Parquet, anything else CSV')
+    parser.add_argument('--chunk-size', type=int, default=10000,
+                       help='Number of tweets per chunk')
+    parser.add_argument('--workers', type=int, default=None,
+                       help='Extraction worker processes (default: all cores)')
+    parser.add_argument('--vectorized', action='store_true',
+                       help='Clean with pyarrow string kernels')
+    parser.add_argument('--drop-text', action='store_true',
+                       help='Leave the tweet text out of the output')
+    parser.add_argument('--store', action='store_true',
+                       help='Also write a columnar feature store next to the output')
+    parser.add_argument('--tokenizer', choices=sorted(TOKENIZERS), default='nltk',
+                       help='Tokenizer backend (regex needs no punkt model)')
+    parser.add_argument('--cache', type=str, default=None,
+                       help='Feature cache; only uncached tweets are extracted')
+    parser.add_argument('--cache-max-entries', type=int, default=None,
+                       help='Most cached tweets kept, least recently used evicted first')
+    parser.add_argument('--cache-max-age-days', type=float, default=None,
+                       help='Evict cached tweets unused for this many days')
+    parser.add_argument('--profile', type=str, default=None, metavar='TRACE_JSON',
+                       help='Print per-step timings and write a Chrome trace')
+    args = parser.parse_args()
+
+    if args.profile:
+        instrumentation.enable(args.profile)
+
+    download_nltk_resources(args.tokenizer)
+
+    cache = None
+    if args.cache:
+        cache = open_feature_cache(args.cache, args.tokenizer, args.cache_max_entries,
+                                   args.cache_max_age_days)
+
+    try:
+        run_pipeline(iter_raw_chunks(args.input, args.chunk_size),
+                     make_sink(args.output, args.store), vectorized=args.vectorized,
+                     n_workers=args.workers, keep_text=not args.drop_text,
+                     tokenizer=args.tokenizer, cache=cache)
+
+        if cache is not None:
+            print(f"Feature cache: {cache.hits} cached, {cache.misses} extracted")
+    finally:
+        # Keeps what was cached before a crash or Ctrl-C
+        if cache is not None:
+            cache.close()
+
+    instrumentation.report()
+
+if __name__ == "__main__": main()
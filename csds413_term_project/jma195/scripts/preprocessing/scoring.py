@@ -0,0 +1,255 @@
+'''
+Online scoring of single tweets with a trained classifier.
+
+Loads a model bundle (classifier, scaler and polynomial expansion) from the
+model registry once and runs clean_tweet -> extract_features -> scale -> predict
+on incoming tweets. The single-tweet path avoids pandas and the per-call input
+validation of scikit-learn. The preprocessing is reduced to numpy arithmetic,
+and linear models and Gaussian naive Bayes are evaluated directly from their
+fitted parameters. Run as a script, it reports p50/p99 scoring latency.
+
+:author: Jacob Anderson
+:version: 0.1.0
+'''
+
+import argparse
+import random
+import time
+from typing import Callable, Iterable
+import numpy as np
+import pandas as pd
+from nltk.corpus import stopwords
+from csds413_term_project.feature_kernels import FEATURE_NAMES
+from csds413_term_project.model_registry import ModelBundle, ModelRegistry
+from csds413_term_project.tokenization import TOKENIZERS, get_tokenizer
+from tweepfake_clean import clean_tweet
+from feature_extract import download_nltk_resources, extract_features
+
+def compile_preprocessing(bundle: ModelBundle) -> Callable:
+    '''
+    Reduces the scaler, polynomial expansion and column selection of a bundle to
+    numpy arithmetic on raw feature rows.
+
+    :param bundle: Model bundle
+    :type bundle: ModelBundle
+    :returns: Function mapping raw features of shape (..., 5) to model inputs
+    :rtype: Callable
+    '''
+    scaler = bundle.scaler
+    mean = scaler.mean_ if scaler.with_mean else 0.0
+    scale = scaler.scale_ if scaler.with_std else 1.0
+
+    columns = bundle.selected_indices
+
+    if bundle.poly is None:
+        def preprocess(X):
+            Z = (X - mean) / scale
+            return Z if columns is None else Z[..., columns]
+        return preprocess
+
+    # Every polynomial output column is a product of powers of the inputs
+    powers = bundle.poly.powers_
+    if columns is not None:
+        powers = powers[columns]
+
+    return lambda X: np.prod(((X - mean) / scale)[..., None, :] ** powers, axis=-1)
+
+def compile_classifier(estimator) -> Callable:
+    '''
+    Builds a fast predictor for a single preprocessed row. Binary linear models
+    (logistic regression, linear SVM, LDA) reduce to a dot product and Gaussian
+    naive Bayes to its log likelihoods; anything else falls back to predict().
+
+    :param estimator: Fitted scikit-learn classifier
+    :returns: Function mapping one preprocessed row to the predicted class
+    :rtype: Callable
+    '''
+    classes = estimator.classes_
+
+    coef = getattr(estimator, 'coef_', None) if hasattr(estimator, 'decision_function') else None
+    if coef is not None and len(classes) == 2 and coef.shape[0] == 1:
+        weights = np.ravel(coef)
+        intercept = float(np.ravel(estimator.intercept_)[0])
+        return lambda x: classes[int(x @ weights + intercept > 0)]
+
+    if hasattr(estimator, 'theta_') and hasattr(estimator, 'var_'):
+        log_norm = np.log(estimator.class_prior_) - 0.5 * np.sum(np.log(2 * np.pi * estimator.var_), axis=1)
+        theta = estimator.theta_
+        inv_var = 1 / estimator.var_
+        return lambda x: classes[np.argmax(log_norm - 0.5 * np.sum((x - theta) ** 2 * inv_var, axis=1))]
+
+    return lambda x: estimator.predict(x[None, :])[0]
+
+class TweetScorer:
+    '''
+    Scores raw tweets with a trained model bundle. The model, stopwords and
+    tokenizer backend are loaded once when the scorer is built.
+    '''
+    def __init__(self, bundle: ModelBundle, stopwords_set: set = None, tokenizer: str = 'nltk'):
+        self.bundle = bundle
+        self.stopwords_set = stopwords_set or set(stopwords.words('english'))
+        self.tokenizer = get_tokenizer(tokenizer)
+        self.preprocess = compile_preprocessing(bundle)
+        self.classify = compile_classifier(bundle.estimator)
+
+        # The punkt model is cached after its first use
+        self.tokenizer('Warm up.')
+
+    @classmethod
+    def from_registry(cls, root: str, tag: str, tokenizer: str = 'nltk') -> 'TweetScorer':
+        '''
+        Builds a scorer from the bundle a registry tag points at.
+
+        :param root: Model registry directory
+        :type root: str
+        :param tag: Tag of the bundle, e.g. 'classification'
+        :type tag: str
+        :param tokenizer: Tokenizer backend name
+        :type tokenizer: str
+        :returns: Scorer for the tagged model
+        :rtype: TweetScorer
+        '''
+        return cls(ModelRegistry(root).load_tagged(tag), tokenizer=tokenizer)
+
+    def features(self, text: str) -> np.ndarray:
+        '''
+        Cleans a raw tweet and extracts its raw features.
+
+        :param text: Raw tweet text
+        :type text: str
+        :returns: Array of the five features
+        :rtype: np.ndarray
+        '''
+        features = extract_features(clean_tweet(text), self.stopwords_set, tokenizer=self.tokenizer)
+        return np.array([features[name] for name in FEATURE_NAMES])
+
+    def score(self, text: str):
+        '''
+        Classifies a single raw tweet.
+
+        :param text: Raw tweet text
+        :type text: str
+        :returns: Predicted class, 1 for bot and 0 for human
+        '''
+        return self.classify(self.preprocess(self.features(text)))
+
+    def batch_inputs(self, texts: Iterable[str]) -> np.ndarray:
+        '''
+        Turns a batch of raw tweets into preprocessed model inputs.
+
+        :param texts: Raw tweet texts
+        :type texts: Iterable[str]
+        :returns: Model inputs, one row per tweet
+        :rtype: np.ndarray
+        '''
+        X = np.array([self.features(text) for text in texts]).reshape(-1, len(FEATURE_NAMES))
+        return self.preprocess(X)
+
+    def score_batch(self, texts: Iterable[str]) -> np.ndarray:
+        '''
+        Classifies a batch of raw tweets with one vectorized predict call.
+
+        :param texts: Raw tweet texts
+        :type texts: Iterable[str]
+        :returns: Predicted classes, 1 for bot and 0 for human
+        :rtype: np.ndarray
+        '''
+        inputs = self.batch_inputs(texts)
+        if len(inputs) == 0:
+            return np.array([], dtype=self.bundle.estimator.classes_.dtype)
+        return self.bundle.estimator.predict(inputs)
+
+    def score_batch_proba(self, texts: Iterable[str]) -> tuple:
+        '''
+        Classifies a batch of raw tweets and gives the bot probability of each,
+        if the classifier has predict_proba.
+
+        :param texts: Raw tweet texts
+        :type texts: Iterable[str]
+        :returns: Tuple predicted classes, bot probabilities or None
+        :rtype: tuple
+        '''
+        estimator = self.bundle.estimator
+        inputs = self.batch_inputs(texts)
+        if len(inputs) == 0:
+            return np.array([], dtype=estimator.classes_.dtype), None
+
+        predictions = estimator.predict(inputs)
+        if not hasattr(estimator, 'predict_proba'):
+            return predictions, None
+
+        bot_column = list(estimator.classes_).index(1)
+        return predictions, estimator.predict_proba(inputs)[:, bot_column]
+
+def latency_percentiles(func: Callable, inputs: list) -> dict:
+    '''
+    Times func on every input and summarizes the latency.
+
+    :param func: Function called once per input
+    :type func: Callable
+    :param inputs: Inputs to time
+    :type inputs: list
+    :returns: Dict with p50, p99 and mean latency in microseconds
+    :rtype: dict
+    '''
+    latencies = np.empty(len(inputs))
+    for i, item in enumerate(inputs):
+        start_time = time.perf_counter_ns()
+        func(item)
+        latencies[i] = (time.perf_counter_ns() - start_time) / 1000
+
+    return {'p50': np.percentile(latencies, 50), 'p99': np.percentile(latencies, 99),
+            'mean': latencies.mean()}
+
+def main():
+    parser = argparse.ArgumentParser(description='Single tweet scoring benchmark')
+    parser.add_argument('--models', type=str, default='../../../axp1343/models',
+                       help='Model registry directory')
+    parser.add_argument('--tag', type=str, default='classification',
+                       help='Registry tag of the model bundle')
+    parser.add_argument('--tweets', type=str, default='../../data/tweepfake_raw.csv',
+                       help='Raw tweets to score')
+    parser.add_argument('--n', type=int, default=5000,
+                       help='Number of tweets to time')
+    parser.add_argument('--tokenizer', choices=sorted(TOKENIZERS), default='nltk',
+                       help='Tokenizer backend (regex needs no punkt model)')
+    args = parser.parse_args()
+
+    download_nltk_resources(args.tokenizer)
+
+    scorer = TweetScorer.from_registry(args.models, args.tag, args.tokenizer)
+    print(f"Model: {type(scorer.bundle.estimator).__name__} ({args.tag}, {args.tokenizer} tokenizer)")
+
+    texts = pd.read_csv(args.tweets, sep=';')['text'].dropna().tolist()
+    texts = random.Random(42).sample(texts, min(args.n, len(texts)))
+
+    # Stage breakdown of the single-tweet path
+    cleaned = [clean_tweet(text) for text in texts]
+    raw_features = [scorer.features(text) for text in texts]
+    inputs = [scorer.preprocess(x) for x in raw_features]
+    stages = [
+        ('clean_tweet', clean_tweet, texts),
+        ('extract_features', lambda text: extract_features(text, scorer.stopwords_set,
+                                                          tokenizer=scorer.tokenizer), cleaned),
+        ('preprocess', scorer.preprocess, raw_features),
+        ('classify', scorer.classify, inputs),
+        ('score (total)', scorer.score, texts),
+    ]
+
+    print(f"\nLatency over {len(texts)} tweets (microseconds):")
+    print(f"{'Stage':<20} {'p50':>10} {'p99':>10} {'mean':>10}")
+    for name, func, stage_inputs in stages:
+        latency = latency_percentiles(func, stage_inputs)
+        print(f"{name:<20} {latency['p50']:>10.1f} {latency['p99']:>10.1f} {latency['mean']:>10.1f}")
+
+    start_time = time.perf_counter()
+    scorer.score_batch(texts)
+    elapsed = time.perf_counter() - start_time
+    print(f"\nscore_batch: {len(texts) / elapsed:.0f} tweets/s")
+
+    # The fast path has to agree with the model's own predict
+    fast = np.array([scorer.score(text) for text in texts])
+    mismatches = int(np.sum(fast != scorer.score_batch(texts)))
+    print(f"Fast path mismatches against predict: {mismatches}")
+
+if __name__ == "__main__": main()
@@ -0,0 +1,383 @@
+'''
+Asyncio scoring server with micro-batching.
+
+Accepts single-tweet scoring requests over a minimal HTTP/1.1 interface
+(POST /score with {"text": ...}, GET /stats) built on asyncio streams, so it
+runs locally with nothing but the standard library. Concurrent requests are
+coalesced into micro-batches: a batch is sent as soon as it is full or its
+oldest request has waited max_wait_ms. Batches are scored on a pool of worker
+processes, each holding its own TweetScorer. At most one batch per worker is in
+flight, so under load requests pile up into larger batches instead of queueing
+in the pool, and the vectorized scaling and predict_proba calls amortize their
+per-call overhead.
+
+Run with --load to start the server and drive it with a local load generator
+that reports client-side throughput and latency next to the server counters.
+
+:author: Jacob Anderson
+:version: 0.1.0
+'''
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from collections import deque
+from http import HTTPStatus
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Callable
+import numpy as np
+import pandas as pd
+from scoring import TweetScorer
+from feature_extract import download_nltk_resources
+from csds413_term_project.tokenization import TOKENIZERS
+
+LABELS = {0: 'human', 1: 'bot'}
+
+# Per-process scorer, loaded once by init_worker
+_worker_scorer = None
+
+def init_worker(models: str, tag: str, tokenizer: str = 'nltk'):
+    '''
+    Loads the model bundle and tokenizer backend for the current worker process.
+    '''
+    global _worker_scorer
+    _worker_scorer = TweetScorer.from_registry(models, tag, tokenizer)
+
+def score_texts(texts: list) -> list:
+    '''
+    Scores a batch of raw tweets in a worker process.
+
+    :param texts: Raw tweet texts
+    :type texts: list
+    :returns: List of result dicts with label and bot probability
+    :rtype: list
+    '''
+    predictions, probabilities = _worker_scorer.score_batch_proba(texts)
+
+    return [{'label': LABELS.get(int(prediction), str(prediction)),
+             'bot_probability': None if probabilities is None else float(probabilities[i])}
+            for i, prediction in enumerate(predictions)]
+
+class ServerStats:
+    '''
+    Throughput and latency counters of the server. Latencies of the most recent
+    requests are kept in a bounded window for the percentiles.
+    '''
+    def __init__(self, window: int = 10000):
+        self.started = time.perf_counter()
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.latencies = deque(maxlen=window)
+        self.batch_sizes = deque(maxlen=window)
+
+    def record_batch(self, size: int, latencies: list):
+        self.batches += 1
+        self.requests += size
+        self.batch_sizes.append(size)
+        self.latencies.extend(latencies)
+
+    def snapshot(self, queue_depth: int = 0) -> dict:
+        '''
+        Summarizes the counters.
+
+        :param queue_depth: Number of requests waiting for a batch
+        :type queue_depth: int
+        :returns: Dict of counters, latencies in milliseconds
+        :rtype: dict
+        '''
+        uptime = time.perf_counter() - self.started
+        latencies = np.array(self.latencies) * 1000 if self.latencies else np.zeros(1)
+
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'batches': self.batches,
+            'mean_batch_size': float(np.mean(self.batch_sizes)) if self.batch_sizes else 0.0,
+            'throughput_rps': self.requests / uptime if uptime > 0 else 0.0,
+            'latency_p50_ms': float(np.percentile(latencies, 50)),
+            'latency_p99_ms': float(np.percentile(latencies, 99)),
+            'queue_depth': queue_depth,
+            'uptime_s': uptime,
+        }
+
+class MicroBatcher:
+    '''
+    Coalesces single requests into batches and runs them on an executor.
+    '''
+    def __init__(self, score_batch: Callable, executor: Executor, max_in_flight: int,
+                 max_batch_size: int = 64, max_wait_ms: float = 5.0):
+        self.score_batch = score_batch
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue()
+        self.slots = asyncio.Semaphore(max_in_flight)
+        self.stats = ServerStats()
+        self.tasks = set()
+
+    async def submit(self, text: str) -> dict:
+        '''
+        Queues a tweet and waits for its result.
+
+        :param text: Raw tweet text
+        :type text: str
+        :returns: Result dict with label and bot probability
+        :rtype: dict
+        '''
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((text, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self) -> list:
+        '''
+        Waits for a first request, then gathers more until the batch is full or
+        the first request's deadline passes.
+        '''
+        batch = [await self.queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def run(self):
+        '''
+        Forms and dispatches batches until cancelled.
+        '''
+        while True:
+            batch = await self._collect()
+
+            # Requests that arrive while every worker is busy join this batch
+            await self.slots.acquire()
+            while len(batch) < self.max_batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            task = asyncio.create_task(self._run_batch(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _run_batch(self, batch: list):
+        texts = [text for text, _, _ in batch]
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.score_batch, texts)
+        except Exception as error:
+            self.stats.errors += len(batch)
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        finally:
+            self.slots.release()
+
+        now = time.perf_counter()
+        for (_, future, submitted), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+        self.stats.record_batch(len(batch), [now - submitted for _, _, submitted in batch])
+
+class ScoringServer:
+    '''
+    Minimal HTTP/1.1 front end of the micro-batcher, with keep-alive.
+    '''
+    def __init__(self, batcher: MicroBatcher):
+        self.batcher = batcher
+
+    async def route(self, method: str, path: str, body: bytes) -> tuple:
+        '''
+        Dispatches a request.
+
+        :returns: Tuple HTTP status, JSON-serializable payload
+        :rtype: tuple
+        '''
+        if method == 'POST' and path == '/score':
+            try:
+                text = json.loads(body)['text']
+            except (ValueError, KeyError, TypeError):
+                return 400, {'error': 'expected a JSON body {"text": ...}'}
+            if not isinstance(text, str):
+                return 400, {'error': 'text must be a string'}
+            return 200, await self.batcher.submit(text)
+
+        if method == 'GET' and path == '/stats':
+            return 200, self.batcher.stats.snapshot(self.batcher.queue.qsize())
+
+        return 404, {'error': f'no route for {method} {path}'}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+
+                headers = {}
+                while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                try:
+                    status, payload = await self.route(method, path, body)
+                except Exception as error:
+                    status, payload = 500, {'error': str(error)}
+
+                data = json.dumps(payload).encode()
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write(f'HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n'
+                             f'Content-Type: application/json\r\n'
+                             f'Content-Length: {len(data)}\r\n'
+                             f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode()
+                             + data)
+                await writer.drain()
+
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+async def http_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                       method: str, path: str, payload: dict = None) -> tuple:
+    '''
+    Sends one request on an open keep-alive connection and reads the response.
+
+    :returns: Tuple HTTP status, decoded JSON payload
+    :rtype: tuple
+    '''
+    body = json.dumps(payload).encode() if payload is not None else b''
+    writer.write(f'{method} {path} HTTP/1.1\r\nHost: localhost\r\n'
+                 f'Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n'.encode()
+                 + body)
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while (line := await reader.readline()) not in (b'\r\n', b''):
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    return status, json.loads(await reader.readexactly(int(headers['content-length'])))
+
+async def run_load(host: str, port: int, texts: list, concurrency: int) -> dict:
+    '''
+    Drives the server with concurrent clients, each sending its share of the
+    tweets one request at a time over a keep-alive connection.
+
+    :param host: Server host
+    :type host: str
+    :param port: Server port
+    :type port: int
+    :param texts: Tweets to score
+    :type texts: list
+    :param concurrency: Number of concurrent clients
+    :type concurrency: int
+    :returns: Dict with client-side throughput and latency in milliseconds
+    :rtype: dict
+    '''
+    latencies = []
+
+    async def client(share: list):
+        reader, writer = await asyncio.open_connection(host, port)
+        for text in share:
+            start_time = time.perf_counter()
+            await http_request(reader, writer, 'POST', '/score', {'text': text})
+            latencies.append(time.perf_counter() - start_time)
+        writer.close()
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(client(texts[i::concurrency]) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start_time
+
+    latencies = np.array(latencies) * 1000
+    return {'requests': len(latencies), 'throughput_rps': len(latencies) / elapsed,
+            'latency_p50_ms': float(np.percentile(latencies, 50)),
+            'latency_p99_ms': float(np.percentile(latencies, 99))}
+
+async def serve(args):
+    n_workers = args.workers or os.cpu_count()
+    executor = ProcessPoolExecutor(n_workers, initializer=init_worker,
+                                   initargs=(args.models, args.tag, args.tokenizer))
+    batcher = MicroBatcher(score_texts, executor, max_in_flight=n_workers,
+                           max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms)
+    server = ScoringServer(batcher)
+
+    batching = asyncio.create_task(batcher.run())
+    tcp_server = await asyncio.start_server(server.handle, args.host, args.port)
+    port = tcp_server.sockets[0].getsockname()[1]
+
+    try:
+        if args.load is None:
+            print(f"Serving on http://{args.host}:{port} (POST /score, GET /stats)")
+            await tcp_server.serve_forever()
+            return
+
+        texts = pd.read_csv(args.tweets, sep=';')['text'].dropna().tolist()
+        texts = random.Random(42).choices(texts, k=args.load)
+
+        # Warms up the workers so model loading is not part of the measurement
+        await asyncio.gather(*(batcher.submit('Warm up.') for _ in range(n_workers)))
+        batcher.stats = ServerStats()
+
+        client_stats = await run_load(args.host, port, texts, args.concurrency)
+        server_stats = batcher.stats.snapshot(batcher.queue.qsize())
+
+        print(f"Load: {args.load} requests, {args.concurrency} clients, "
+              f"max batch {args.max_batch_size}, max wait {args.max_wait_ms}ms")
+        print(f"  Client throughput: {client_stats['throughput_rps']:.0f} req/s")
+        print(f"  Client latency:    p50 {client_stats['latency_p50_ms']:.2f}ms, "
+              f"p99 {client_stats['latency_p99_ms']:.2f}ms")
+        print(f"  Server batches:    {server_stats['batches']} "
+              f"(mean size {server_stats['mean_batch_size']:.1f})")
+        print(f"  Server latency:    p50 {server_stats['latency_p50_ms']:.2f}ms, "
+              f"p99 {server_stats['latency_p99_ms']:.2f}ms")
+    finally:
+        tcp_server.close()
+        batching.cancel()
+        executor.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-batching tweet scoring server')
+    parser.add_argument('--host', type=str, default='127.0.0.1',
+                       help='Address to listen on')
+    parser.add_argument('--port', type=int, default=8000,
+                       help='Port to listen on (0 picks a free one)')
+    parser.add_argument('--models', type=str, default='../../../axp1343/models',
+                       help='Model registry directory')
+    parser.add_argument('--tag', type=str, default='classification',
+                       help='Registry tag of the model bundle')
+    parser.add_argument('--tokenizer', choices=sorted(TOKENIZERS), default='nltk',
+                       help='Tokenizer backend (regex needs no punkt model)')
+    parser.add_argument('--workers', type=int, default=None,
+                       help='Scoring worker processes (default: all cores)')
+    parser.add_argument('--max-batch-size', type=int, default=64,
+                       help='Largest micro-batch')
+    parser.add_argument('--max-wait-ms', type=float, default=5.0,
+                       help='Longest a request waits for its batch to fill')
+    parser.add_argument('--load', type=int, default=None,
+                       help='Run a local load test with this many requests, then exit')
+    parser.add_argument('--concurrency', type=int, default=32,
+                       help='Concurrent clients of the load test')
+    parser.add_argument('--tweets', type=str, default='../../data/tweepfake_raw.csv',
+                       help='Raw tweets for the load test')
+    args = parser.parse_args()
+
+    download_nltk_resources(args.tokenizer)
+
+    asyncio.run(serve(args))
+
+if __name__ == "__main__": main()
@@ -0,0 +1,118 @@
+'''
+Conformance check of the regex tokenizer backend against the NLTK backend.
+
+Extracts the five features of every cleaned tweet with both backends and
+reports, per feature, how often the values differ, along with how often the
+sentence count and the alphabetic words differ and how much faster the regex
+backend is. The regex backend approximates punkt's trained abbreviation and
+capitalization statistics with fixed rules, so a small mismatch rate is
+expected; the check fails when a feature differs more often than allowed.
+
+:author: Jacob Anderson
+:version: 0.1.0
+'''
+
+import argparse
+import sys
+import time
+import numpy as np
+import pandas as pd
+from nltk.corpus import stopwords
+from csds413_term_project.feature_kernels import FEATURE_NAMES
+from csds413_term_project.tokenization import tokenize_tweet, tokenize_tweet_regex
+from feature_extract import download_nltk_resources, compute_features
+
+def tokenize_all(tokenizer, texts: list) -> tuple:
+    '''
+    Tokenizes every text and times the backend.
+
+    :param tokenizer: Tokenizer backend
+    :type tokenizer: Callable
+    :param texts: Cleaned tweet texts
+    :type texts: list
+    :returns: Tuple list of TokenizedTweet, seconds taken
+    :rtype: tuple
+    '''
+    start_time = time.perf_counter()
+    tokens = [tokenizer(text) for text in texts]
+    return tokens, time.perf_counter() - start_time
+
+def feature_matrix(tokens: list, stopwords_set: set) -> np.ndarray:
+    '''
+    Computes the five features of every tokenized tweet.
+
+    :param tokens: List of TokenizedTweet
+    :type tokens: list
+    :param stopwords_set: Set of functional words
+    :type stopwords_set: set
+    :returns: Array of shape (n_tweets, 5)
+    :rtype: np.ndarray
+    '''
+    rows = [compute_features(tweet, stopwords_set) for tweet in tokens]
+    return np.array([[row[name] for name in FEATURE_NAMES] for row in rows], dtype=float).reshape(-1, len(FEATURE_NAMES))
+
+def compare(texts: list, stopwords_set: set, n_examples: int = 10) -> dict:
+    '''
+    Compares the regex backend with the NLTK backend on every text and prints
+    the first few tweets whose tokens differ.
+
+    :param texts: Cleaned tweet texts
+    :type texts: list
+    :param stopwords_set: Set of functional words
+    :type stopwords_set: set
+    :param n_examples: Number of differing tweets to print
+    :type n_examples: int
+    :returns: Dict of mismatch rates per feature, for sentences and words, and timings
+    :rtype: dict
+    '''
+    reference, reference_seconds = tokenize_all(tokenize_tweet, texts)
+    candidate, candidate_seconds = tokenize_all(tokenize_tweet_regex, texts)
+
+    shown = 0
+    for text, expected, actual in zip(texts, reference, candidate):
+        if expected != actual and shown < n_examples:
+            print(f"  {text!r}")
+            print(f"    nltk:  {expected.words} starts {expected.sentence_starts}")
+            print(f"    regex: {actual.words} starts {actual.sentence_starts}")
+            shown += 1
+
+    differs = ~np.isclose(feature_matrix(reference, stopwords_set),
+                          feature_matrix(candidate, stopwords_set), equal_nan=True)
+
+    n = max(len(texts), 1)
+    report = {name: float(differs[:, j].sum()) / n for j, name in enumerate(FEATURE_NAMES)}
+    report['sentences'] = sum(a.n_sentences != b.n_sentences for a, b in zip(reference, candidate)) / n
+    report['words'] = sum(a.words != b.words for a, b in zip(reference, candidate)) / n
+    report['any'] = float(differs.any(axis=1).sum()) / n
+    report['nltk_seconds'] = reference_seconds
+    report['regex_seconds'] = candidate_seconds
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description='Regex tokenizer conformance check')
+    parser.add_argument('--tweets', type=str, default='../../data/tweepfake.csv',
+                       help='Cleaned TweepFake CSV')
+    parser.add_argument('--n', type=int, default=None,
+                       help='Only check the first n tweets')
+    parser.add_argument('--max-rate', type=float, default=0.01,
+                       help='Largest allowed fraction of tweets with a differing feature')
+    args = parser.parse_args()
+
+    download_nltk_resources('nltk')
+    stopwords_set = set(stopwords.words('english'))
+
+    texts = pd.read_csv(args.tweets, sep=';')['text'].dropna().tolist()[:args.n]
+    report = compare(texts, stopwords_set)
+
+    print(f"\nMismatch rates over {len(texts)} tweets:")
+    for name in FEATURE_NAMES + ['sentences', 'words', 'any']:
+        print(f"  {name:<10} {report[name]:>8.4%}")
+
+    speedup = report['nltk_seconds'] / max(report['regex_seconds'], 1e-9)
+    print(f"\nTokenization: nltk {report['nltk_seconds']:.2f}s, "
+          f"regex {report['regex_seconds']:.2f}s ({speedup:.1f}x faster)")
+
+    worst = max(report[name] for name in FEATURE_NAMES)
+    sys.exit(1 if worst > args.max_rate else 0)
+
+if __name__ == "__main__": main()
@@ -0,0 +1,69 @@
+'''
+Resident memory of the current process.
+
+Reads the current and peak resident set size. On Linux the peak can be reset,
+so that the peak of one stage of a run can be measured on its own; elsewhere
+the peak is the peak of the whole process so far.
+
+:author: Jacob Anderson
+:version: 0.1.0
+'''
+
+import sys
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def _status_mb(field: str) -> float:
+    '''
+    Reads a memory field of /proc/self/status in megabytes, None if unavailable.
+    '''
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def current_rss_mb() -> float:
+    '''
+    Reads the current resident set size.
+
+    :returns: Current resident set size in megabytes, None if unavailable
+    :rtype: float
+    '''
+    return _status_mb('VmRSS')
+
+def peak_rss_mb() -> float:
+    '''
+    Reads the peak resident set size.
+
+    :returns: Peak resident set size in megabytes since the process started or
+        the last reset_peak_rss, None if unavailable
+    :rtype: float
+    '''
+    peak = _status_mb('VmHWM')
+    if peak is not None or resource is None:
+        return peak
+
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / 1024 ** 2 if sys.platform == 'darwin' else max_rss / 1024
+
+def reset_peak_rss() -> bool:
+    '''
+    Resets the peak resident set size to the current one (Linux only).
+
+    :returns: Whether the peak was reset
+    :rtype: bool
+    '''
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except OSError:
+        return False
@@ -0,0 +1,188 @@
+'''
+Model registry for fitted classifiers and their preprocessing.
+
+Artifacts are stored with joblib under a key that is a content hash of
+everything that determines them: the training data and the hyperparameters.
+They are also keyed by the scikit-learn version, because pickles do not carry
+across versions. Asking for an artifact whose inputs have not changed reloads it
+from disk instead of refitting. Named tags point at keys, so scripts can find the
+latest model for a task without knowing its hash.
+
+:author: Jacob Anderson
+:version: 0.1.0
+'''
+
+import json
+import os
+from typing import Callable, NamedTuple
+import joblib
+import numpy as np
+import sklearn
+from csds413_term_project.instrumentation import span
+
+TAGS_FILE = 'tags.json'
+
+def params_fingerprint(estimator) -> tuple:
+    '''
+    Describes an estimator by its class and hyperparameters, ignoring any fitted
+    state.
+
+    :param estimator: scikit-learn estimator or transformer
+    :returns: Tuple class name, parameters
+    :rtype: tuple
+    '''
+    return type(estimator).__qualname__, estimator.get_params(deep=True)
+
+def content_hash(*parts) -> str:
+    '''
+    Hashes arrays, estimator fingerprints and plain values into a registry key.
+
+    :param parts: Objects the artifact depends on
+    :returns: Hex digest
+    :rtype: str
+    '''
+    return joblib.hash((sklearn.__version__,) + parts)
+
+class ModelBundle(NamedTuple):
+    '''
+    A fitted classifier together with the preprocessing it expects. Raw features
+    are standardized by the scaler, optionally expanded by the polynomial
+    transformer, and narrowed to the selected columns before prediction.
+    '''
+    estimator: object
+    scaler: object
+    poly: object = None
+    selected_indices: list = None
+    feature_names: list = None
+
+    def transform(self, X: np.ndarray) -> np.ndarray:
+        '''
+        Applies the preprocessing to raw feature rows.
+
+        :param X: Raw features, one row per tweet
+        :type X: np.ndarray
+        :returns: Features as the estimator was trained on them
+        :rtype: np.ndarray
+        '''
+        X = self.scaler.transform(X)
+        if self.poly is not None:
+            X = self.poly.transform(X)
+        if self.selected_indices is not None:
+            X = X[:, self.selected_indices]
+        return X
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        '''
+        Predicts labels for raw feature rows.
+
+        :param X: Raw features, one row per tweet
+        :type X: np.ndarray
+        :returns: Predicted labels
+        :rtype: np.ndarray
+        '''
+        return self.estimator.predict(self.transform(X))
+
+class ModelRegistry:
+    '''
+    Directory of joblib artifacts addressed by content hash, plus named tags.
+    '''
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, f'{key}.joblib')
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def load(self, key: str):
+        '''
+        Loads the artifact stored under a key.
+
+        :param key: Registry key
+        :type key: str
+        :returns: Stored artifact
+        '''
+        return joblib.load(self.path(key))
+
+    def save(self, key: str, artifact):
+        '''
+        Stores an artifact under a key. The file is written under a temporary
+        name and moved into place, so an interrupted run never leaves a truncated
+        entry behind.
+
+        :param key: Registry key
+        :type key: str
+        :param artifact: Picklable object
+        '''
+        tmp_path = self.path(key) + '.tmp'
+        joblib.dump(artifact, tmp_path)
+        os.replace(tmp_path, self.path(key))
+
+    def get_or_create(self, key: str, create: Callable):
+        '''
+        Loads the artifact for a key, or creates and stores it on a miss.
+
+        :param key: Registry key
+        :type key: str
+        :param create: Function with no arguments building the artifact
+        :type create: Callable
+        :returns: Stored or newly created artifact
+        '''
+        if key in self:
+            return self.load(key)
+
+        artifact = create()
+        self.save(key, artifact)
+        return artifact
+
+    def _read_tags(self) -> dict:
+        tags_path = os.path.join(self.root, TAGS_FILE)
+        if not os.path.exists(tags_path):
+            return {}
+        with open(tags_path) as tags_file:
+            return json.load(tags_file)
+
+    def tag(self, name: str, key: str):
+        '''
+        Points a name at a stored key.
+
+        :param name: Tag name, e.g. the script the model belongs to
+        :type name: str
+        :param key: Registry key
+        :type key: str
+        '''
+        tags = self._read_tags()
+        tags[name] = key
+        with open(os.path.join(self.root, TAGS_FILE), 'w') as tags_file:
+            json.dump(tags, tags_file, indent=2)
+
+    def load_tagged(self, name: str):
+        '''
+        Loads the artifact a tag points at.
+
+        :param name: Tag name
+        :type name: str
+        :returns: Stored artifact
+        '''
+        return self.load(self._read_tags()[name])
+
+def fit_transformer(registry: ModelRegistry, transformer, X: np.ndarray):
+    '''
+    Fits a preprocessing transformer, or reloads it if one with the same
+    parameters was already fit on the same data.
+
+    :param registry: Model registry, no caching if None
+    :type registry: ModelRegistry
+    :param transformer: Unfitted scikit-learn transformer
+    :param X: Data to fit on
+    :type X: np.ndarray
+    :returns: Fitted transformer
+    '''
+    with span(f'preprocess.{type(transformer).__name__}', rows=len(X)):
+        if registry is None:
+            return transformer.fit(X)
+
+        key = content_hash(params_fingerprint(transformer), X)
+        return registry.get_or_create(key, lambda: transformer.fit(X))
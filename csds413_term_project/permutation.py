@@ -0,0 +1,301 @@
+'''
+Shared permutation runner for the permutation tests.
+
+Splits a test into fixed-size chunks of permutations and runs them on a pool
+of worker processes. Every chunk draws from its own generator spawned from one
+SeedSequence, so the null distribution depends only on the seed and the chunk
+size and is identical for any number of workers. The sequential mode stops as
+soon as the p-value is decided relative to a significance level.
+
+:author: Jacob Anderson
+:version: 0.1.0
+'''
+
+import warnings
+from contextlib import closing
+from typing import Callable, Iterator
+import numpy as np
+from joblib import Parallel, delayed
+from scipy import stats
+from csds413_term_project import instrumentation
+from csds413_term_project.instrumentation import span
+
+def plan_chunks(n_permutations: int, chunk_size: int, seed: int = None) -> list:
+    '''
+    Splits the permutations into chunks and gives each chunk its own seed.
+
+    :param n_permutations: Total number of permutations
+    :type n_permutations: int
+    :param chunk_size: Number of permutations per chunk
+    :type chunk_size: int
+    :param seed: Root seed for the SeedSequence
+    :type seed: int
+    :returns: List of (start, size, seed sequence) tuples
+    :rtype: list
+    '''
+    starts = range(0, n_permutations, chunk_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(starts))
+
+    return [(start, min(chunk_size, n_permutations - start), seed_seq)
+            for start, seed_seq in zip(starts, seeds)]
+
+def _run_chunk(statistic: Callable, start: int, size: int,
+               seed_seq: np.random.SeedSequence) -> tuple:
+    '''
+    Runs a single chunk of permutations.
+
+    :param statistic: Function mapping (n, rng) to n null statistics
+    :type statistic: Callable
+    :param start: Index of the first permutation in the chunk
+    :type start: int
+    :param size: Number of permutations in the chunk
+    :type size: int
+    :param seed_seq: Seed sequence for the chunk generator
+    :type seed_seq: np.random.SeedSequence
+    :returns: Tuple start index, null statistics
+    :rtype: tuple
+    '''
+    with span('permutations.chunk', rows=size, start=start):
+        return start, np.asarray(statistic(size, np.random.default_rng(seed_seq)))
+
+def iter_permutation_chunks(statistic: Callable, n_permutations: int,
+                            seed: int = None, n_workers: int = None,
+                            chunk_size: int = 100) -> Iterator[tuple]:
+    '''
+    Runs the permutations and yields each chunk as soon as it finishes, so callers
+    can inspect the partial null distribution while the rest is still running.
+
+    The statistic is called as statistic(n, rng) and must return n null statistics
+    drawn with rng. It has to be picklable, e.g. a module-level function or a
+    functools.partial of one; large arrays in it are memory-mapped to the workers.
+
+    :param statistic: Function mapping (n, rng) to n null statistics
+    :type statistic: Callable
+    :param n_permutations: Total number of permutations
+    :type n_permutations: int
+    :param seed: Root seed for the SeedSequence
+    :type seed: int
+    :param n_workers: Number of worker processes, all cores if None
+    :type n_workers: int
+    :param chunk_size: Number of permutations per chunk
+    :type chunk_size: int
+    :returns: Iterator of (start index, null statistics) in completion order
+    :rtype: Iterator[tuple]
+    '''
+    chunks = plan_chunks(n_permutations, chunk_size, seed)
+
+    if n_workers == 1:
+        for start, size, seed_seq in chunks:
+            yield _run_chunk(statistic, start, size, seed_seq)
+        return
+
+    # With profiling on, the workers' spans come back with their chunks
+    run_chunk = instrumentation.in_worker(_run_chunk)
+    parallel = Parallel(n_jobs=-1 if n_workers is None else n_workers,
+                        return_as='generator_unordered')
+    for output in parallel(delayed(run_chunk)(statistic, start, size, seed_seq)
+                           for start, size, seed_seq in chunks):
+        yield instrumentation.unwrap(output)
+
+def permutation_p_value(null_distribution: np.ndarray, observed: float) -> float:
+    '''
+    Computes the permutation p-value with the +1 correction. For a statistic
+    with one value per feature, the null distribution has a column per feature
+    and one p-value per feature is returned.
+
+    :param null_distribution: Array of permuted statistics
+    :type null_distribution: np.ndarray
+    :param observed: Observed statistic
+    :type observed: float
+    :returns: p-value
+    :rtype: float
+    '''
+    return (np.sum(null_distribution >= observed, axis=0) + 1) / (len(null_distribution) + 1)
+
+def run_permutations(statistic: Callable, n_permutations: int,
+                     observed: float = None, seed: int = None,
+                     n_workers: int = None, chunk_size: int = 100,
+                     progress: Callable = None) -> np.ndarray:
+    '''
+    Runs a permutation test on the worker pool and assembles the null distribution
+    in permutation order. If a progress callback is given it is called after every
+    chunk as progress(n_done, n_permutations, interim_p_value), where the interim
+    p-value is None unless the observed statistic is known.
+
+    The statistic may also return an array of shape (n, k), e.g. one statistic
+    per feature. The null distribution then has shape (n_permutations, k), and
+    observed and the interim p-values have one entry per column.
+
+    :param statistic: Function mapping (n, rng) to n null statistics
+    :type statistic: Callable
+    :param n_permutations: Total number of permutations
+    :type n_permutations: int
+    :param observed: Observed statistic used for interim p-values
+    :type observed: float
+    :param seed: Root seed for the SeedSequence
+    :type seed: int
+    :param n_workers: Number of worker processes, all cores if None
+    :type n_workers: int
+    :param chunk_size: Number of permutations per chunk
+    :type chunk_size: int
+    :param progress: Callback receiving progress after every chunk
+    :type progress: Callable
+    :returns: Null distribution
+    :rtype: np.ndarray
+    '''
+    null_distribution = None
+    n_done = 0
+    n_extreme = 0
+
+    with span('permutations', rows=n_permutations):
+        for start, values in iter_permutation_chunks(statistic, n_permutations, seed,
+                                                     n_workers, chunk_size):
+            # Sized by the first chunk, which tells whether the statistic is a vector
+            if null_distribution is None:
+                null_distribution = np.zeros((n_permutations,) + values.shape[1:])
+            null_distribution[start:start + len(values)] = values
+            n_done += len(values)
+
+            interim_p_value = None
+            if observed is not None:
+                n_extreme += np.sum(values >= observed, axis=0)
+                interim_p_value = (n_extreme + 1) / (n_done + 1)
+
+            if progress is not None:
+                progress(n_done, n_permutations, interim_p_value)
+
+    return np.zeros(0) if null_distribution is None else null_distribution
+
+def clopper_pearson_interval(n_extreme: int, n: int, error_rate: float) -> tuple:
+    '''
+    Computes the exact binomial confidence interval for the permutation p-value.
+
+    :param n_extreme: Number of permuted statistics at least as large as observed
+    :type n_extreme: int
+    :param n: Number of permutations run
+    :type n: int
+    :param error_rate: Probability that the interval misses the true p-value
+    :type error_rate: float
+    :returns: Tuple lower bound, upper bound
+    :rtype: tuple
+    '''
+    lower = stats.beta.ppf(error_rate / 2, n_extreme, n - n_extreme + 1) if n_extreme > 0 else 0.0
+    upper = stats.beta.ppf(1 - error_rate / 2, n_extreme + 1, n - n_extreme) if n_extreme < n else 1.0
+
+    return lower, upper
+
+def run_sequential_permutations(statistic: Callable, observed: float,
+                                max_permutations: int, alpha: float = 0.05,
+                                error_rate: float = 0.001, seed: int = None,
+                                n_workers: int = None, chunk_size: int = 100,
+                                look_every: int = 500, progress: Callable = None) -> tuple:
+    '''
+    Runs a permutation test that stops early once the p-value is decided relative
+    to alpha. After every look_every permutations the Clopper-Pearson interval for
+    the p-value is checked, and the test stops when the interval lies entirely
+    above or below alpha. The interval level is Bonferroni-split over all possible
+    looks, so the probability of stopping on the wrong side of alpha is at most
+    error_rate.
+
+    The looks do not depend on the chunk size: a chunk spanning several looks is
+    checked at each of them. Chunks are checked in permutation order, so the
+    stopping point is the same for any number of workers. Chunks no larger than
+    look_every keep the permutations drawn past the stopping point few.
+
+    :param statistic: Function mapping (n, rng) to n null statistics
+    :type statistic: Callable
+    :param observed: Observed statistic
+    :type observed: float
+    :param max_permutations: Number of permutations run if the test never stops
+    :type max_permutations: int
+    :param alpha: Significance level the p-value is compared against
+    :type alpha: float
+    :param error_rate: Bound on the probability of a wrong early decision
+    :type error_rate: float
+    :param seed: Root seed for the SeedSequence
+    :type seed: int
+    :param n_workers: Number of worker processes, all cores if None
+    :type n_workers: int
+    :param chunk_size: Number of permutations per chunk
+    :type chunk_size: int
+    :param look_every: Number of permutations between looks
+    :type look_every: int
+    :param progress: Callback receiving progress after every chunk and look
+    :type progress: Callable
+    :returns: Tuple null distribution actually drawn, p-value, permutations used
+    :rtype: tuple
+    '''
+    n_looks = -(-max_permutations // look_every)
+    look_error_rate = error_rate / n_looks
+
+    null_distribution = np.zeros(max_permutations)
+    pending = {}
+    n_done = 0
+    n_extreme = 0
+    decided = False
+
+    chunks = iter_permutation_chunks(statistic, max_permutations, seed,
+                                     n_workers, chunk_size)
+
+    # Stopping early cancels the chunks still queued on the pool, which is expected
+    with warnings.catch_warnings(), closing(chunks), span('permutations') as record:
+        warnings.filterwarnings('ignore', message='.*tasks which were still being processed')
+
+        for start, values in chunks:
+            pending[start] = values
+
+            while n_done in pending and not decided:
+                values = pending.pop(n_done)
+                chunk_start = n_done
+                chunk_stop = n_done + len(values)
+
+                # Split the chunk at the looks it spans
+                while n_done < chunk_stop and not decided:
+                    stop = min(chunk_stop, (n_done // look_every + 1) * look_every)
+                    segment = values[n_done - chunk_start:stop - chunk_start]
+                    null_distribution[n_done:stop] = segment
+                    n_done = stop
+                    n_extreme += np.sum(segment >= observed)
+
+                    if progress is not None:
+                        progress(n_done, max_permutations, (n_extreme + 1) / (n_done + 1))
+
+                    if n_done % look_every == 0 or n_done == max_permutations:
+                        lower, upper = clopper_pearson_interval(n_extreme, n_done,
+                                                                look_error_rate)
+                        decided = upper < alpha or lower > alpha
+
+            if decided:
+                break
+
+        record.rows = n_done
+
+    p_value = (n_extreme + 1) / (n_done + 1)
+
+    return null_distribution[:n_done], p_value, n_done
+
+def make_progress_printer(every: int = None) -> Callable:
+    '''
+    Builds a progress callback that prints each time another `every` permutations
+    have completed, or after every chunk if every is None.
+
+    :param every: Number of permutations between printed lines
+    :type every: int
+    :returns: Progress callback for run_permutations
+    :rtype: Callable
+    '''
+    last_printed = [0]
+
+    def print_progress(n_done: int, n_total: int, p_value: float):
+        if every is not None and n_done // every == last_printed[0] // every and n_done < n_total:
+            return
+        last_printed[0] = n_done
+
+        line = f"  Completed {n_done}/{n_total} permutations"
+        if p_value is not None and np.ndim(p_value) > 0:
+            line += f" (interim p-values: {', '.join(f'{p:.4f}' for p in p_value)})"
+        elif p_value is not None:
+            line += f" (interim p-value: {p_value:.4f})"
+        print(line)
+
+    return print_progress
@@ -0,0 +1,532 @@
+'''
+Chunk-mergeable streaming summaries of the feature table.
+
+Every summary here can be built from a chunk of rows and merged with the
+summary of any other disjoint chunk, so one pass of scan_features gives the
+same result read in one piece, in chunks or in parallel row ranges:
+
+- FeatureSummary keeps per-group moments (through GroupStatistics), minima,
+  maxima and a QuantileSketch of every feature.
+- QuantileSketch is a relative-error quantile sketch in the manner of DDSketch:
+  values fall into logarithmically spaced buckets, so any quantile estimate is
+  within a fraction relative_accuracy of a true sample quantile.
+- GroupedHistograms counts every group and feature over fixed bin edges, e.g.
+  edges spanning the minima and maxima of a first pass.
+- BoxWhiskers finds the box plot whiskers for fences taken from the sketched
+  quartiles, and keeps a bounded sample of the outliers beyond them.
+
+Memory depends on the number of features, bins and buckets, not on the number
+of rows.
+
+:author: Jacob Anderson
+:version: 0.1.0
+'''
+
+from functools import partial
+import numpy as np
+import pandas as pd
+from csds413_term_project.feature_store import scan_features
+from csds413_term_project.sufficient_stats import GROUPS, GroupStatistics, group_codes
+
+# Magnitudes below this fall into the zero bucket of a QuantileSketch
+MIN_INDEXABLE = 1e-9
+
+class _Buckets:
+    '''
+    Dense counts of consecutive bucket indices, starting at offset.
+    '''
+    def __init__(self):
+        self.offset = 0
+        self.counts = np.zeros(0, dtype=np.int64)
+
+    def _extend(self, low: int, high: int):
+        '''
+        Grows the counts to cover the indices low to high.
+        '''
+        if len(self.counts) == 0:
+            self.offset = low
+            self.counts = np.zeros(high - low + 1, dtype=np.int64)
+            return
+
+        new_low = min(low, self.offset)
+        new_high = max(high, self.offset + len(self.counts) - 1)
+        if new_low == self.offset and new_high == self.offset + len(self.counts) - 1:
+            return
+
+        counts = np.zeros(new_high - new_low + 1, dtype=np.int64)
+        counts[self.offset - new_low:self.offset - new_low + len(self.counts)] = self.counts
+        self.offset = new_low
+        self.counts = counts
+
+    def add(self, indices: np.ndarray):
+        if len(indices) == 0:
+            return
+        low, high = int(indices.min()), int(indices.max())
+        self._extend(low, high)
+        self.counts[low - self.offset:high - self.offset + 1] += np.bincount(indices - low)
+
+    def merge(self, other: '_Buckets'):
+        if len(other.counts) == 0:
+            return
+        self._extend(other.offset, other.offset + len(other.counts) - 1)
+        start = other.offset - self.offset
+        self.counts[start:start + len(other.counts)] += other.counts
+
+    @property
+    def indices(self) -> np.ndarray:
+        return np.arange(self.offset, self.offset + len(self.counts))
+
+class QuantileSketch:
+    '''
+    Mergeable quantile sketch with relative accuracy. A value x > 0 falls into
+    bucket i = ceil(log(x) / log(gamma)) with gamma = (1 + a) / (1 - a), whose
+    representative value 2 gamma^i / (gamma + 1) is within a relative error a
+    of every value in the bucket. Negative values are bucketed by magnitude,
+    and magnitudes below MIN_INDEXABLE are counted as zero. The exact minimum
+    and maximum are kept as well.
+    '''
+    def __init__(self, relative_accuracy: float = 0.005):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError(f"relative_accuracy must be in (0, 1), got {relative_accuracy}")
+
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.positive = _Buckets()
+        self.negative = _Buckets()
+        self.zero_count = 0
+        self.min = np.inf
+        self.max = -np.inf
+
+    @property
+    def count(self) -> int:
+        return int(self.positive.counts.sum() + self.negative.counts.sum() + self.zero_count)
+
+    def _index(self, magnitudes: np.ndarray) -> np.ndarray:
+        return np.ceil(np.log(magnitudes) / np.log(self.gamma)).astype(np.int64)
+
+    def _value(self, indices: np.ndarray) -> np.ndarray:
+        return 2 * self.gamma ** indices / (self.gamma + 1)
+
+    def update(self, values: np.ndarray):
+        '''
+        Adds values to the sketch. NaNs are ignored.
+
+        :param values: Values to add
+        :type values: np.ndarray
+        '''
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+        positive = values[values >= MIN_INDEXABLE]
+        negative = -values[values <= -MIN_INDEXABLE]
+        self.positive.add(self._index(positive))
+        self.negative.add(self._index(negative))
+        self.zero_count += len(values) - len(positive) - len(negative)
+
+    def merge(self, other: 'QuantileSketch') -> 'QuantileSketch':
+        '''
+        Adds the values of another sketch with the same relative accuracy.
+
+        :param other: Sketch to merge in
+        :type other: QuantileSketch
+        :returns: This sketch
+        :rtype: QuantileSketch
+        '''
+        if other.gamma != self.gamma:
+            raise ValueError("cannot merge sketches with different relative accuracies")
+
+        self.positive.merge(other.positive)
+        self.negative.merge(other.negative)
+        self.zero_count += other.zero_count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def quantile(self, q) -> np.ndarray:
+        '''
+        Estimates quantiles as the value of rank q (n - 1), like np.quantile
+        with method='lower', up to the relative accuracy of the sketch.
+
+        :param q: Quantile or array of quantiles in [0, 1]
+        :returns: Estimated quantiles, NaN for an empty sketch
+        :rtype: np.ndarray
+        '''
+        q = np.asarray(q, dtype=float)
+        if self.count == 0:
+            return np.full(q.shape, np.nan)
+
+        # Buckets in increasing order of value: negatives by decreasing magnitude
+        values = np.concatenate([-self._value(self.negative.indices)[::-1], [0.0],
+                                 self._value(self.positive.indices)])
+        counts = np.concatenate([self.negative.counts[::-1], [self.zero_count],
+                                 self.positive.counts])
+        ranks = np.floor(q * (self.count - 1))
+        estimates = values[np.searchsorted(np.cumsum(counts), ranks, side='right')]
+        return np.clip(estimates, self.min, self.max)
+
+class FeatureSummary:
+    '''
+    Per-group moments, minima, maxima and quantile sketches of every feature.
+    '''
+    def __init__(self, n_features: int, n_groups: int = 2, relative_accuracy: float = 0.005):
+        self.statistics = GroupStatistics(n_features, n_groups)
+        self.minima = np.full((n_groups, n_features), np.inf)
+        self.maxima = np.full((n_groups, n_features), -np.inf)
+        self.sketches = [[QuantileSketch(relative_accuracy) for _ in range(n_features)]
+                         for _ in range(n_groups)]
+
+    @property
+    def n_features(self) -> int:
+        return self.statistics.n_features
+
+    @property
+    def n_groups(self) -> int:
+        return self.statistics.n_groups
+
+    @property
+    def counts(self) -> np.ndarray:
+        return self.statistics.counts
+
+    @property
+    def means(self) -> np.ndarray:
+        return self.statistics.means
+
+    @property
+    def variances(self) -> np.ndarray:
+        '''
+        Sample variances of shape (n_groups, n_features).
+        '''
+        return (np.diagonal(self.statistics.cross_products, axis1=1, axis2=2)
+                / (self.counts[:, None] - 1))
+
+    def covariance(self, group: int) -> np.ndarray:
+        return self.statistics.covariance(group)
+
+    def update(self, X: np.ndarray, codes: np.ndarray):
+        '''
+        Adds a chunk of rows.
+
+        :param X: Chunk of the feature matrix
+        :type X: np.ndarray
+        :param codes: Group index of every row of the chunk, negative to skip
+        :type codes: np.ndarray
+        '''
+        X = np.asarray(X, dtype=float)
+        codes = np.asarray(codes)
+        self.statistics.update(X, codes)
+
+        for group in range(self.n_groups):
+            rows = X[codes == group]
+            if len(rows) == 0:
+                continue
+
+            self.minima[group] = np.minimum(self.minima[group], rows.min(axis=0))
+            self.maxima[group] = np.maximum(self.maxima[group], rows.max(axis=0))
+            for j, sketch in enumerate(self.sketches[group]):
+                sketch.update(rows[:, j])
+
+    def merge(self, other: 'FeatureSummary') -> 'FeatureSummary':
+        '''
+        Adds the summary of a disjoint set of rows.
+
+        :param other: Summary to merge in
+        :type other: FeatureSummary
+        :returns: This summary
+        :rtype: FeatureSummary
+        '''
+        self.statistics.merge(other.statistics)
+        self.minima = np.minimum(self.minima, other.minima)
+        self.maxima = np.maximum(self.maxima, other.maxima)
+        for sketches, other_sketches in zip(self.sketches, other.sketches):
+            for sketch, other_sketch in zip(sketches, other_sketches):
+                sketch.merge(other_sketch)
+        return self
+
+    def quantiles(self, q) -> np.ndarray:
+        '''
+        Estimates quantiles of every group and feature.
+
+        :param q: Array of quantiles in [0, 1]
+        :returns: Array of shape (n_groups, n_features, len(q))
+        :rtype: np.ndarray
+        '''
+        return np.array([[sketch.quantile(np.atleast_1d(q)) for sketch in sketches]
+                         for sketches in self.sketches])
+
+class GroupedHistograms:
+    '''
+    Histogram counts of every group and feature over fixed bin edges. As in
+    np.histogram, bins are half-open except the last, and values outside the
+    edges are not counted.
+    '''
+    def __init__(self, edges: np.ndarray):
+        self.edges = np.asarray(edges, dtype=float)
+        self.counts = np.zeros(self.edges.shape[:-1] + (self.edges.shape[-1] - 1,),
+                               dtype=np.int64)
+
+    def update(self, X: np.ndarray, codes: np.ndarray):
+        '''
+        Adds a chunk of rows.
+
+        :param X: Chunk of the feature matrix
+        :type X: np.ndarray
+        :param codes: Group index of every row of the chunk, negative to skip
+        :type codes: np.ndarray
+        '''
+        X = np.asarray(X, dtype=float)
+        codes = np.asarray(codes)
+        for group in range(self.counts.shape[0]):
+            rows = X[codes == group]
+            for j in range(self.counts.shape[1]):
+                self.counts[group, j] += np.histogram(rows[:, j], self.edges[group, j])[0]
+
+    def merge(self, other: 'GroupedHistograms') -> 'GroupedHistograms':
+        self.counts += other.counts
+        return self
+
+    def densities(self) -> np.ndarray:
+        '''
+        Counts normalized so every histogram integrates to one, like
+        density=True in np.histogram.
+
+        :returns: Densities with the shape of counts
+        :rtype: np.ndarray
+        '''
+        totals = self.counts.sum(axis=-1, keepdims=True)
+        return self.counts / (totals * np.diff(self.edges, axis=-1))
+
+def _sample_keys(values: np.ndarray) -> np.ndarray:
+    '''
+    Pseudo-random keys derived from the bits of the values (splitmix64), so a
+    bottom-k sample by key does not depend on how the rows were chunked.
+    '''
+    keys = np.ascontiguousarray(values, dtype=float).view(np.uint64)
+    keys = keys + np.uint64(0x9E3779B97F4A7C15)
+    keys = (keys ^ (keys >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    keys = (keys ^ (keys >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return keys ^ (keys >> np.uint64(31))
+
+class BoxWhiskers:
+    '''
+    Box plot whiskers of every group and feature for given fences: the lower
+    whisker is the smallest value at or above the lower fence, the upper one
+    the largest value at or below the upper fence, as in matplotlib's boxplot.
+    Values beyond the whiskers are outliers; up to max_outliers of them are
+    kept per group and feature, chosen by smallest key.
+    '''
+    def __init__(self, lower_fences: np.ndarray, upper_fences: np.ndarray,
+                 max_outliers: int = 1000):
+        self.lower_fences = np.asarray(lower_fences, dtype=float)
+        self.upper_fences = np.asarray(upper_fences, dtype=float)
+        self.max_outliers = max_outliers
+        self.lower = np.full(self.lower_fences.shape, np.inf)
+        self.upper = np.full(self.upper_fences.shape, -np.inf)
+        self.outlier_counts = np.zeros(self.lower_fences.shape, dtype=np.int64)
+        self.outliers = [[np.zeros(0) for _ in range(self.lower.shape[1])]
+                         for _ in range(self.lower.shape[0])]
+
+    def _keep(self, values: np.ndarray) -> np.ndarray:
+        '''
+        Keeps the max_outliers values with the smallest keys.
+        '''
+        if len(values) <= self.max_outliers:
+            return values
+        keys = _sample_keys(values)
+        return values[np.argpartition(keys, self.max_outliers)[:self.max_outliers]]
+
+    def update(self, X: np.ndarray, codes: np.ndarray):
+        '''
+        Adds a chunk of rows.
+
+        :param X: Chunk of the feature matrix
+        :type X: np.ndarray
+        :param codes: Group index of every row of the chunk, negative to skip
+        :type codes: np.ndarray
+        '''
+        X = np.asarray(X, dtype=float)
+        codes = np.asarray(codes)
+        for group in range(self.lower.shape[0]):
+            rows = X[codes == group]
+            for j in range(self.lower.shape[1]):
+                column = rows[:, j]
+                inside = (column >= self.lower_fences[group, j]) & (
+                    column <= self.upper_fences[group, j])
+                if inside.any():
+                    self.lower[group, j] = min(self.lower[group, j], column[inside].min())
+                    self.upper[group, j] = max(self.upper[group, j], column[inside].max())
+
+                outliers = column[~inside]
+                self.outlier_counts[group, j] += len(outliers)
+                self.outliers[group][j] = self._keep(
+                    np.concatenate([self.outliers[group][j], outliers]))
+
+    def merge(self, other: 'BoxWhiskers') -> 'BoxWhiskers':
+        self.lower = np.minimum(self.lower, other.lower)
+        self.upper = np.maximum(self.upper, other.upper)
+        self.outlier_counts += other.outlier_counts
+        for group, row in enumerate(other.outliers):
+            for j, outliers in enumerate(row):
+                self.outliers[group][j] = self._keep(
+                    np.concatenate([self.outliers[group][j], outliers]))
+        return self
+
+def _frame_arrays(features_df: pd.DataFrame, feature_cols: list, label_col: str,
+                  groups: tuple) -> tuple:
+    return (features_df[feature_cols].to_numpy(dtype=float),
+            group_codes(features_df[label_col], groups))
+
+def _summarize_frame(features_df: pd.DataFrame, feature_cols: list, label_col: str,
+                     groups: tuple, relative_accuracy: float) -> FeatureSummary:
+    summary = FeatureSummary(len(feature_cols), len(groups), relative_accuracy)
+    summary.update(*_frame_arrays(features_df, feature_cols, label_col, groups))
+    return summary
+
+def _histogram_frame(features_df: pd.DataFrame, feature_cols: list, label_col: str,
+                     groups: tuple, edges: np.ndarray) -> GroupedHistograms:
+    histograms = GroupedHistograms(edges)
+    histograms.update(*_frame_arrays(features_df, feature_cols, label_col, groups))
+    return histograms
+
+def _whiskers_frame(features_df: pd.DataFrame, feature_cols: list, label_col: str,
+                    groups: tuple, lower_fences: np.ndarray, upper_fences: np.ndarray,
+                    max_outliers: int) -> BoxWhiskers:
+    whiskers = BoxWhiskers(lower_fences, upper_fences, max_outliers)
+    whiskers.update(*_frame_arrays(features_df, feature_cols, label_col, groups))
+    return whiskers
+
+def summarize_features(csv_path: str, feature_cols: list, label_col: str = 'label',
+                       groups: tuple = GROUPS, relative_accuracy: float = 0.005,
+                       chunk_size: int = 100000, n_workers: int = 1) -> FeatureSummary:
+    '''
+    Summarizes every group and feature of a features CSV in one pass.
+
+    :param csv_path: Path to the features CSV
+    :type csv_path: str
+    :param feature_cols: Feature columns
+    :type feature_cols: list
+    :param label_col: Label column
+    :type label_col: str
+    :param groups: Labels of the groups, in order
+    :type groups: tuple
+    :param relative_accuracy: Relative accuracy of the quantile sketches
+    :type relative_accuracy: float
+    :param chunk_size: Number of rows per chunk
+    :type chunk_size: int
+    :param n_workers: Number of worker processes, all cores if None
+    :type n_workers: int
+    :returns: Summary of all rows
+    :rtype: FeatureSummary
+    '''
+    summarize = partial(_summarize_frame, feature_cols=feature_cols, label_col=label_col,
+                        groups=groups, relative_accuracy=relative_accuracy)
+    summary = scan_features(csv_path, [label_col] + feature_cols, summarize, chunk_size,
+                            n_workers)
+    if summary is None:
+        return FeatureSummary(len(feature_cols), len(groups), relative_accuracy)
+    return summary
+
+def feature_histograms(csv_path: str, feature_cols: list, edges: np.ndarray,
+                       label_col: str = 'label', groups: tuple = GROUPS,
+                       chunk_size: int = 100000, n_workers: int = 1) -> GroupedHistograms:
+    '''
+    Counts histograms of every group and feature of a features CSV in one pass.
+
+    :param csv_path: Path to the features CSV
+    :type csv_path: str
+    :param feature_cols: Feature columns
+    :type feature_cols: list
+    :param edges: Bin edges of shape (n_groups, n_features, n_bins + 1)
+    :type edges: np.ndarray
+    :param label_col: Label column
+    :type label_col: str
+    :param groups: Labels of the groups, in order
+    :type groups: tuple
+    :param chunk_size: Number of rows per chunk
+    :type chunk_size: int
+    :param n_workers: Number of worker processes, all cores if None
+    :type n_workers: int
+    :returns: Histogram counts
+    :rtype: GroupedHistograms
+    '''
+    count = partial(_histogram_frame, feature_cols=feature_cols, label_col=label_col,
+                    groups=groups, edges=edges)
+    histograms = scan_features(csv_path, [label_col] + feature_cols, count, chunk_size,
+                               n_workers)
+    return GroupedHistograms(edges) if histograms is None else histograms
+
+def range_edges(summary: FeatureSummary, n_bins: int) -> np.ndarray:
+    '''
+    Equal-width bin edges from the minimum to the maximum of every group and
+    feature, the bins plt.hist uses for an integer bin count.
+
+    :param summary: Summary with the minima and maxima
+    :type summary: FeatureSummary
+    :param n_bins: Number of bins
+    :type n_bins: int
+    :returns: Edges of shape (n_groups, n_features, n_bins + 1)
+    :rtype: np.ndarray
+    '''
+    edges = np.empty(summary.minima.shape + (n_bins + 1,))
+    for index in np.ndindex(summary.minima.shape):
+        low, high = summary.minima[index], summary.maxima[index]
+        if not np.isfinite(low):
+            low, high = 0.0, 1.0
+        edges[index] = np.histogram_bin_edges([low, high], bins=n_bins)
+    return edges
+
+def box_statistics(csv_path: str, feature_cols: list, summary: FeatureSummary,
+                   label_col: str = 'label', groups: tuple = GROUPS, whis: float = 1.5,
+                   max_outliers: int = 1000, chunk_size: int = 100000,
+                   n_workers: int = 1) -> list:
+    '''
+    Computes box plot statistics of every group and feature. The quartiles and
+    median come from the sketches of the summary; a second pass over the CSV
+    finds the whiskers at whis times the interquartile range and samples the
+    outliers.
+
+    :param csv_path: Path to the features CSV
+    :type csv_path: str
+    :param feature_cols: Feature columns
+    :type feature_cols: list
+    :param summary: Summary of the same rows
+    :type summary: FeatureSummary
+    :param label_col: Label column
+    :type label_col: str
+    :param groups: Labels of the groups, in order
+    :type groups: tuple
+    :param whis: Whisker reach in interquartile ranges
+    :type whis: float
+    :param max_outliers: Outliers kept per group and feature
+    :type max_outliers: int
+    :param chunk_size: Number of rows per chunk
+    :type chunk_size: int
+    :param n_workers: Number of worker processes, all cores if None
+    :type n_workers: int
+    :returns: Nested list [group][feature] of dicts for matplotlib's Axes.bxp
+    :rtype: list
+    '''
+    q1, median, q3 = np.moveaxis(summary.quantiles([0.25, 0.5, 0.75]), -1, 0)
+    iqr = q3 - q1
+
+    find = partial(_whiskers_frame, feature_cols=feature_cols, label_col=label_col,
+                   groups=groups, lower_fences=q1 - whis * iqr, upper_fences=q3 + whis * iqr,
+                   max_outliers=max_outliers)
+    whiskers = scan_features(csv_path, [label_col] + feature_cols, find, chunk_size, n_workers)
+    if whiskers is None:
+        whiskers = BoxWhiskers(q1 - whis * iqr, q3 + whis * iqr, max_outliers)
+
+    return [[{
+        'label': feature,
+        'med': median[group, j],
+        'q1': q1[group, j],
+        'q3': q3[group, j],
+        'whislo': whiskers.lower[group, j],
+        'whishi': whiskers.upper[group, j],
+        'fliers': whiskers.outliers[group][j],
+        'mean': summary.means[group, j]
+    } for j, feature in enumerate(feature_cols)] for group in range(len(groups))]
@@ -0,0 +1,351 @@
+'''
+Single-pass sufficient statistics for the two-group feature analyses.
+
+The Mahalanobis distance, the per-feature contributions to it and Cohen's d
+only depend on the count, the feature sums and the matrix of cross-products
+of each group. GroupStatistics accumulates these chunk by chunk, with the
+cross-products centered on the group mean so that large feature values do not
+cancel. Accumulators of disjoint chunks merge exactly, so the features can be
+read once, in chunks or in parallel row ranges, without holding the table in
+memory.
+
+Standardizing the features, restricting to a subset of them and pooling the
+group covariances are all done on the statistics, not on the data. Systems
+with the pooled covariance are solved through its Cholesky factor instead of
+an explicit inverse.
+
+:author: Jacob Anderson
+:version: 0.1.0
+'''
+
+from functools import partial
+import numpy as np
+import pandas as pd
+from scipy import linalg
+from csds413_term_project.feature_store import scan_features
+
+# Group order used by the analyses: differences are group 0 minus group 1
+GROUPS = ('human', 'bot')
+
+class GroupStatistics:
+    '''
+    Per-group counts, feature sums and centered cross-product matrices. Rows
+    are assigned to groups by integer codes; rows with a negative code, e.g.
+    an unknown label, are skipped.
+    '''
+    def __init__(self, n_features: int, n_groups: int = 2):
+        self.counts = np.zeros(n_groups)
+        self.sums = np.zeros((n_groups, n_features))
+        self.cross_products = np.zeros((n_groups, n_features, n_features))
+
+    @classmethod
+    def from_arrays(cls, X: np.ndarray, codes: np.ndarray, n_groups: int = 2) -> 'GroupStatistics':
+        '''
+        Accumulates the statistics of a feature matrix in one go.
+
+        :param X: Feature matrix of shape (n_samples, n_features)
+        :type X: np.ndarray
+        :param codes: Group index of every row
+        :type codes: np.ndarray
+        :param n_groups: Number of groups
+        :type n_groups: int
+        :returns: Statistics of the rows
+        :rtype: GroupStatistics
+        '''
+        statistics = cls(np.shape(X)[1], n_groups)
+        statistics.update(X, codes)
+        return statistics
+
+    @property
+    def n_features(self) -> int:
+        return self.sums.shape[1]
+
+    @property
+    def n_groups(self) -> int:
+        return len(self.counts)
+
+    @property
+    def means(self) -> np.ndarray:
+        return self.sums / self.counts[:, None]
+
+    def update(self, X: np.ndarray, codes: np.ndarray):
+        '''
+        Adds a chunk of rows.
+
+        :param X: Chunk of the feature matrix
+        :type X: np.ndarray
+        :param codes: Group index of every row of the chunk
+        :type codes: np.ndarray
+        '''
+        X = np.asarray(X, dtype=float)
+        codes = np.asarray(codes)
+
+        for group in range(self.n_groups):
+            rows = X[codes == group]
+            if len(rows) == 0:
+                continue
+
+            centered = rows - rows.mean(axis=0)
+            self._merge_group(group, len(rows), rows.sum(axis=0), centered.T @ centered)
+
+    def _merge_group(self, group: int, count: float, sums: np.ndarray,
+                     cross_products: np.ndarray):
+        '''
+        Merges the statistics of a disjoint set of rows into one group.
+        '''
+        if self.counts[group] > 0:
+            delta = sums / count - self.means[group]
+            cross_products = cross_products + np.outer(delta, delta) * (
+                self.counts[group] * count / (self.counts[group] + count))
+
+        self.counts[group] += count
+        self.sums[group] += sums
+        self.cross_products[group] += cross_products
+
+    def merge(self, other: 'GroupStatistics') -> 'GroupStatistics':
+        '''
+        Adds the statistics of a disjoint set of rows, e.g. from another chunk
+        or another process.
+
+        :param other: Statistics to merge in
+        :type other: GroupStatistics
+        :returns: These statistics
+        :rtype: GroupStatistics
+        '''
+        for group in range(self.n_groups):
+            if other.counts[group] > 0:
+                self._merge_group(group, other.counts[group], other.sums[group],
+                                  other.cross_products[group])
+        return self
+
+    def covariance(self, group: int) -> np.ndarray:
+        '''
+        Sample covariance matrix of one group, as np.cov gives it.
+
+        :param group: Group index
+        :type group: int
+        :returns: Covariance matrix
+        :rtype: np.ndarray
+        '''
+        return self.cross_products[group] / (self.counts[group] - 1)
+
+    def pooled_covariance(self) -> np.ndarray:
+        '''
+        Pooled within-group covariance matrix, with n - n_groups degrees of
+        freedom.
+
+        :returns: Pooled covariance matrix
+        :rtype: np.ndarray
+        '''
+        return self.cross_products.sum(axis=0) / (self.counts.sum() - self.n_groups)
+
+    def total(self) -> 'GroupStatistics':
+        '''
+        Merges all groups into one.
+
+        :returns: Single-group statistics of all rows
+        :rtype: GroupStatistics
+        '''
+        total = GroupStatistics(self.n_features, 1)
+        for group in range(self.n_groups):
+            if self.counts[group] > 0:
+                total._merge_group(0, self.counts[group], self.sums[group],
+                                   self.cross_products[group])
+        return total
+
+    def scale(self) -> tuple:
+        '''
+        Mean and standard deviation of every feature over all rows, as
+        StandardScaler computes them (population standard deviation, and 1 for
+        constant features).
+
+        :returns: Tuple mean, standard deviation
+        :rtype: tuple
+        '''
+        total = self.total()
+        std = np.sqrt(np.diag(total.cross_products[0]) / total.counts[0])
+        return total.means[0], np.where(std > 0, std, 1.0)
+
+    def standardized(self) -> 'GroupStatistics':
+        '''
+        Statistics of the rows standardized with scale, as StandardScaler would
+        transform them.
+
+        :returns: Standardized statistics
+        :rtype: GroupStatistics
+        '''
+        mean, std = self.scale()
+        standardized = GroupStatistics(self.n_features, self.n_groups)
+        standardized.counts = self.counts.copy()
+        standardized.sums = (self.sums - self.counts[:, None] * mean) / std
+        standardized.cross_products = self.cross_products / np.outer(std, std)
+        return standardized
+
+    def subset(self, features: list) -> 'GroupStatistics':
+        '''
+        Restricts the statistics to some of the features.
+
+        :param features: Indices of the features to keep
+        :type features: list
+        :returns: Statistics of the selected features
+        :rtype: GroupStatistics
+        '''
+        features = np.asarray(features)
+        subset = GroupStatistics(len(features), self.n_groups)
+        subset.counts = self.counts.copy()
+        subset.sums = self.sums[:, features]
+        subset.cross_products = self.cross_products[:, features[:, None], features]
+        return subset
+
+def group_codes(labels, groups: tuple = GROUPS) -> np.ndarray:
+    '''
+    Maps labels to group indices, -1 for labels outside the groups.
+
+    :param labels: Label of every row
+    :param groups: Labels of the groups, in order
+    :type groups: tuple
+    :returns: Group index of every row
+    :rtype: np.ndarray
+    '''
+    return np.asarray(pd.Categorical(labels, categories=list(groups)).codes)
+
+def frame_statistics(features_df: pd.DataFrame, feature_cols: list, label_col: str = 'label',
+                     groups: tuple = GROUPS) -> GroupStatistics:
+    '''
+    Accumulates the statistics of a features DataFrame.
+
+    :param features_df: DataFrame with label and feature columns
+    :type features_df: pd.DataFrame
+    :param feature_cols: Feature columns
+    :type feature_cols: list
+    :param label_col: Label column
+    :type label_col: str
+    :param groups: Labels of the groups, in order
+    :type groups: tuple
+    :returns: Statistics of the rows
+    :rtype: GroupStatistics
+    '''
+    return GroupStatistics.from_arrays(features_df[feature_cols].to_numpy(dtype=float),
+                                       group_codes(features_df[label_col], groups), len(groups))
+
+def feature_statistics(csv_path: str, feature_cols: list, label_col: str = 'label',
+                       groups: tuple = GROUPS, chunk_size: int = 100000,
+                       n_workers: int = 1) -> GroupStatistics:
+    '''
+    Accumulates the statistics of a features CSV in one pass over its store.
+    With several workers, each takes a contiguous range of rows and the results
+    are merged.
+
+    :param csv_path: Path to the features CSV
+    :type csv_path: str
+    :param feature_cols: Feature columns
+    :type feature_cols: list
+    :param label_col: Label column
+    :type label_col: str
+    :param groups: Labels of the groups, in order
+    :type groups: tuple
+    :param chunk_size: Number of rows per chunk
+    :type chunk_size: int
+    :param n_workers: Number of worker processes, all cores if None
+    :type n_workers: int
+    :returns: Statistics of all rows
+    :rtype: GroupStatistics
+    '''
+    summarize = partial(frame_statistics, feature_cols=feature_cols, label_col=label_col,
+                        groups=groups)
+    statistics = scan_features(csv_path, [label_col] + feature_cols, summarize, chunk_size,
+                               n_workers)
+    return GroupStatistics(len(feature_cols), len(groups)) if statistics is None else statistics
+
+def cholesky_factor(matrix: np.ndarray) -> np.ndarray:
+    '''
+    Lower Cholesky factor of a symmetric positive definite matrix.
+
+    :param matrix: Symmetric positive definite matrix
+    :type matrix: np.ndarray
+    :returns: Lower triangular L with L @ L.T == matrix
+    :rtype: np.ndarray
+    '''
+    return linalg.cholesky(matrix, lower=True)
+
+def cholesky_solve(matrix: np.ndarray, rhs: np.ndarray) -> np.ndarray:
+    '''
+    Solves matrix @ x = rhs through the Cholesky factorization of the matrix.
+
+    :param matrix: Symmetric positive definite matrix
+    :type matrix: np.ndarray
+    :param rhs: Right-hand side vector or matrix
+    :type rhs: np.ndarray
+    :returns: Solution x
+    :rtype: np.ndarray
+    '''
+    return linalg.cho_solve(linalg.cho_factor(matrix, lower=True), rhs)
+
+def whiten(X: np.ndarray, factor: np.ndarray, overwrite: bool = False) -> np.ndarray:
+    '''
+    Transforms rows x into L^-1 x for the lower Cholesky factor L of a
+    covariance matrix. Euclidean distances between whitened rows are
+    Mahalanobis distances under that covariance.
+
+    :param X: Rows of shape (n, n_features)
+    :type X: np.ndarray
+    :param factor: Lower Cholesky factor
+    :type factor: np.ndarray
+    :param overwrite: Whether X may be overwritten, which saves a copy of a
+        C-contiguous float64 X
+    :type overwrite: bool
+    :returns: Whitened rows
+    :rtype: np.ndarray
+    '''
+    return linalg.solve_triangular(factor, np.asarray(X).T, lower=True,
+                                   overwrite_b=overwrite).T
+
+def mean_difference(statistics: GroupStatistics) -> np.ndarray:
+    '''
+    Difference of the group means, group 0 minus group 1.
+
+    :param statistics: Two-group statistics
+    :type statistics: GroupStatistics
+    :returns: Mean difference per feature
+    :rtype: np.ndarray
+    '''
+    means = statistics.means
+    return means[0] - means[1]
+
+def mahalanobis_distance(statistics: GroupStatistics) -> float:
+    '''
+    Mahalanobis distance between the group centroids under the pooled
+    covariance.
+
+    :param statistics: Two-group statistics
+    :type statistics: GroupStatistics
+    :returns: Mahalanobis distance
+    :rtype: float
+    '''
+    diff = mean_difference(statistics)
+    return float(np.sqrt(diff @ cholesky_solve(statistics.pooled_covariance(), diff)))
+
+def mahalanobis_contributions(statistics: GroupStatistics) -> np.ndarray:
+    '''
+    Splits the squared Mahalanobis distance into per-feature terms
+    diff_j * (S^-1 diff)_j, which sum to the squared distance.
+
+    :param statistics: Two-group statistics
+    :type statistics: GroupStatistics
+    :returns: Contribution per feature
+    :rtype: np.ndarray
+    '''
+    diff = mean_difference(statistics)
+    return diff * cholesky_solve(statistics.pooled_covariance(), diff)
+
+def cohens_d(statistics: GroupStatistics) -> np.ndarray:
+    '''
+    Cohen's d of every feature, the mean difference over the pooled standard
+    deviation.
+
+    :param statistics: Two-group statistics
+    :type statistics: GroupStatistics
+    :returns: Cohen's d per feature
+    :rtype: np.ndarray
+    '''
+    return mean_difference(statistics) / np.sqrt(np.diag(statistics.pooled_covariance()))
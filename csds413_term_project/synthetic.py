@@ -0,0 +1,129 @@
+'''
+Synthetic TweepFake-like data for benchmarking.
+
+Raw tweets are assembled from a small vocabulary with the kinds of noise the
+cleaning step removes (URLs, mentions, hashtags, escaped newlines, emoji) and
+the kinds of rows the filters drop (HTML, mojibake, file paths). Bot tweets
+use more function words and fewer capitalized words than human ones, so the
+extracted features differ between the groups the way they do in the real data.
+Feature tables are drawn directly from per-group distributions. Everything is
+generated with numpy and seeded, so a given (n, seed) always gives the same
+data, and large tables can be generated chunk by chunk.
+
+:author: Jacob Anderson
+:version: 0.1.0
+'''
+
+from typing import Iterator
+import numpy as np
+import pandas as pd
+from csds413_term_project.feature_kernels import FEATURE_NAMES
+
+FUNCTION_WORDS = ['the', 'a', 'and', 'of', 'to', 'in', 'is', 'it', 'you', 'that', 'for',
+                  'on', 'with', 'was', 'at', 'be', 'this', 'my', 'we', 'are', 'not', 'but']
+CONTENT_WORDS = ['people', 'time', 'world', 'great', 'new', 'today', 'love', 'think', 'know',
+                 'really', 'game', 'music', 'news', 'video', 'night', 'work', 'story', 'thanks',
+                 'happy', 'climate', 'market', 'model', 'science', 'weekend', 'coffee', 'city']
+CAPITALIZED_WORDS = ['Trump', 'London', 'Monday', 'Apple', 'NASA', 'USA', 'COVID', 'iPhone',
+                     'McDonald', 'AMAZING', 'I', 'i', 'OMG', 'YouTube']
+PUNCTUATION = ['.', '!', '?', ',', '...', ':)', "don't", "it's", '-', '"']
+NOISE = ['https://t.co/abc123', '@someone', '#trending', '\\n', '\U0001F600', '<U+1F60A>']
+DROPPED = ['<a href="x">', 'Ã©', '/usr/local/bin', '&amp;']
+
+# Token table and per-group sampling weights of each token kind
+_TOKENS = np.array(FUNCTION_WORDS + CONTENT_WORDS + CAPITALIZED_WORDS + PUNCTUATION + NOISE + DROPPED,
+                   dtype=object)
+_KINDS = np.repeat(np.arange(6), [len(FUNCTION_WORDS), len(CONTENT_WORDS), len(CAPITALIZED_WORDS),
+                                  len(PUNCTUATION), len(NOISE), len(DROPPED)])
+_KIND_WEIGHTS = {
+    'human': np.array([0.30, 0.40, 0.14, 0.12, 0.035, 0.005]),
+    'bot': np.array([0.40, 0.38, 0.06, 0.12, 0.035, 0.005]),
+}
+
+def _token_weights(label: str) -> np.ndarray:
+    kind_weights = _KIND_WEIGHTS[label]
+    kind_sizes = np.bincount(_KINDS)
+    return kind_weights[_KINDS] / kind_sizes[_KINDS]
+
+def synthetic_raw_tweets(n: int, seed: int = None, bot_fraction: float = 0.5) -> pd.DataFrame:
+    '''
+    Generates raw tweets in the layout of the TweepFake CSV.
+
+    :param n: Number of tweets
+    :type n: int
+    :param seed: Random seed
+    :type seed: int
+    :param bot_fraction: Fraction of tweets labelled bot
+    :type bot_fraction: float
+    :returns: DataFrame with text and account.type columns
+    :rtype: pd.DataFrame
+    '''
+    rng = np.random.default_rng(seed)
+    is_bot = rng.random(n) < bot_fraction
+    lengths = rng.integers(3, 40, size=n)
+
+    # Every tweet draws its tokens from the table of its group
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    token_ids = np.empty(offsets[-1], dtype=np.int64)
+    tweet_is_bot = np.repeat(is_bot, lengths)
+    for label, mask in (('human', ~tweet_is_bot), ('bot', tweet_is_bot)):
+        token_ids[mask] = rng.choice(len(_TOKENS), size=int(mask.sum()), p=_token_weights(label))
+
+    tokens = _TOKENS[token_ids]
+    texts = [' '.join(tokens[start:stop]) for start, stop in zip(offsets[:-1], offsets[1:])]
+
+    return pd.DataFrame({'text': texts, 'account.type': np.where(is_bot, 'bot', 'human')})
+
+def iter_synthetic_raw_tweets(n: int, chunk_size: int = 100000,
+                              seed: int = None) -> Iterator[pd.DataFrame]:
+    '''
+    Generates raw tweets chunk by chunk, with a running index across chunks.
+
+    :param n: Total number of tweets
+    :type n: int
+    :param chunk_size: Tweets per chunk
+    :type chunk_size: int
+    :param seed: Random seed
+    :type seed: int
+    :returns: Iterator of DataFrames with text and account.type columns
+    :rtype: Iterator[pd.DataFrame]
+    '''
+    starts = range(0, n, chunk_size)
+    for start, seed_seq in zip(starts, np.random.SeedSequence(seed).spawn(len(starts))):
+        chunk = synthetic_raw_tweets(min(chunk_size, n - start), seed=seed_seq)
+        chunk.index += start
+        yield chunk
+
+def synthetic_features(n: int, seed: int = None, bot_fraction: float = 0.5,
+                       effect_size: float = 0.3) -> pd.DataFrame:
+    '''
+    Generates a feature table like the output of the feature extraction. Each
+    feature is normal within a group, with the bot mean shifted by effect_size
+    standard deviations, and clipped to its valid range.
+
+    :param n: Number of rows
+    :type n: int
+    :param seed: Random seed
+    :type seed: int
+    :param bot_fraction: Fraction of rows labelled bot
+    :type bot_fraction: float
+    :param effect_size: Shift of the bot means in standard deviations
+    :type effect_size: float
+    :returns: DataFrame with label and the five features
+    :rtype: pd.DataFrame
+    '''
+    rng = np.random.default_rng(seed)
+    is_bot = rng.random(n) < bot_fraction
+
+    # Human means and standard deviations of V, S, W, F and C
+    means = np.array([0.90, 12.0, 4.6, 0.35, 0.08])
+    stds = np.array([0.08, 6.0, 0.8, 0.12, 0.07])
+    lower = np.array([0.0, 1.0, 1.0, 0.0, 0.0])
+    upper = np.array([1.0, np.inf, np.inf, 1.0, 1.0])
+
+    shift = np.where(is_bot[:, None], effect_size * stds, 0.0)
+    values = np.clip(rng.normal(means + shift, stds), lower, upper)
+
+    features_df = pd.DataFrame(values, columns=FEATURE_NAMES)
+    features_df.insert(0, 'label', np.where(is_bot, 'bot', 'human'))
+    return features_df
@@ -0,0 +1,246 @@
+'''
+Single-pass tokenization for the feature extraction.
+
+Each tweet is split into sentences and words once, and the alphabetic words are
+kept in one flat list with the offset at which every sentence starts. All of the
+stylometric features (and any custom feature function) read from this structure
+instead of re-tokenizing the text.
+
+Two tokenizer backends produce this structure. The 'nltk' backend runs punkt
+and the Treebank word tokenizer. The 'regex' backend is a handful of
+precompiled patterns that reproduce the rules of those two tokenizers that can
+change the alphabetic words of a cleaned tweet. It needs no downloaded models,
+so workers without network access can use it.
+
+:author: Jacob Anderson
+:version: 0.1.0
+'''
+
+import re
+from typing import Callable, Iterator, NamedTuple
+from nltk.tokenize import word_tokenize, sent_tokenize
+
+class TokenizedTweet(NamedTuple):
+    '''
+    Alphabetic words of a tweet indexed by sentence. The words of sentence i are
+    words[sentence_starts[i]:sentence_starts[i + 1]]; sentences with no alphabetic
+    words are kept so that the sentence count matches the sentence tokenizer.
+    '''
+    words: list
+    sentence_starts: list
+
+    @property
+    def n_words(self) -> int:
+        return len(self.words)
+
+    @property
+    def n_sentences(self) -> int:
+        return len(self.sentence_starts)
+
+    def sentences(self) -> Iterator[list]:
+        '''
+        Iterates over the alphabetic words of each sentence.
+
+        :returns: Iterator of word lists, one per sentence
+        :rtype: Iterator[list]
+        '''
+        bounds = self.sentence_starts + [len(self.words)]
+        for start, stop in zip(bounds, bounds[1:]):
+            yield self.words[start:stop]
+
+    def sentence_start_flags(self) -> list:
+        '''
+        Flags the words that open a sentence.
+
+        :returns: List of booleans aligned with words
+        :rtype: list
+        '''
+        flags = [False] * len(self.words)
+        for start in self.sentence_starts:
+            if start < len(self.words):
+                flags[start] = True
+        return flags
+
+def tokenize_tweet(text: str) -> TokenizedTweet:
+    '''
+    Tokenizes a tweet into sentences and alphabetic words in one pass. This is
+    what word_tokenize does internally, but the sentence boundaries are kept
+    rather than thrown away.
+
+    :param text: Cleaned tweet text
+    :type text: str
+    :returns: Sentence-indexed alphabetic words
+    :rtype: TokenizedTweet
+    '''
+    words = []
+    sentence_starts = []
+
+    for sentence in sent_tokenize(text):
+        sentence_starts.append(len(words))
+        words.extend(token for token in word_tokenize(sentence, preserve_line=True)
+                     if token.isalpha())
+
+    return TokenizedTweet(words, sentence_starts)
+
+# Abbreviations that do not end a sentence, lower case and without the final
+# period (the punkt model keeps a trained list of these)
+ABBREVIATIONS = frozenset([
+    'mr', 'mrs', 'ms', 'dr', 'prof', 'sr', 'jr', 'st', 'mt', 'ft', 'vs', 'etc',
+    'e.g', 'i.e', 'cf', 'approx', 'dept', 'est', 'inc', 'ltd', 'co', 'corp',
+    'no', 'vol', 'gen', 'gov', 'sen', 'rep', 'pres', 'col', 'lt', 'sgt', 'capt',
+    'rev', 'u.s', 'u.k', 'u.n', 'a.m', 'p.m', 'jan', 'feb', 'mar', 'apr', 'jun',
+    'jul', 'aug', 'sep', 'sept', 'oct', 'nov', 'dec',
+])
+
+# Candidate sentence end: a whitespace-delimited chunk ending in . ? or !,
+# optionally followed by closing quotes or brackets, and then more text
+_SENTENCE_END = re.compile(r'(\S*?)([.?!])([)\]}"\'\u2019\u201d]*)\s+(?=(\S))')
+
+# Punkt splits a chunk into words at these characters
+_PUNKT_NON_WORD = re.compile(r'[)";}\]*:@\'({\[!?]')
+_NUMBER = re.compile(r'^-?[.,]?\d[\d,.-]*$')
+
+# Word tokenizer rules, in the order the Treebank tokenizer applies them
+_OPENING_QUOTE = re.compile(r'(^|[ (\[{<])(?:"|\'\')')
+_FINAL_PERIOD = re.compile(r'([^.])\.([\]\)}>"\'\u00bb\u201d\u2019 ]*)\s*$')
+_LEADING_QUOTE = re.compile(r"(?i)(?<!\w)'(?!(?:re|ve|ll|m|t|s|d|n)\b)(?=\w)")
+_COLON_COMMA = re.compile(r'([:,])(\D|$)')
+_QUOTE = re.compile(r"([^'])' ")
+_MULTI_CHAR = re.compile(r"\.{2,}|--|''")
+_CLITICS = (
+    re.compile(r"([^' ])('[sSmMdD]|')(?= )"),
+    re.compile(r"([^' ])('ll|'LL|'re|'RE|'ve|'VE|n't|N'T)(?= )"),
+)
+_CONTRACTIONS = (
+    re.compile(r"(?i)\b(can(?=not\b)|d(?='ye\b)|gim(?=me\b)|gon(?=na\b)|got(?=ta\b)"
+               r"|lem(?=me\b)|more(?='n\b)|wan(?=na\s))('?[a-z]+)"),
+    re.compile(r"(?i) ('t)(is|was)\b"),
+)
+
+# Characters the word tokenizer always splits off as separate tokens
+_SEPARATORS = str.maketrans(dict.fromkeys(
+    ';@#$%&?!*()[]{}<>"`\u00ab\u00bb\u201c\u201d\u2018\u2019\u201e'
+    '\u2012\u2013\u2014\u2015', ' '
+))
+
+def _ends_sentence(match: re.Match) -> bool:
+    '''
+    Decides whether a candidate sentence end is a sentence break, following the
+    punkt heuristics for abbreviations, initials, ellipses and numbers.
+    '''
+    if match.group(2) != '.':
+        return True
+
+    word = match.group(1)
+    next_upper = match.group(4).isupper()
+
+    # Ellipses only end a sentence before a capitalized word
+    if word.endswith('.'):
+        return next_upper
+
+    token = _PUNKT_NON_WORD.split(word)[-1].lower()
+    if token in ABBREVIATIONS or token.split('-')[-1] in ABBREVIATIONS:
+        return False
+
+    # Initials such as "J. Smith"
+    if len(token) == 1 and token.isalpha():
+        return False
+
+    # Ordinals and numbers only end a sentence before a capitalized word
+    if _NUMBER.match(token):
+        return not match.group(4).islower()
+
+    return True
+
+def split_sentences(text: str) -> list:
+    '''
+    Splits cleaned text into sentences with the regex backend.
+
+    :param text: Cleaned tweet text
+    :type text: str
+    :returns: List of sentences
+    :rtype: list
+    '''
+    text = text.strip()
+    if not text:
+        return []
+
+    sentences = []
+    start = 0
+    for match in _SENTENCE_END.finditer(text):
+        if _ends_sentence(match):
+            sentences.append(text[start:match.end(3)])
+            start = match.end()
+
+    sentences.append(text[start:])
+    return sentences
+
+def alphabetic_words(sentence: str) -> list:
+    '''
+    Returns the alphabetic words the Treebank word tokenizer would produce for a
+    sentence. Rules that only ever split off non-alphabetic tokens are reduced to
+    replacing the split characters with spaces.
+
+    :param sentence: A single sentence
+    :type sentence: str
+    :returns: List of alphabetic words
+    :rtype: list
+    '''
+    # Opening quotes are rewritten to `` before the final period is split off
+    if '"' in sentence or "''" in sentence:
+        sentence = _OPENING_QUOTE.sub(r'\1 `` ', sentence)
+
+    sentence = _FINAL_PERIOD.sub(r'\1 \2', sentence)
+    sentence = _LEADING_QUOTE.sub("' ", sentence)
+    sentence = _COLON_COMMA.sub(r' \1 \2', sentence)
+    sentence = _MULTI_CHAR.sub(' ', sentence.translate(_SEPARATORS))
+
+    if "'" in sentence:
+        sentence = _QUOTE.sub(r"\1 ' ", sentence)
+
+    sentence = ' ' + ' '.join(sentence.split()) + ' '
+    if "'" in sentence:
+        for pattern in _CLITICS:
+            sentence = pattern.sub(r'\1 \2', sentence)
+
+    for pattern in _CONTRACTIONS:
+        sentence = pattern.sub(r' \1 \2 ', sentence)
+    return [token for token in sentence.split() if token.isalpha()]
+
+def tokenize_tweet_regex(text: str) -> TokenizedTweet:
+    '''
+    Tokenizes a tweet like tokenize_tweet, using the precompiled regex backend
+    instead of NLTK.
+
+    :param text: Cleaned tweet text
+    :type text: str
+    :returns: Sentence-indexed alphabetic words
+    :rtype: TokenizedTweet
+    '''
+    words = []
+    sentence_starts = []
+
+    for sentence in split_sentences(text):
+        sentence_starts.append(len(words))
+        words.extend(alphabetic_words(sentence))
+
+    return TokenizedTweet(words, sentence_starts)
+
+# Tokenizer backends by name. A backend maps cleaned text to a TokenizedTweet.
+TOKENIZERS = {
+    'nltk': tokenize_tweet,
+    'regex': tokenize_tweet_regex,
+}
+
+def get_tokenizer(name: str) -> Callable[[str], TokenizedTweet]:
+    '''
+    Looks up a tokenizer backend by name.
+
+    :param name: Backend name, one of TOKENIZERS
+    :type name: str
+    :returns: Function mapping cleaned text to a TokenizedTweet
+    :rtype: Callable[[str], TokenizedTweet]
+    '''
+    if name not in TOKENIZERS:
+        raise ValueError(f"Unknown tokenizer '{name}', expected one of {sorted(TOKENIZERS)}")
+    return TOKENIZERS[name]